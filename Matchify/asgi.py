@@ -2,6 +2,9 @@
 ASGI config for Matchify project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the site through it (with any ASGI server) so async views such as the
+now-playing event stream (``/now-playing/stream``) don't hold a worker
+thread per open connection.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
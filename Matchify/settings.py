@@ -58,6 +58,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'Matchifyapp.middleware.TasteMemoMiddleware',
 ]
 
 
@@ -173,3 +174,12 @@ EMAIL_USE_TLS = True
 
 PASSWORD_RESET_TIMEOUT = 14400
 
+# Shared Spotify HTTP client (see Matchifyapp/spotify_client.py for all options)
+SPOTIFY_HTTP = {
+    'POOL_SIZE': 20,
+    'READ_TIMEOUT': 10,
+    'MAX_RETRIES': 3,
+    'RATE_PER_SECOND': 20,
+    'BURST': 40,
+}
+
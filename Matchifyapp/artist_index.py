@@ -0,0 +1,279 @@
+"""
+In-process prefix index of artist names for leaderboard autocomplete.
+
+Built from every artist in ``ArtistListen`` and users' indexed top artists
+(``TopItem``), so suggestions are served from memory without calling
+Spotify. Each artist is indexed under its full name and under every word
+onward ("the beatles", "beatles"), kept in one sorted list searched with
+bisect. Artists are ranked by how many users listen to them; the best TOP_K
+for every prefix up to PREFIX_LEN characters are ranked when the index is
+built, and longer (more selective) prefixes rank all their matches. On a miss
+the caller falls back to Spotify search and the results are added to the
+index.
+
+Names of top artists come from this process's interned profiles or the
+previous index; only artists new to both are looked up in stored profiles.
+A stale index keeps being served while its replacement is built in a
+background thread.
+"""
+
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+
+from .models import ArtistListen, TasteSnapshot, TopItem
+from .spotify_client import API_BASE, get_client
+from .taste_profile import artist_info
+
+logger = logging.getLogger(__name__)
+
+# Rebuild from the database after this long, to pick up newly synced artists.
+INDEX_TTL = getattr(settings, 'ARTIST_INDEX_TTL_SECONDS', 10 * 60)
+# Prefixes up to this many characters have their best TOP_K artists ranked up front.
+PREFIX_LEN = 3
+TOP_K = 20
+SPOTIFY_SEARCH_LIMIT = 5
+NAME_LOOKUP_BATCH = 1000
+
+
+def normalize(text):
+    """Case-fold, strip accents and collapse whitespace."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+
+def _keys(name):
+    words = normalize(name).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class ArtistIndex:
+    """Sorted (key, artist_id) list with names, listener counts and per-prefix top artists."""
+
+    def __init__(self):
+        self._names = {}
+        self._weights = Counter()
+        self._keys = []
+        self._top = {}  # prefix of up to PREFIX_LEN chars -> best TOP_K artist ids, best first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def _rank(self, artist_id):
+        return (-self._weights[artist_id], self._names[artist_id].casefold(), artist_id)
+
+    def add(self, artist_id, name, weight=1):
+        """Add an artist (or bump its weight if already indexed).
+
+        `search` reads without the lock, so lists are never changed in place:
+        updated copies are built and swapped in.
+        """
+        if not artist_id or not name:
+            return
+        with self._lock:
+            self._weights[artist_id] += weight
+            if artist_id in self._names:
+                return
+            self._names[artist_id] = name
+            keys = list(self._keys)
+            for key in _keys(name):
+                insort(keys, (key, artist_id))
+                for n in range(1, min(PREFIX_LEN, len(key)) + 1):
+                    top = self._top.get(key[:n], [])
+                    if artist_id not in top:
+                        self._top[key[:n]] = sorted(top + [artist_id], key=self._rank)[:TOP_K]
+            self._keys = keys
+
+    @classmethod
+    def build(cls, previous=None):
+        """Index every artist in ArtistListen and TopItem; names known to `previous` are reused."""
+        index = cls()
+        names = {}
+        weights = Counter()
+        listens = (
+            ArtistListen.objects.exclude(artist_id__isnull=True).exclude(artist_name__isnull=True)
+            .values('artist_id', 'artist_name').annotate(listeners=Count('user_id', distinct=True))
+        )
+        for row in listens.iterator():
+            names.setdefault(row['artist_id'], row['artist_name'])
+            weights[row['artist_id']] += row['listeners']
+        # One row per (user, time range) an artist is in the top list of
+        top_artists = (
+            TopItem.objects.filter(kind=TopItem.ARTIST)
+            .values('item_id').annotate(lists=Count('id'))
+        )
+        for row in top_artists.iterator():
+            weights[row['item_id']] += row['lists']
+
+        known = previous._names if previous is not None else {}
+        unnamed = []
+        for artist_id in weights:
+            if artist_id in names:
+                continue
+            name = known.get(artist_id) or (artist_info(artist_id) or (None,))[0]
+            if name:
+                names[artist_id] = name
+            else:
+                unnamed.append(artist_id)
+        names.update(_stored_names(unnamed))
+        # Artists only known from Spotify search results aren't in the database; keep them
+        for artist_id, name in known.items():
+            if artist_id not in names:
+                names[artist_id] = name
+                weights[artist_id] += previous._weights[artist_id]
+
+        # Bulk build: one sort instead of an insort per key
+        index._names = {aid: name for aid, name in names.items() if name}
+        index._weights = weights
+        index._keys = sorted((key, aid) for aid, name in index._names.items() for key in _keys(name))
+        prefixes = defaultdict(set)
+        for key, aid in index._keys:
+            for n in range(1, min(PREFIX_LEN, len(key)) + 1):
+                prefixes[key[:n]].add(aid)
+        index._top = {prefix: heapq.nsmallest(TOP_K, aids, key=index._rank) for prefix, aids in prefixes.items()}
+        return index
+
+    def artist_id_for(self, name):
+        """Id of the most listened-to artist named exactly `name` (ignoring case and accents), or None."""
+        wanted = normalize(name)
+        if not wanted:
+            return None
+        keys = self._keys
+        best = None
+        i = bisect_left(keys, (wanted, ''))
+        while i < len(keys) and keys[i][0] == wanted:
+            aid = keys[i][1]
+            # The key may be a later word of a longer name ("beatles" for "The Beatles")
+            if normalize(self._names[aid]) == wanted and (best is None or self._rank(aid) < self._rank(best)):
+                best = aid
+            i += 1
+        return best
+
+    def search(self, query, limit=10):
+        """Return up to `limit` [{'id', 'name'}] whose name (or a word onward) starts with `query`."""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        if len(prefix) <= PREFIX_LEN and limit <= TOP_K:
+            ranked = self._top.get(prefix, [])
+        else:
+            keys = self._keys
+            matches = set()
+            i = bisect_left(keys, (prefix, ''))
+            while i < len(keys) and keys[i][0].startswith(prefix):
+                matches.add(keys[i][1])
+                i += 1
+            ranked = sorted(matches, key=self._rank)
+        return [{'id': aid, 'name': self._names[aid]} for aid in ranked[:limit]]
+
+
+def _stored_names(artist_ids):
+    """{artist_id: name} for top artists this process hasn't seen, read from their listeners' stored profiles."""
+    from .taste_snapshots import profile_for
+
+    names = {}
+    for start in range(0, len(artist_ids), NAME_LOOKUP_BATCH):
+        batch = artist_ids[start:start + NAME_LOOKUP_BATCH]
+        holders = TopItem.objects.filter(kind=TopItem.ARTIST, item_id__in=batch).values('user_id')
+        wanted = set(batch)
+        snapshots = (TasteSnapshot.objects.filter(user_id__in=holders)
+                     .only('user_id', 'time_range', 'artists', 'tracks', 'profile', 'refreshed_at'))
+        for snapshot in snapshots.iterator():
+            profile = profile_for(snapshot)
+            for artist in profile.artist_dicts(profile.artists):
+                if artist['id'] in wanted and artist['name']:
+                    names[artist['id']] = artist['name']
+    return names
+
+
+_index = None
+_built_at = 0.0
+_build_lock = threading.Lock()
+
+
+def _rebuild():
+    """Build a new index and swap it in; call with `_build_lock` held."""
+    global _index, _built_at
+    started = time.monotonic()
+    _index = ArtistIndex.build(previous=_index)
+    _built_at = time.monotonic()
+    logger.info(f"Built artist index: {len(_index)} artists in {(_built_at - started) * 1000:.0f}ms")
+
+
+def _rebuild_in_background():
+    # Only one rebuild at a time; everyone else keeps using the current index
+    if not _build_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            _rebuild()
+        except Exception as e:
+            logger.error(f"Error rebuilding artist index: {e}")
+        finally:
+            _build_lock.release()
+            connection.close()
+
+    if getattr(settings, 'ARTIST_INDEX_REBUILD_ASYNC', True):
+        threading.Thread(target=run, name='artist-index-rebuild', daemon=True).start()
+    else:
+        try:
+            _rebuild()
+        finally:
+            _build_lock.release()
+
+
+def get_index():
+    """Return the process-wide ArtistIndex.
+
+    Only the first call builds it in the foreground. Once it is older than
+    INDEX_TTL it is rebuilt in a background thread, and the current one is
+    returned meanwhile.
+    """
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                _rebuild()
+    elif time.monotonic() - _built_at > INDEX_TTL:
+        _rebuild_in_background()
+    return _index
+
+
+def search_spotify(user, query, limit=SPOTIFY_SEARCH_LIMIT):
+    """Search Spotify for artists as `user`. Returns a list of Spotify artist objects (empty on failure)."""
+    from .views import get_auth_header
+
+    headers = get_auth_header(user)
+    if not headers:
+        return []
+    resp = get_client().get(API_BASE + 'search', headers=headers,
+                            params={'q': query, 'type': 'artist', 'limit': limit})
+    if resp.status_code != 200:
+        logger.info(f"Spotify artist search returned {resp.status_code}")
+        return []
+    return resp.json().get('artists', {}).get('items', [])
+
+
+def suggest_artists(user, query, limit=10):
+    """Autocomplete artist names from the local index, falling back to Spotify on a miss."""
+    index = get_index()
+    results = index.search(query, limit)
+    if results:
+        return results
+    # Spotify matches fuzzily, so return its results as-is rather than re-searching the index
+    results = []
+    for artist in search_spotify(user, query):
+        if artist.get('id') and artist.get('name'):
+            index.add(artist['id'], artist['name'])
+            results.append({'id': artist['id'], 'name': artist['name']})
+    return results[:limit]
@@ -0,0 +1,249 @@
+"""
+Vectorized batch compatibility scoring.
+
+`MusicMatchingAlgorithm` scores one pair of TasteProfiles at a time.
+`BatchScorer` encodes every user's music data once as sparse
+matrices and scores one user against many candidates (or every pair in a
+school) with sparse matrix products. The component scores are the same as the
+pairwise helpers, and `_finalize_block` applies `_finalize_result`'s
+calibration and breakdown scaling to a whole block of pairs with array
+operations, so callers get exactly the dicts `calculate_music_compatibility`
+would return.
+
+Encoding
+--------
+Artist and track compatibility weight a shared item by ``1/(i+1)`` (its rank
+in the scoring user's list) times ``1/(|i-j|+1)`` (the rank difference to the
+other user's list). Each user's ranked list is stored as a one-hot row over
+(item, rank) columns. For the scoring side each (item, i) entry is spread over
+all ranks j of the same item with weight ``kernel[i, j]``, so one sparse
+product sums the per-item terms for every candidate at once.
+"""
+
+import numpy as np
+from scipy import sparse
+
+from .compatibility import MusicMatchingAlgorithm
+from .score_calibration import calibrate_many
+from .taste_profile import TasteProfile, current_interners
+
+WEIGHTS = {'artist': 0.45, 'genre': 0.30, 'track': 0.25}
+BREAKDOWN_KEYS = ('artist_compatibility', 'genre_compatibility', 'track_compatibility')
+
+
+def _round1(values):
+    """Round an array to one decimal exactly as the builtin ``round(x, 1)`` rounds each element."""
+    scaled = np.asarray(values, dtype=np.float64) * 10.0
+    out = np.rint(scaled) / 10.0
+    # Near a half the scaled product may have rounded across it; let the builtin decide those
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for idx in zip(*np.nonzero(near_half)):
+        out[idx] = round(float(values[idx]), 1)
+    return out
+
+
+def _finalize_block(artist, genre, track, raw_total):
+    """(total_score, artist, genre, track) arrays of `_finalize_result` for a block of component scores.
+
+    Same steps as `_finalize_result`: components are rounded, the raw total is
+    calibrated (raw totals <= 0 as if they were 1), and the components are
+    scaled to sum to the shown total. When all components are 0 a positive
+    total keeps them, and a non-positive one is split by WEIGHTS.
+    """
+    parts = [_round1(artist), _round1(genre), _round1(track)]
+    positive = raw_total > 0
+    calibrated = calibrate_many(np.where(positive, raw_total, 1.0))
+    raw_sum = np.maximum(parts[0], 0.0) + np.maximum(parts[1], 0.0) + np.maximum(parts[2], 0.0)
+    # Rows with no breakdown to scale get a placeholder scale; their scaled parts aren't used
+    scale = calibrated / np.where(raw_sum > 0, raw_sum, 1.0)
+    out = []
+    for part, weight in zip(parts, (WEIGHTS['artist'], WEIGHTS['genre'], WEIGHTS['track'])):
+        scaled = _round1(np.maximum(part * scale, 0.0))
+        unscaled = np.where(positive, part, _round1(calibrated * weight))
+        out.append(np.where(raw_sum > 0, scaled, unscaled))
+    return (_round1(calibrated), *out)
+
+
+def _rank_kernel(max_rank):
+    """kernel[i, j] = 1/(i+1) * 1/(|i-j|+1) for ranks 0..max_rank-1."""
+    ranks = np.arange(max_rank)
+    return (1.0 / (ranks + 1))[:, None] / (np.abs(ranks[:, None] - ranks[None, :]) + 1)
+
+
+class _RankedItems:
+    """Sparse (item, rank) encoding of each user's ranked list of interned ids (negative = no id)."""
+
+    def __init__(self, id_lists):
+        vocab = {}
+        rows, items, ranks = [], [], []
+        lengths = np.zeros(len(id_lists), dtype=np.int64)
+        for row, ids in enumerate(id_lists):
+            lengths[row] = len(ids)
+            seen = set()
+            for rank, item_id in enumerate(ids):
+                if item_id < 0 or item_id in seen:
+                    continue
+                seen.add(item_id)
+                rows.append(row)
+                items.append(vocab.setdefault(item_id, len(vocab)))
+                ranks.append(rank)
+
+        self.max_rank = max(int(lengths.max()) if len(lengths) else 0, 1)
+        self.n_columns = max(len(vocab), 1) * self.max_rank
+        self.kernel = _rank_kernel(self.max_rank)
+        # Sum of 1/(i+1) over every position in the list: the best possible score
+        harmonic = np.concatenate([[0.0], np.cumsum(1.0 / np.arange(1, self.max_rank + 1))])
+        self.denominator = harmonic[lengths]
+
+        columns = np.asarray(items, dtype=np.int64) * self.max_rank + np.asarray(ranks, dtype=np.int64)
+        self.placement = sparse.csr_matrix(
+            (np.ones(len(columns)), (np.asarray(rows, dtype=np.int64), columns)),
+            shape=(len(id_lists), self.n_columns)
+        )
+        # Kept transposed in CSR so products against all users don't re-slice per call
+        self._placement_t = self.placement.T.tocsr()
+
+    def _expanded(self, query_rows):
+        """Query rows with every (item, i) spread to (item, j) with weight kernel[i, j]."""
+        sub = self.placement[query_rows]
+        row_of_entry = np.repeat(np.arange(sub.shape[0]), np.diff(sub.indptr))
+        item_base = (sub.indices // self.max_rank) * self.max_rank
+        rank = sub.indices % self.max_rank
+        columns = item_base[:, None] + np.arange(self.max_rank)[None, :]
+        return sparse.csr_matrix(
+            (self.kernel[rank].ravel(), (np.repeat(row_of_entry, self.max_rank), columns.ravel())),
+            shape=(sub.shape[0], self.n_columns)
+        )
+
+    def scores(self, query_rows, target_rows):
+        """0-100 scores of each query row against each target row (dense array)."""
+        numer = (self._expanded(query_rows) @ self._placement_t).toarray()[:, target_rows]
+        denom = self.denominator[query_rows][:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out = np.where(denom > 0, numer / denom * 100.0, 0.0)
+        return np.minimum(out, 100.0)
+
+
+class _GenreSets:
+    """Binary user x genre matrix for Jaccard-based genre compatibility."""
+
+    def __init__(self, genre_lists):
+        vocab = {}
+        rows, cols = [], []
+        for row, genres in enumerate(genre_lists):
+            for genre in set(genres):
+                rows.append(row)
+                cols.append(vocab.setdefault(genre, len(vocab)))
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(cols)), (rows, cols)), shape=(len(genre_lists), max(len(vocab), 1))
+        )
+        self.sizes = np.asarray(self.matrix.sum(axis=1)).ravel()
+        self._matrix_t = self.matrix.T.tocsr()
+
+    def scores(self, query_rows, target_rows):
+        inter = (self.matrix[query_rows] @ self._matrix_t).toarray()[:, target_rows]
+        size_q = self.sizes[query_rows][:, None]
+        size_t = self.sizes[target_rows][None, :]
+        union = size_q + size_t - inter
+        with np.errstate(divide='ignore', invalid='ignore'):
+            jaccard = np.where(union > 0, inter / union, 0.0)
+        # The frequency-weighted term of the pairwise helper is 1 whenever any genre is shared
+        out = (jaccard * 0.6 + (inter > 0) * 0.4) * 100.0
+        out = np.where((size_q > 0) & (size_t > 0), out, 0.0)
+        return np.minimum(out, 100.0)
+
+
+class BatchScorer:
+    """Score many users at once from their music data.
+
+    Args:
+        data_by_user: {user_id: TasteProfile} as returned by
+            `taste_snapshots.get_user_music_data` (music data dicts are converted).
+    """
+
+    def __init__(self, data_by_user):
+        self.algorithm = MusicMatchingAlgorithm()
+        # The scorers compare codes across users, so every profile must use the same interners
+        interners = current_interners()
+        self.data = {user_id: TasteProfile.coerce(data).recode(interners) for user_id, data in data_by_user.items()}
+        self.user_ids = list(self.data)
+        self.row_of = {user_id: row for row, user_id in enumerate(self.user_ids)}
+        profiles = [self.data[u] for u in self.user_ids]
+        self._artists = _RankedItems([p.artists.tolist() for p in profiles])
+        self._tracks = _RankedItems([p.tracks.tolist() for p in profiles])
+        self._genres = _GenreSets([p.genres.tolist() for p in profiles])
+
+    def component_scores(self, query_ids, target_ids):
+        """Return (artist, genre, track, raw_total) arrays of shape (len(query_ids), len(target_ids))."""
+        q = np.asarray([self.row_of[u] for u in query_ids], dtype=np.int64)
+        t = np.asarray([self.row_of[u] for u in target_ids], dtype=np.int64)
+        artist = self._artists.scores(q, t)
+        genre = self._genres.scores(q, t)
+        track = self._tracks.scores(q, t)
+        raw_total = artist * WEIGHTS['artist'] + genre * WEIGHTS['genre'] + track * WEIGHTS['track']
+        return artist, genre, track, raw_total
+
+    def _results(self, pairs, artist, genre, track, raw_total, include_common):
+        """Result dicts for `pairs` [(a_id, b_id)], given their component score arrays (1-D, same order)."""
+        totals, *breakdowns = (values.tolist() for values in _finalize_block(artist, genre, track, raw_total))
+        results = []
+        for (a_id, b_id), total, *components in zip(pairs, totals, *breakdowns):
+            if include_common:
+                d1, d2 = self.data[a_id], self.data[b_id]
+                common = (self.algorithm._get_common_artists(d1, d2),
+                          self.algorithm._get_common_genres(d1, d2),
+                          self.algorithm._get_common_tracks(d1, d2))
+            else:
+                common = ([], [], [])
+            results.append({
+                'total_score': total,
+                'breakdown': dict(zip(BREAKDOWN_KEYS, components)),
+                'common_artists': common[0],
+                'common_genres': common[1],
+                'common_tracks': common[2]
+            })
+        return results
+
+    def iter_pair_scores(self, query_ids=None, target_ids=None, block_size=256, include_common=False):
+        """Yield (user_a_id, user_b_id, raw_total, result) for every query x target pair.
+
+        Defaults to all pairs. Query users are processed in blocks so memory stays
+        at O(block_size * len(target_ids)).
+        """
+        query_ids = list(self.user_ids if query_ids is None else query_ids)
+        target_ids = list(self.user_ids if target_ids is None else target_ids)
+        if not query_ids or not target_ids:
+            return
+        targets = np.asarray(target_ids, dtype=object)
+        for start in range(0, len(query_ids), block_size):
+            block = query_ids[start:start + block_size]
+            artist, genre, track, raw_total = self.component_scores(block, target_ids)
+            # Every pair in the block except a user with themselves, finalized together
+            keep = np.asarray(block, dtype=object)[:, None] != targets[None, :]
+            rows, cols = np.nonzero(keep)
+            pairs = [(block[i], target_ids[j]) for i, j in zip(rows.tolist(), cols.tolist())]
+            raw = raw_total[rows, cols]
+            results = self._results(pairs, artist[rows, cols], genre[rows, cols], track[rows, cols], raw,
+                                    include_common)
+            for (a_id, b_id), raw_score, result in zip(pairs, raw.tolist(), results):
+                yield a_id, b_id, raw_score, result
+
+    def score_candidates(self, user_id, candidate_ids=None, limit=None, include_common=True):
+        """Score one user against candidates; returns [(candidate_id, result)] best first.
+
+        With `limit` only the best `limit` candidates (by raw score, which the
+        calibration preserves in order) are finalized, which is what match lists need.
+        """
+        candidate_ids = [c for c in (self.user_ids if candidate_ids is None else candidate_ids) if c != user_id]
+        if not candidate_ids:
+            return []
+        artist, genre, track, raw_total = self.component_scores([user_id], candidate_ids)
+        order = np.argsort(-raw_total[0], kind='stable')
+        if limit is not None:
+            order = order[:limit]
+        chosen = [candidate_ids[j] for j in order.tolist()]
+        results = self._results([(user_id, c) for c in chosen], artist[0, order], genre[0, order],
+                                track[0, order], raw_total[0, order], include_common)
+        scored = list(zip(chosen, results))
+        scored.sort(key=lambda x: x[1]['total_score'], reverse=True)
+        return scored
@@ -0,0 +1,180 @@
+"""
+Precomputed pairwise compatibility scores.
+
+`MusicCompatibility` holds one row per (user_a, user_b, time_range) so match
+lists, swipe cards and profile pages can read a score with a single indexed
+query instead of scoring users on every request. The table is rebuilt in bulk
+by the `rebuild_compatibility` management command, which only recomputes rows
+touching users whose taste snapshot changed since they were last scored, and
+then only against the users sharing an artist, track or rare genre with them
+(see `item_index.candidate_ids`), or in embedding mode against their nearest
+neighbours in taste-embedding space (see `taste_embeddings`). Pairs that are
+never candidates have no stored row.
+"""
+
+from itertools import chain
+import logging
+
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .batch_scoring import BatchScorer
+from .compatibility import MusicMatchingAlgorithm
+from .item_index import candidate_ids
+from .taste_embeddings import embedding_matching_enabled, similar_users
+from .models import MusicCompatibility, TasteSnapshot
+from .taste_snapshots import get_user_music_data, load_profiles
+
+logger = logging.getLogger(__name__)
+
+UPDATE_FIELDS = ['total_score', 'raw_score', 'breakdown', 'computed_at']
+
+
+def _make_row(user_a_id, user_b_id, time_range, raw_score, result, computed_at):
+    return MusicCompatibility(
+        user_a_id=user_a_id,
+        user_b_id=user_b_id,
+        time_range=time_range,
+        total_score=result['total_score'],
+        raw_score=round(float(raw_score), 3),
+        breakdown=result['breakdown'],
+        computed_at=computed_at,
+    )
+
+
+def _write_rows(rows):
+    """Upsert a batch of MusicCompatibility rows in one statement."""
+    if not rows:
+        return
+    MusicCompatibility.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['user_a', 'user_b', 'time_range'],
+        update_fields=UPDATE_FIELDS,
+    )
+
+
+def get_compatibility(user_a, user_b, time_range='long_term'):
+    """Return user_a's compatibility with user_b, preferring the stored score.
+
+    On a miss the pair is scored from the users' taste snapshots and written
+    back so the next lookup is a single indexed read. If either user has no
+    snapshot the live algorithm (with its ranking fallback) is used instead and
+    nothing is stored.
+    """
+    row = MusicCompatibility.objects.filter(user_a=user_a, user_b=user_b, time_range=time_range).first()
+    if row is not None:
+        return row.as_result()
+
+    algorithm = MusicMatchingAlgorithm()
+    data_a = get_user_music_data(user_a, time_range)
+    data_b = get_user_music_data(user_b, time_range) if data_a else None
+    if not (data_a and data_b):
+        return algorithm.calculate_music_compatibility(user_a, user_b, time_range)
+
+    try:
+        raw_score, result = algorithm.score_music_data(data_a, data_b)
+        _write_rows([_make_row(user_a.id, user_b.id, time_range, raw_score, result, timezone.now())])
+        return result
+    except Exception as e:
+        logger.error(f"Error storing compatibility for {user_a.id}->{user_b.id}: {e}")
+        return None
+
+
+def changed_user_ids(time_range):
+    """Users whose snapshot is newer than their oldest stored score (or who have none)."""
+    oldest_score = (MusicCompatibility.objects
+                    .filter(user_a=OuterRef('user'), time_range=time_range)
+                    .order_by('computed_at')
+                    .values('computed_at')[:1])
+    return set(TasteSnapshot.objects
+               .filter(time_range=time_range)
+               .annotate(oldest_score=Subquery(oldest_score))
+               .filter(Q(oldest_score__isnull=True) | Q(refreshed_at__gt=F('oldest_score')))
+               .values_list('user_id', flat=True))
+
+
+def match_candidates(user_id, time_range):
+    """Ids of the users worth scoring against `user_id`.
+
+    In embedding mode (TASTE_EMBEDDING_MATCHING) that is the user's nearest
+    neighbours by taste embedding, when they have one; otherwise everyone
+    sharing an artist, track or rare genre with them.
+    """
+    if embedding_matching_enabled():
+        neighbours = similar_users(user_id, time_range)
+        if neighbours is not None:
+            return set(neighbours)
+    return candidate_ids(user_id, time_range)
+
+
+def _write_pairs(pairs, time_range, computed_at, batch_size):
+    rows = []
+    written = 0
+    for a, b, raw_score, result in pairs:
+        rows.append(_make_row(a, b, time_range, raw_score, result, computed_at))
+        if len(rows) >= batch_size:
+            _write_rows(rows)
+            written += len(rows)
+            rows = []
+    _write_rows(rows)
+    return written + len(rows)
+
+
+def rebuild_compatibility(time_range='long_term', full=False, batch_size=1000):
+    """Recompute stored compatibility rows from taste snapshots (no Spotify calls).
+
+    With `full` every pair is rescored and every row not written by the run
+    (e.g. for users who no longer have a snapshot) is deleted. Otherwise only
+    users returned by `changed_user_ids` are rescored, each against its
+    `match_candidates`, and every scored pair is written in both directions;
+    their rows for pairs that are no longer candidates are deleted. Scoring
+    runs through `BatchScorer`. Returns a dict of counters for reporting.
+    """
+    now = timezone.now()
+    stale = MusicCompatibility.objects.filter(time_range=time_range, computed_at__lt=now)
+    if full:
+        data = load_profiles(time_range)
+        written = _write_pairs(BatchScorer(data).iter_pair_scores(), time_range, now, batch_size) if data else 0
+        deleted, _ = stale.delete()
+        return {'users': len(data), 'changed_users': len(data), 'rows_written': written, 'rows_deleted': deleted}
+
+    changed = changed_user_ids(time_range)
+    candidates = {user_id: match_candidates(user_id, time_range) for user_id in changed}
+    # Only the changed users and their candidates are loaded, not the whole school
+    data = load_profiles(time_range, changed.union(*candidates.values()))
+    changed &= set(data)
+    if not changed:
+        return {'users': len(data), 'changed_users': 0, 'rows_written': 0, 'rows_deleted': 0}
+
+    scorer = BatchScorer(data)
+    changed_ids = [u for u in scorer.user_ids if u in changed]
+    # Both directions of every (changed user, candidate) pair; candidate lists needn't be symmetric
+    targets_of = {}
+    for user_id in changed_ids:
+        for target in candidates[user_id]:
+            if target in scorer.row_of and target != user_id:
+                targets_of.setdefault(user_id, set()).add(target)
+                targets_of.setdefault(target, set()).add(user_id)
+    pairs = chain.from_iterable(
+        scorer.iter_pair_scores([user_id], sorted(targets_of[user_id]))
+        for user_id in scorer.user_ids if user_id in targets_of
+    )
+    written = _write_pairs(pairs, time_range, now, batch_size)
+    deleted, _ = stale.filter(Q(user_a_id__in=changed_ids) | Q(user_b_id__in=changed_ids)).delete()
+    return {'users': len(data), 'changed_users': len(changed), 'rows_written': written, 'rows_deleted': deleted}
+
+
+def score_user(user, time_range='long_term'):
+    """Score `user` against their `match_candidates` and store the rows.
+
+    For users with no stored scores yet (e.g. new since the last rebuild), so
+    match search doesn't wait for the next run. Returns the number of rows written.
+    """
+    candidates = match_candidates(user.pk, time_range)
+    data = load_profiles(time_range, candidates | {user.pk})
+    if user.pk not in data:
+        return 0
+    scorer = BatchScorer(data)
+    targets = [u for u in scorer.user_ids if u != user.pk]
+    return _write_pairs(scorer.iter_pair_scores([user.pk], targets), time_range, timezone.now(), 1000)
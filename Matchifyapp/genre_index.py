@@ -0,0 +1,135 @@
+"""
+Genre vocabulary and genre -> listeners inverted index.
+
+Spotify genres are free strings. Each distinct name gets a ``Genre`` row and
+a user's genres (the number of their top artists carrying each one) are kept
+as ``UserGenre`` rows, written whenever their taste snapshot is refreshed.
+Looked up by genre, the same table answers "who else listens to this?", which
+swipe candidate generation uses to find users sharing the owner's rarest
+genres without scoring everyone. The number of users with any genre (the
+IDF denominator) is counted once per USER_COUNT_TTL per process.
+"""
+
+from collections import Counter
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Genre, TasteSnapshot, UserGenre
+
+# How many of a user's rarest genres are followed when looking for neighbours
+RARE_GENRES = getattr(settings, 'GENRE_INDEX_RARE_GENRES', 10)
+# How long this process reuses its count of users with a genre vector
+USER_COUNT_TTL = getattr(settings, 'GENRE_INDEX_USER_COUNT_TTL_SECONDS', 10 * 60)
+
+_user_counts = {}  # time_range -> (counted_monotonic, users)
+_user_counts_lock = threading.Lock()
+
+
+def genre_ids(names):
+    """Return {name: Genre id} for `names`, adding unknown genres to the vocabulary."""
+    names = {name for name in names if name}
+    if not names:
+        return {}
+    Genre.objects.bulk_create([Genre(name=name) for name in names], ignore_conflicts=True)
+    return dict(Genre.objects.filter(name__in=names).values_list('name', 'id'))
+
+
+def _rows(user_id, time_range, genre_counts, ids):
+    counts = Counter()
+    for g in genre_counts:
+        if g.get('genre') in ids:
+            counts[ids[g['genre']]] += g.get('count') or 0
+    return [UserGenre(user_id=user_id, time_range=time_range, genre_id=genre_id, count=count)
+            for genre_id, count in counts.items()]
+
+
+def store_user_genres(user_id, time_range, genre_counts):
+    """Replace a user's genre vector for `time_range` with `genre_counts` ([{'genre', 'count'}])."""
+    ids = genre_ids(g.get('genre') for g in genre_counts)
+    with transaction.atomic():
+        UserGenre.objects.filter(user_id=user_id, time_range=time_range).delete()
+        UserGenre.objects.bulk_create(_rows(user_id, time_range, genre_counts, ids))
+
+
+def user_count(time_range):
+    """Number of users with a genre vector for `time_range`, recounted after USER_COUNT_TTL."""
+    entry = _user_counts.get(time_range)
+    if entry is None or time.monotonic() - entry[0] > USER_COUNT_TTL:
+        with _user_counts_lock:
+            entry = _user_counts.get(time_range)
+            if entry is None or time.monotonic() - entry[0] > USER_COUNT_TTL:
+                users = UserGenre.objects.filter(time_range=time_range).values('user_id').distinct().count()
+                entry = _user_counts[time_range] = (time.monotonic(), users)
+    return entry[1]
+
+
+def clear_user_counts():
+    _user_counts.clear()
+
+
+def index_snapshots(time_range=None, batch_size=500):
+    """Rebuild UserGenre from every stored taste snapshot. Returns (users, rows) written."""
+    snapshots = TasteSnapshot.objects.all()
+    if time_range:
+        snapshots = snapshots.filter(time_range=time_range)
+    snapshots = snapshots.values_list('user_id', 'time_range', 'genres')
+
+    ids = genre_ids(g.get('genre') for _, _, genres in snapshots.iterator() for g in genres or [])
+    users = written = 0
+    batch = []
+
+    def flush():
+        nonlocal written
+        users_by_range = {}
+        for row in batch:
+            users_by_range.setdefault(row.time_range, set()).add(row.user_id)
+        with transaction.atomic():
+            for range_, user_ids in users_by_range.items():
+                UserGenre.objects.filter(time_range=range_, user_id__in=user_ids).delete()
+            UserGenre.objects.bulk_create(batch)
+        written += len(batch)
+
+    for user_id, range_, genres in snapshots.iterator():
+        users += 1
+        batch.extend(_rows(user_id, range_, genres or [], ids))
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    clear_user_counts()
+    return users, written
+
+
+def genre_neighbours(user, time_range, limit=50):
+    """Users who share `user`'s rarest genres, as [(user_id, similarity)] best first.
+
+    Only the user's RARE_GENRES least common genres are followed through the
+    index. Each shared genre counts its smoothed inverse document frequency,
+    log(1 + N/df), which stays positive even when the cached user count N
+    lags behind the live listener counts; similarity is the share of the
+    best possible total (0-1].
+    """
+    mine = list(UserGenre.objects.filter(user=user, time_range=time_range).values_list('genre_id', flat=True))
+    if not mine:
+        return []
+    listeners = dict(
+        UserGenre.objects.filter(time_range=time_range, genre_id__in=mine)
+        .values('genre_id').annotate(n=Count('id')).values_list('genre_id', 'n')
+    )
+    total_users = user_count(time_range)
+    rare = sorted(mine, key=lambda genre_id: (listeners.get(genre_id, 0), genre_id))[:RARE_GENRES]
+    idf = {genre_id: math.log(1 + total_users / listeners.get(genre_id, 1)) for genre_id in rare}
+    best = sum(idf.values())
+
+    scores = Counter()
+    shared = (UserGenre.objects.filter(time_range=time_range, genre_id__in=rare)
+              .exclude(user=user).values_list('user_id', 'genre_id'))
+    for user_id, genre_id in shared.iterator():
+        scores[user_id] += idf[genre_id]
+    return [(user_id, score / best) for user_id, score in scores.most_common(limit)]
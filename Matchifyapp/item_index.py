@@ -0,0 +1,73 @@
+"""
+Inverted index from top artists and tracks to the users who have them.
+
+Each saved taste snapshot rewrites the user's ``TopItem`` rows (their top
+TOP_N artists and tracks). ``candidate_ids`` then finds everyone sharing at
+least one of a user's artists or tracks, or one of their rarest genres (via
+``genre_index``), with a few index lookups. Match search and the incremental
+compatibility rebuild score only those candidates instead of every user.
+"""
+
+from django.conf import settings
+from django.db import transaction
+
+from .genre_index import genre_neighbours
+from .models import TasteSnapshot, TopItem
+
+# How many of a user's top artists and tracks are indexed
+TOP_N = getattr(settings, 'ITEM_INDEX_TOP_N', 50)
+# Cap on users gathered through shared genres (artist/track sharers are never capped)
+MAX_GENRE_CANDIDATES = getattr(settings, 'ITEM_INDEX_MAX_GENRE_CANDIDATES', 1000)
+
+
+def _rows(user_id, time_range, profile):
+    rows = []
+    for kind, ids in ((TopItem.ARTIST, profile.artist_ids()), (TopItem.TRACK, profile.track_ids())):
+        seen = set()
+        for rank, item_id in enumerate(ids[:TOP_N], start=1):
+            if item_id and item_id not in seen:
+                seen.add(item_id)
+                rows.append(TopItem(user_id=user_id, time_range=time_range, kind=kind, item_id=item_id, rank=rank))
+    return rows
+
+
+def store_top_items(user_id, time_range, profile):
+    """Replace a user's indexed top artists and tracks for `time_range` with those of `profile`.
+
+    Returns the number of rows written.
+    """
+    rows = _rows(user_id, time_range, profile)
+    with transaction.atomic():
+        TopItem.objects.filter(user_id=user_id, time_range=time_range).delete()
+        TopItem.objects.bulk_create(rows)
+    return len(rows)
+
+
+def index_snapshots(time_range=None, batch_size=500):
+    """Rebuild TopItem from every stored taste snapshot. Returns (users, rows) written."""
+    from .taste_snapshots import profile_for
+
+    snapshots = TasteSnapshot.objects.only('user_id', 'time_range', 'artists', 'tracks', 'profile', 'refreshed_at')
+    if time_range:
+        snapshots = snapshots.filter(time_range=time_range)
+    users = written = 0
+    for snapshot in snapshots.iterator(chunk_size=batch_size):
+        written += store_top_items(snapshot.user_id, snapshot.time_range, profile_for(snapshot))
+        users += 1
+    return users, written
+
+
+def candidate_ids(user_id, time_range):
+    """Ids of users who share a top artist or track, or one of the rarest genres, with `user_id`."""
+    candidates = set()
+    mine = TopItem.objects.filter(user_id=user_id, time_range=time_range)
+    for kind in (TopItem.ARTIST, TopItem.TRACK):
+        candidates.update(
+            TopItem.objects
+            .filter(kind=kind, time_range=time_range, item_id__in=mine.filter(kind=kind).values('item_id'))
+            .values_list('user_id', flat=True)
+            .distinct()
+        )
+    candidates.update(uid for uid, _ in genre_neighbours(user_id, time_range, limit=MAX_GENRE_CANDIDATES))
+    candidates.discard(user_id)
+    return candidates
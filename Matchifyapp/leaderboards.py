@@ -0,0 +1,114 @@
+"""
+Per-school artist leaderboards.
+
+Rankings are materialized into ``LeaderboardEntry`` by `refresh_leaderboards`
+(run by the `refresh_leaderboards` command and after every `sync_artist_plays`
+run) so the leaderboard page and JSON endpoint only read one page of ranks.
+"""
+
+from django.db import transaction
+from django.db.models import CharField, F, Subquery, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from .artist_index import get_index
+from .models import ArtistListen, LeaderboardEntry, Profile, school_domain_for_email
+
+# Ranks stored per (school, artist); pages beyond this are empty.
+MAX_RANK = 100
+ALL_USERS = ''  # school_domain of the board over every user
+
+
+def _ranked_listens(partition_by_school, max_rank):
+    """ArtistListen rows numbered per artist (and school), best listeners first, up to max_rank."""
+    listens = ArtistListen.objects.filter(user__is_active=True, play_count__gt=0, artist_id__isnull=False)
+    partition_by = [F('artist_id')]
+    school = Value(ALL_USERS, output_field=CharField())
+    if partition_by_school:
+        listens = listens.filter(user__profile__school_domain__gt='')
+        school = F('user__profile__school_domain')
+        partition_by.insert(0, school)
+    return (
+        listens
+        .annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=partition_by,
+                order_by=[F('play_count').desc(), F('total_ms').desc(), F('user_id').asc()],
+            ),
+            school=school,
+        )
+        .filter(position__lte=max_rank)
+        .values_list('school', 'artist_id', 'artist_name', 'position', 'user_id', 'play_count', 'total_ms')
+    )
+
+
+def refresh_leaderboards(max_rank=MAX_RANK, batch_size=2000):
+    """Rebuild every school's leaderboards (and the all-users board) from ArtistListen.
+
+    The table is replaced in one transaction, so readers keep seeing the
+    previous rankings until the new ones are committed. Returns the number of
+    entries written.
+    """
+    written = 0
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+        for partition_by_school in (True, False):
+            batch = []
+            for school, artist_id, artist_name, position, user_id, plays, total_ms in \
+                    _ranked_listens(partition_by_school, max_rank).iterator(chunk_size=batch_size):
+                batch.append(LeaderboardEntry(
+                    school_domain=school,
+                    artist_id=artist_id,
+                    artist_name=artist_name or '',
+                    rank=position,
+                    user_id=user_id,
+                    score=plays,
+                    total_ms=total_ms or 0,
+                ))
+                if len(batch) >= batch_size:
+                    LeaderboardEntry.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            LeaderboardEntry.objects.bulk_create(batch)
+            written += len(batch)
+    return written
+
+
+def get_leaderboard(user, artist_id=None, artist_name=None, limit=10, offset=0):
+    """Return ranks offset+1..offset+limit of an artist's leaderboard in `user`'s school.
+
+    The school is the ``Profile.school_domain`` the boards were built from
+    (the email domain only if the user has no profile); users without one
+    see the board over all users. An artist name is resolved to its id
+    through the in-memory artist index. One indexed query on
+    (school_domain, artist_id, rank).
+    """
+    if not artist_id and artist_name:
+        artist_id = get_index().artist_id_for(artist_name)
+    if not artist_id:
+        return []
+    school_domain = Coalesce(
+        Subquery(Profile.objects.filter(user_id=user.pk).values('school_domain')[:1]),
+        Value(school_domain_for_email(user.email) or ALL_USERS),
+        output_field=CharField(),
+    )
+
+    entries = LeaderboardEntry.objects.filter(school_domain=school_domain, artist_id=artist_id)
+
+    rows = (
+        entries
+        .filter(rank__gt=offset, rank__lte=offset + limit)
+        .order_by('rank')
+        .values_list('rank', 'user__username', 'score', 'total_ms')
+    )
+    return [
+        {
+            'rank': rank,
+            'username': username,
+            'score': score,
+            'play_count': score,
+            'listens': score,
+            'minutes': int((total_ms or 0) / 60000),
+        }
+        for rank, username, score, total_ms in rows
+    ]
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from ...taste_embeddings import DIMENSIONS, build_embeddings
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compute taste embeddings (truncated SVD of user x artist/genre weights) for nearest-neighbour match search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--time-range', default='long_term',
+                            choices=['short_term', 'medium_term', 'long_term'])
+        parser.add_argument('--dimensions', type=int, default=DIMENSIONS,
+                            help='Embedding size')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stored = build_embeddings(time_range=options['time_range'], dimensions=options['dimensions'])
+        self.stdout.write(f"Stored {stored} taste embeddings ({options['time_range']}) in {time.monotonic() - started:.1f}s")
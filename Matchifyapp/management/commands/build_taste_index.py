@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from ... import genre_index, item_index
+import time
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the genre and top artist/track indexes (UserGenre, TopItem) from stored taste snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--time-range', default=None,
+                            help='Only index snapshots for this time range (default: all)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows (genres) or snapshots (top items) handled per batch')
+
+    def handle(self, *args, **options):
+        for name, index in (('genre counts', genre_index), ('top items', item_index)):
+            started = time.monotonic()
+            users, rows = index.index_snapshots(time_range=options['time_range'], batch_size=options['batch_size'])
+            self.stdout.write(f"Indexed {rows} {name} for {users} snapshots in {time.monotonic() - started:.1f}s")
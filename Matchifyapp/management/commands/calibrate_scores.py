@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from ...score_calibration import QUANTILES, SAMPLE_SIZE, build_calibration, recalibrate_stored
+import time
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the raw -> shown compatibility score calibration from a sample of stored scores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample-size', type=int, default=SAMPLE_SIZE,
+                            help='Raw scores to sample')
+        parser.add_argument('--quantiles', type=int, default=QUANTILES,
+                            help='Quantiles to keep (101 = every percentile)')
+        parser.add_argument('--no-recalibrate', action='store_true',
+                            help="Don't rewrite stored scores with the new calibration")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        calibration = build_calibration(sample_size=options['sample_size'], quantiles=options['quantiles'])
+        if calibration is None:
+            self.stdout.write('Not enough stored compatibility scores to calibrate; keeping the current calibration')
+            return
+        q = calibration.raw_quantiles
+        self.stdout.write(
+            f"Calibrated from {calibration.sample_size} raw scores "
+            f"(median {q[len(q) // 2]:.1f}, 90th percentile {q[int(len(q) * 0.9)]:.1f})"
+        )
+        if not options['no_recalibrate']:
+            updated = recalibrate_stored()
+            self.stdout.write(f"Rewrote {updated} stored scores")
+        self.stdout.write(f"Done in {time.monotonic() - started:.1f}s")
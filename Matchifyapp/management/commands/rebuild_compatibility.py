@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from ...compatibility_store import rebuild_compatibility
+from ...models import TasteSnapshot
+from ...taste_snapshots import refresh_snapshot
+from django.utils import timezone
+import time
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed MusicCompatibility table from stored taste snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--time-range', default='long_term',
+                            choices=['short_term', 'medium_term', 'long_term'])
+        parser.add_argument('--full', action='store_true',
+                            help='Rescore every pair instead of only users whose snapshot changed')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk upsert')
+        parser.add_argument('--refresh-snapshots', action='store_true',
+                            help='Re-fetch expired taste snapshots from Spotify before scoring')
+
+    def handle(self, *args, **options):
+        time_range = options['time_range']
+
+        if options['refresh_snapshots']:
+            expired = TasteSnapshot.objects.filter(time_range=time_range, expires_at__lte=timezone.now()).select_related('user')
+            refreshed = 0
+            for snapshot in expired:
+                if refresh_snapshot(snapshot.user, time_range) is not None:
+                    refreshed += 1
+            self.stdout.write(f"Refreshed {refreshed} expired snapshots")
+
+        started = time.monotonic()
+        stats = rebuild_compatibility(time_range=time_range, full=options['full'], batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Scored {stats['changed_users']} of {stats['users']} users ({time_range}): "
+            f"{stats['rows_written']} rows written, {stats['rows_deleted']} stale rows deleted in {elapsed:.1f}s"
+        )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from ...leaderboards import MAX_RANK, refresh_leaderboards
+import time
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized per-school artist leaderboards from ArtistListen'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-rank', type=int, default=MAX_RANK,
+                            help='Ranks stored per school and artist')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = refresh_leaderboards(max_rank=options['max_rank'])
+        self.stdout.write(f"Wrote {written} leaderboard entries in {time.monotonic() - started:.1f}s")
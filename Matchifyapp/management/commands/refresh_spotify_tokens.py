@@ -0,0 +1,33 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from ...spotify_tokens import refresh_expiring
+import time
+
+
+class Command(BaseCommand):
+    help = ('Refresh every Spotify access token expiring soon, so user requests '
+            "don't wait on accounts.spotify.com")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--within-minutes', type=int, default=15,
+                            help='Refresh tokens expiring within this many minutes')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Tokens refreshed concurrently (1 = sequential)')
+        parser.add_argument('--max-expired-hours', type=int, default=24,
+                            help='Skip tokens that expired longer ago than this')
+        parser.add_argument('--every', type=int, default=0,
+                            help='Keep running, refreshing every N seconds (0 = run once)')
+
+    def handle(self, *args, **options):
+        within = timedelta(minutes=options['within_minutes'])
+        max_expired = timedelta(hours=options['max_expired_hours'])
+        while True:
+            started = time.monotonic()
+            refreshed, failed = refresh_expiring(within, workers=options['workers'], max_expired=max_expired)
+            self.stdout.write(
+                f"Refreshed {refreshed} tokens expiring within {options['within_minutes']} minutes "
+                f"({failed} failed) in {time.monotonic() - started:.1f}s"
+            )
+            if options['every'] <= 0:
+                break
+            time.sleep(max(0.0, options['every'] - (time.monotonic() - started)))
@@ -1,85 +1,254 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
-from django.utils import timezone
-from ...models import ArtistListen
-from ...views import get_auth_header, get_token
-import requests
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils.dateparse import parse_datetime
+from ...models import ArtistListen, PlayEvent, PlayHistoryCursor
+from ...spotify_client import API_BASE, get_client
+from ...views import get_auth_header
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import queue
+import threading
 import time
 
+SYNCED, SKIPPED, FAILED = 'synced', 'skipped', 'failed'
+LISTEN_UPDATE_FIELDS = ['artist_name', 'play_count', 'total_ms', 'last_updated']
+
+
+def parse_plays(items, after_ms=0):
+    """Turn recently-played items into play dicts newer than `after_ms`, oldest first.
+
+    Each play is {'played_at', 'played_at_ms', 'track_id', 'artist_id',
+    'artist_name', 'duration_ms'} attributed to the track's primary artist.
+    Local files (no track or artist id) are skipped.
+    """
+    plays = []
+    for it in items:
+        track = it.get('track')
+        played_at = parse_datetime(it.get('played_at') or '')
+        if not track or not track.get('id') or played_at is None:
+            continue
+        artists = track.get('artists', [])
+        if not artists or not artists[0].get('id'):
+            continue
+        played_at_ms = int(played_at.timestamp() * 1000)
+        if played_at_ms <= after_ms:
+            continue
+        # Use first artist as primary
+        artist = artists[0]
+        plays.append({
+            'played_at': played_at,
+            'played_at_ms': played_at_ms,
+            'track_id': track['id'],
+            'artist_id': artist['id'],
+            'artist_name': artist.get('name') or '',
+            'duration_ms': track.get('duration_ms', 0) or 0,
+        })
+    plays.sort(key=lambda p: p['played_at_ms'])
+    return plays
+
+
 class Command(BaseCommand):
-    help = 'Sync last 50 recently-played tracks for each user and update ArtistListen play_count'
+    help = ('Ingest new recently-played tracks for each user into PlayEvent and update '
+            'their cumulative ArtistListen totals')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Users synced concurrently (1 = sequential)')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Users whose plays are written in one transaction')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Max Spotify requests per second for this run (default: SPOTIFY_HTTP setting)')
+        parser.add_argument('--burst', type=int, default=None,
+                            help='Requests that may be sent back to back under --rate (default: 2 seconds worth)')
+        parser.add_argument('--progress-every', type=int, default=500,
+                            help='Print a progress line every N users')
+        parser.add_argument('--skip-leaderboards', action='store_true',
+                            help="Don't run refresh_leaderboards after the sync")
 
     def handle(self, *args, **options):
         User = get_user_model()
-        users = User.objects.filter(is_active=True)
+        users = list(User.objects.filter(is_active=True))
+        client = get_client()
+        if options['rate']:
+            # All workers share the client's token bucket, so this caps the whole run
+            burst = options['burst'] or max(1, int(options['rate'] * 2))
+            client.limiter.configure(options['rate'], burst)
+
+        self._lock = threading.Lock()
+        # SQLite allows one writer at a time, so workers take turns writing there;
+        # on Postgres batches for different users don't contend and run in parallel
+        self._write_lock = threading.Lock() if connection.vendor == 'sqlite' else contextlib.nullcontext()
+        self._counts = {SYNCED: 0, SKIPPED: 0, FAILED: 0}
+        self._queries = 0
+        self._artist_rows = 0
+        self._new_plays = 0
+        self._total = len(users)
+        self._batch_size = max(options['batch_size'], 1)
+        self._progress_every = max(options['progress_every'], 1)
+        self._started = time.monotonic()
+        self._cursors = dict(PlayHistoryCursor.objects.values_list('user_id', 'after_ms'))
+
+        pending = queue.SimpleQueue()
         for user in users:
+            pending.put(user)
+        workers = max(1, min(options['workers'], len(users) or 1))
+        if workers == 1:
+            with connection.execute_wrapper(self._count_query):
+                self._process(pending)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for future in [pool.submit(self._drain, pending) for _ in range(workers)]:
+                    future.result()
+
+        elapsed = time.monotonic() - self._started
+        rate_limited = sum(s['status'].get(429, 0) for s in client.metrics().values())
+        self.stdout.write(
+            f"Synced {self._counts[SYNCED]}, skipped {self._counts[SKIPPED]}, failed {self._counts[FAILED]} "
+            f"of {self._total} users in {elapsed:.1f}s "
+            f"({self._total / elapsed if elapsed else 0:.1f} users/s, {workers} workers, {rate_limited} rate-limited responses)"
+        )
+        if self._total:
+            # Writing row by row would cost a token lookup per user plus a
+            # get_or_create and a save per updated ArtistListen row
+            row_by_row = self._total + 2 * self._artist_rows
+            self.stdout.write(
+                f"{self._new_plays} new plays, {self._artist_rows} artist totals updated. "
+                f"DB queries: {self._queries} ({self._queries / self._total:.1f}/user); "
+                f"row-by-row writes would need at least {row_by_row} ({row_by_row / self._total:.1f}/user)"
+            )
+
+        if self._new_plays and not options['skip_leaderboards']:
+            call_command('refresh_leaderboards', stdout=self.stdout)
+
+    def _count_query(self, execute, sql, params, many, context):
+        with self._lock:
+            self._queries += 1
+        return execute(sql, params, many, context)
+
+    def _drain(self, pending):
+        """Worker thread: count this thread's queries and release its DB connection when done."""
+        try:
+            with connection.execute_wrapper(self._count_query):
+                self._process(pending)
+        finally:
+            connection.close()
+
+    def _process(self, pending):
+        """Fetch users from the queue until it is empty, writing their plays every batch_size users."""
+        batch = []
+        while True:
             try:
-                token = get_token(user)
-                if not token:
-                    self.stdout.write(f"Skipping {user.username}: no token")
-                    continue
-                headers = get_auth_header(user)
-                if not headers:
-                    self.stdout.write(f"Skipping {user.username}: no auth headers")
-                    continue
-                url = 'https://api.spotify.com/v1/me/player/recently-played?limit=50'
-                resp = requests.get(url, headers=headers)
-                if resp.status_code != 200:
-                    self.stdout.write(f"User {user.username}: Spotify API returned {resp.status_code}")
-                    continue
-                data = resp.json()
-                items = data.get('items', [])
-                # Count artist occurrences and accumulate ms for primary artist
-                counts = {}
-                ms = {}
-                for it in items:
-                    track = it.get('track')
-                    if not track:
-                        continue
-                    duration = track.get('duration_ms', 0) or 0
-                    artists = track.get('artists', [])
-                    if not artists:
-                        continue
-                    # Use first artist as primary
-                    artist = artists[0]
-                    aid = artist.get('id')
-                    name = artist.get('name')
-                    counts[aid] = counts.get(aid, 0) + 1
-                    ms[aid] = ms.get(aid, 0) + duration
-
-                # Update DB rows
-                for aid, cnt in counts.items():
-                    # attempt to get a name from the first matching track's artist
-                    # we didn't store a mapping earlier, so try to find any track with this artist id
-                    name = None
-                    for it in items:
-                        track = it.get('track')
-                        if not track:
-                            continue
-                        artists = track.get('artists', [])
-                        if not artists:
-                            continue
-                        a0 = artists[0]
-                        if a0.get('id') == aid:
-                            name = a0.get('name')
-                            break
+                user = pending.get_nowait()
+            except queue.Empty:
+                break
+            status, message, plays = self.fetch_user(user)
+            if status != SYNCED:
+                self._record(user, status, message)
+            elif not plays:
+                # Nothing new since the last sync
+                self._record(user, SYNCED)
+            else:
+                batch.append((user, plays))
+                if len(batch) >= self._batch_size:
+                    self._write_batch(batch)
+                    batch = []
+        if batch:
+            self._write_batch(batch)
 
-                    try:
-                        # Create or update: overwrite play_count with the last-50 count (sliding window)
-                        listen, created = ArtistListen.objects.get_or_create(
-                            user=user, artist_id=aid,
-                            defaults={'artist_name': name or '', 'play_count': 0, 'total_ms': 0}
-                        )
-                        listen.play_count = cnt
-                        listen.total_ms = ms.get(aid, 0)
-                        # update artist_name if missing or different
-                        if name and listen.artist_name != name:
-                            listen.artist_name = name
-                        listen.save()
-                    except Exception as e:
-                        self.stdout.write(f"Error updating ArtistListen for {user.username} {aid}: {e}")
+    def _record(self, user, status, message=None):
+        with self._lock:
+            self._counts[status] += 1
+            if message:
+                self.stdout.write(f"{user.username}: {message}")
+            done = sum(self._counts.values())
+            if done % self._progress_every == 0 and done < self._total:
+                elapsed = time.monotonic() - self._started
+                self.stdout.write(f"Progress: {done}/{self._total} users ({done / elapsed if elapsed else 0:.1f} users/s)")
+
+    def fetch_user(self, user):
+        """Fetch one user's plays since their cursor. Returns (status, message, plays); never raises."""
+        try:
+            # get_auth_header looks the token up (and refreshes it) once; None means no token
+            headers = get_auth_header(user)
+            if not headers:
+                return SKIPPED, "skipping, no token", None
+            after_ms = self._cursors.get(user.id, 0)
+            params = {'limit': 50}
+            if after_ms:
+                params['after'] = after_ms
+            url = API_BASE + 'me/player/recently-played'
+            client = get_client()
+            resp = client.get(url, headers=headers, params=params,
+                              acquire_timeout=client.background_acquire_timeout)
+            if resp.status_code != 200:
+                return FAILED, f"Spotify API returned {resp.status_code}", None
+            return SYNCED, None, parse_plays(resp.json().get('items', []), after_ms)
+        except Exception as e:
+            return FAILED, f"unexpected error: {e}", None
+
+    @staticmethod
+    def _write(batch):
+        """Append the batch's plays, advance cursors and re-aggregate the touched ArtistListen rows.
+
+        Totals are recomputed from PlayEvent rather than incremented, so writing
+        the same plays twice can't double count. Returns the number of
+        ArtistListen rows written.
+        """
+        names = {}
+        events = []
+        cursors = []
+        for user, plays in batch:
+            for p in plays:
+                names[(user.id, p['artist_id'])] = p['artist_name']
+                events.append(PlayEvent(user=user, played_at=p['played_at'], track_id=p['track_id'],
+                                        artist_id=p['artist_id'], duration_ms=p['duration_ms']))
+            cursors.append(PlayHistoryCursor(user=user, after_ms=plays[-1]['played_at_ms']))
 
-                # Be courteous with Spotify rate limits
-                time.sleep(0.15)
+        with transaction.atomic():
+            PlayEvent.objects.bulk_create(events, ignore_conflicts=True)
+            PlayHistoryCursor.objects.bulk_create(
+                cursors, update_conflicts=True, unique_fields=['user'], update_fields=['after_ms', 'synced_at']
+            )
+            totals = (
+                PlayEvent.objects
+                .filter(user_id__in={u for u, _ in names}, artist_id__in={a for _, a in names})
+                .values('user_id', 'artist_id')
+                .annotate(plays=Count('id'), ms=Sum('duration_ms'))
+            )
+            rows = [
+                ArtistListen(user_id=t['user_id'], artist_id=t['artist_id'],
+                             artist_name=names[(t['user_id'], t['artist_id'])],
+                             play_count=t['plays'], total_ms=t['ms'] or 0)
+                for t in totals if (t['user_id'], t['artist_id']) in names
+            ]
+            ArtistListen.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=['user', 'artist_id'], update_fields=LISTEN_UPDATE_FIELDS
+            )
+        return len(rows)
+
+    def _write_batch(self, batch):
+        """Write a batch of users in one transaction.
+
+        If the batch fails, each user is retried on their own so one bad row
+        only fails that user.
+        """
+        with self._write_lock:
+            try:
+                written = [(batch, self._write(batch))]
             except Exception as e:
-                self.stdout.write(f"Unexpected error for {user.username}: {e}")
+                self.stdout.write(f"Batch write of {len(batch)} users failed ({e}); retrying per user")
+                written = []
+                for user, plays in batch:
+                    try:
+                        written.append(([(user, plays)], self._write([(user, plays)])))
+                    except Exception as e:
+                        self._record(user, FAILED, f"error writing plays: {e}")
+        for users, artist_rows in written:
+            with self._lock:
+                self._artist_rows += artist_rows
+                self._new_plays += sum(len(plays) for _, plays in users)
+            for user, _ in users:
+                self._record(user, SYNCED)
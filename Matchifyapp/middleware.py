@@ -0,0 +1,37 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .taste_snapshots import request_memo
+
+
+class TasteMemoMiddleware:
+    """Give each request its own memo of users' music data.
+
+    Views that need the same user's taste more than once (compatibility,
+    taste summary, swipe cards) then load and parse it once per request.
+    Works natively under both WSGI and ASGI, so async views (the now-playing
+    stream) aren't wrapped in a sync adapter.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = request_memo.set({})
+        try:
+            return self.get_response(request)
+        finally:
+            request_memo.reset(token)
+
+    async def __acall__(self, request):
+        token = request_memo.set({})
+        try:
+            return await self.get_response(request)
+        finally:
+            request_memo.reset(token)
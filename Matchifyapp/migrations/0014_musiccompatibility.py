@@ -0,0 +1,33 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Matchifyapp', '0013_tastesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MusicCompatibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_range', models.CharField(max_length=16)),
+                ('total_score', models.FloatField()),
+                ('raw_score', models.FloatField()),
+                ('breakdown', models.JSONField(default=dict)),
+                ('computed_at', models.DateTimeField()),
+                ('user_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compatibility_scores', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_a', 'time_range', '-total_score'], name='compat_user_range_score_idx')],
+                'unique_together': {('user_a', 'user_b', 'time_range')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Matchifyapp', '0014_musiccompatibility'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayHistoryCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('after_ms', models.BigIntegerField(default=0)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='play_history_cursor', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlayEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('played_at', models.DateTimeField()),
+                ('track_id', models.CharField(max_length=64)),
+                ('artist_id', models.CharField(max_length=64)),
+                ('duration_ms', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='play_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'artist_id'], name='playevent_user_artist_idx')],
+                'unique_together': {('user', 'played_at')},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_school_domain(apps, schema_editor):
+    """Store every user's email domain on their profile, creating missing profiles."""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Profile = apps.get_model('Matchifyapp', 'Profile')
+    domains = {}
+    for user_id, email in User.objects.values_list('id', 'email').iterator():
+        domain = email.rsplit('@', 1)[1].strip().lower() if email and '@' in email else ''
+        domains[user_id] = domain or None
+
+    existing = Profile.objects.in_bulk(field_name='user_id')
+    for user_id, profile in existing.items():
+        profile.school_domain = domains.get(user_id)
+    Profile.objects.bulk_update(existing.values(), ['school_domain'], batch_size=1000)
+    Profile.objects.bulk_create(
+        [Profile(user_id=user_id, school_domain=domain) for user_id, domain in domains.items() if user_id not in existing],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Matchifyapp', '0015_playevent_playhistorycursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='school_domain',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(backfill_school_domain, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='artistlisten',
+            index=models.Index(fields=['artist_id', '-play_count'], name='listen_artist_plays_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='artistlisten',
+            index=models.Index(fields=['artist_id', '-total_ms'], name='listen_artist_ms_idx'),
+        ),
+    ]
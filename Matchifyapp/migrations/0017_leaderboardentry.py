@@ -0,0 +1,32 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Matchifyapp', '0016_profile_school_domain_listen_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('school_domain', models.CharField(blank=True, default='', max_length=255)),
+                ('artist_id', models.CharField(max_length=128)),
+                ('artist_name', models.CharField(blank=True, default='', max_length=255)),
+                ('rank', models.PositiveIntegerField()),
+                ('score', models.IntegerField(default=0)),
+                ('total_ms', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('school_domain', 'artist_id', 'rank')},
+            },
+        ),
+    ]
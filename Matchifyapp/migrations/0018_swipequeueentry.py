@@ -0,0 +1,31 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Matchifyapp', '0017_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SwipeQueueEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(default=0)),
+                ('queued_at', models.DateTimeField(auto_now_add=True)),
+                ('served_at', models.DateTimeField(blank=True, null=True)),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='swipe_queue', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'served_at', '-score'], name='swipequeue_next_idx')],
+                'unique_together': {('owner', 'candidate')},
+            },
+        ),
+    ]
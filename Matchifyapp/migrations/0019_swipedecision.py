@@ -0,0 +1,30 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Matchifyapp', '0018_swipequeueentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SwipeDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('like', 'Like'), ('dislike', 'Dislike')], max_length=8)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('swiper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='swipe_decisions', to=settings.AUTH_USER_MODEL)),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('swiper', 'target')},
+            },
+        ),
+    ]
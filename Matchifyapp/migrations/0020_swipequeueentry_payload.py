@@ -0,0 +1,23 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Matchifyapp', '0019_swipedecision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='swipequeueentry',
+            name='payload',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='swipequeueentry',
+            name='prepared_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Matchifyapp', '0020_swipequeueentry_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tastesnapshot',
+            name='profile',
+            field=models.BinaryField(null=True),
+        ),
+    ]
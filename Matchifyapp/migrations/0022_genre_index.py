@@ -0,0 +1,37 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Matchifyapp', '0021_tastesnapshot_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserGenre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_range', models.CharField(max_length=16)),
+                ('count', models.PositiveIntegerField()),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listeners', to='Matchifyapp.genre')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='genre_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['genre', 'time_range'], name='usergenre_genre_idx')],
+                'unique_together': {('user', 'time_range', 'genre')},
+            },
+        ),
+    ]
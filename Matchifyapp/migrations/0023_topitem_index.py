@@ -0,0 +1,31 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Matchifyapp', '0022_genre_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_range', models.CharField(max_length=16)),
+                ('kind', models.CharField(choices=[('artist', 'Artist'), ('track', 'Track')], max_length=6)),
+                ('item_id', models.CharField(max_length=64)),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='top_items', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'item_id', 'time_range'], name='topitem_lookup_idx')],
+                'unique_together': {('user', 'time_range', 'kind', 'item_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Matchifyapp', '0023_topitem_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TasteEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_range', models.CharField(max_length=16)),
+                ('vector', models.BinaryField()),
+                ('built_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='taste_embeddings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'time_range')},
+            },
+        ),
+    ]
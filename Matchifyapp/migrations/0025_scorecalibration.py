@@ -0,0 +1,25 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Matchifyapp', '0024_tasteembedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreCalibration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('raw_quantiles', models.JSONField()),
+                ('sample_size', models.PositiveIntegerField()),
+                ('built_at', models.DateTimeField()),
+            ],
+            options={
+                'get_latest_by': 'built_at',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-17 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Matchifyapp', '0025_scorecalibration'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='spotifytoken',
+            name='expires_in',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
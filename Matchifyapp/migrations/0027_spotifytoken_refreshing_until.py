@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-17 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Matchifyapp', '0026_spotifytoken_expires_in_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifytoken',
+            name='refreshing_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,10 +1,21 @@
 from django.db import models
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+def school_domain_for_email(email):
+    """Return the lower-cased domain of an email address (the user's 'school'), or None."""
+    if not email or '@' not in email:
+        return None
+    return email.rsplit('@', 1)[1].strip().lower() or None
 
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
+    # Email domain of the user, kept in sync by signals.sync_school_domain so
+    # school-scoped queries (leaderboards) can filter on an indexed column.
+    school_domain = models.CharField(max_length=255, blank=True, null=True, db_index=True)
     bio = models.TextField(blank=True, null=True)
     # Profile image field for user avatars. Use db_column 'avatar' to match the
     # existing database column (some environments already have an 'avatar' column).
@@ -33,8 +44,9 @@ class spotifyToken(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     access_token = models.TextField()
     refresh_token = models.TextField()
-    expires_in = models.DateTimeField()
+    expires_in = models.DateTimeField(db_index=True)  # when access_token expires
     token_type = models.CharField(max_length=50)
+    refreshing_until = models.DateTimeField(blank=True, null=True)  # lease of the worker refreshing it
 
     def __str__(self):
         return self.user.username
@@ -113,19 +125,24 @@ class ArtistListen(models.Model):
     """Aggregated listening time for a user for a specific artist.
 
     This model stores total milliseconds listened for a (user, artist) pair.
-    A background job or management command should populate/update these rows by
-    pulling users' recently-played history from Spotify and attributing track
-    durations to their primary artist(s).
+    Rows are maintained by the `sync_artist_plays` command as cumulative
+    aggregates of the user's ``PlayEvent`` rows, attributing each track's
+    duration to its primary artist.
     """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='artist_listens')
     artist_id = models.CharField(max_length=128, blank=True, null=True, db_index=True)
     artist_name = models.CharField(max_length=255, blank=True, null=True, db_index=True)
     total_ms = models.BigIntegerField(default=0)  # total milliseconds listened
-    play_count = models.IntegerField(default=0)  # number of times this artist appeared in recent-play history
+    play_count = models.IntegerField(default=0)  # number of recorded plays of this artist
     last_updated = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('user', 'artist_id')
+        indexes = [
+            # Leaderboards: top listeners of one artist
+            models.Index(fields=['artist_id', '-play_count'], name='listen_artist_plays_idx'),
+            models.Index(fields=['artist_id', '-total_ms'], name='listen_artist_ms_idx'),
+        ]
 
     def minutes(self):
         return (self.total_ms or 0) / 60000.0
@@ -134,6 +151,273 @@ class ArtistListen(models.Model):
         return f"ArtistListen(user={self.user.username} artist={self.artist_name} ms={self.total_ms})"
 
 
+class LeaderboardEntry(models.Model):
+    """Materialized rank of a user among listeners of an artist within a school.
+
+    Rebuilt by ``leaderboards.refresh_leaderboards`` (the `refresh_leaderboards`
+    command, also run after `sync_artist_plays`) so leaderboard pages read a
+    page of ranks with one indexed lookup. ``school_domain`` '' is the board
+    over all users, shown to users without a school email.
+    """
+    school_domain = models.CharField(max_length=255, blank=True, default='')
+    artist_id = models.CharField(max_length=128)
+    artist_name = models.CharField(max_length=255, blank=True, default='')
+    rank = models.PositiveIntegerField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    score = models.IntegerField(default=0)  # play count
+    total_ms = models.BigIntegerField(default=0)
+
+    class Meta:
+        # Also the index for reading a page of ranks
+        unique_together = ('school_domain', 'artist_id', 'rank')
+
+    def __str__(self):
+        return f"LeaderboardEntry({self.school_domain or '*'} {self.artist_id} #{self.rank} user={self.user_id})"
+
+
+class PlayEvent(models.Model):
+    """One play from a user's Spotify recently-played history.
+
+    Append-only: `sync_artist_plays` inserts only plays newer than the user's
+    ``PlayHistoryCursor`` and ``ArtistListen`` is aggregated from these rows.
+    ``played_at`` is unique per user, so re-ingesting a page is harmless.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='play_events')
+    played_at = models.DateTimeField()
+    track_id = models.CharField(max_length=64)
+    artist_id = models.CharField(max_length=64)  # primary artist
+    duration_ms = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'played_at')
+        indexes = [models.Index(fields=['user', 'artist_id'], name='playevent_user_artist_idx')]
+
+    def __str__(self):
+        return f"PlayEvent(user={self.user_id} track={self.track_id} at={self.played_at})"
+
+
+class PlayHistoryCursor(models.Model):
+    """Spotify ``after`` cursor (played_at in unix ms) of the newest play ingested for a user."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='play_history_cursor')
+    after_ms = models.BigIntegerField(default=0)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"PlayHistoryCursor(user={self.user_id} after={self.after_ms})"
+
+
+class TasteSnapshot(models.Model):
+    """Cached copy of a user's Spotify top artists and tracks for one time range.
+
+    Rows are written by ``taste_snapshots.refresh_snapshot`` and read through
+    ``taste_snapshots.get_snapshot`` so compatibility scoring and profile pages
+    don't have to call Spotify on every request. A snapshot is considered fresh
+    until ``expires_at``; stale rows are still served when a refresh fails,
+    with ``expires_at`` pushed back so the refresh is retried later rather than on every read.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='taste_snapshots')
+    time_range = models.CharField(max_length=16)  # 'short_term', 'medium_term' or 'long_term'
+    artists = models.JSONField(default=list)  # Spotify artist objects in rank order
+    tracks = models.JSONField(default=list)  # Spotify track objects in rank order
+    genres = models.JSONField(default=list)  # [{"genre": name, "count": n}] most common first
+    profile = models.BinaryField(null=True, editable=False)  # TasteProfile.to_bytes() of artists/tracks
+    refreshed_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'time_range')
+
+    def is_fresh(self):
+        return self.expires_at > timezone.now()
+
+    def __str__(self):
+        return f"TasteSnapshot(user={self.user.username} range={self.time_range} refreshed={self.refreshed_at})"
+
+
+class Genre(models.Model):
+    """Vocabulary of Spotify genre names, so per-user genres are stored as integer ids."""
+    name = models.CharField(max_length=128, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class UserGenre(models.Model):
+    """How many of `user`'s top artists (for one time range) carry `genre`.
+
+    Together a user's rows are their genre frequency vector; the
+    (genre, time_range) index makes the table an inverted index from a genre
+    to its listeners. Rewritten by ``genre_index.store_user_genres`` whenever a
+    taste snapshot is refreshed.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='genre_counts')
+    time_range = models.CharField(max_length=16)
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, related_name='listeners')
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('user', 'time_range', 'genre')
+        indexes = [
+            models.Index(fields=['genre', 'time_range'], name='usergenre_genre_idx'),
+        ]
+
+    def __str__(self):
+        return f"UserGenre({self.user_id} {self.time_range} {self.genre_id} x{self.count})"
+
+
+class TopItem(models.Model):
+    """One of `user`'s top artists or tracks for a time range, at `rank` (1 = top).
+
+    Indexed by (kind, item_id, time_range) so the table doubles as an inverted
+    index from an artist or track to the users who have it in their top list.
+    Rewritten from each saved taste snapshot (see ``item_index``).
+    """
+    ARTIST = 'artist'
+    TRACK = 'track'
+    KIND_CHOICES = [(ARTIST, 'Artist'), (TRACK, 'Track')]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='top_items')
+    time_range = models.CharField(max_length=16)
+    kind = models.CharField(max_length=6, choices=KIND_CHOICES)
+    item_id = models.CharField(max_length=64)  # Spotify artist or track id
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('user', 'time_range', 'kind', 'item_id')
+        indexes = [
+            models.Index(fields=['kind', 'item_id', 'time_range'], name='topitem_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f"TopItem({self.user_id} {self.time_range} {self.kind} {self.item_id} #{self.rank})"
+
+
+class TasteEmbedding(models.Model):
+    """Dense, unit-length taste vector of a user for one time range.
+
+    Built for everyone at once by the `build_taste_embeddings` command
+    (truncated SVD of the user x artist/genre matrix, see
+    ``taste_embeddings``) and loaded into an in-process nearest-neighbour
+    index for match search.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='taste_embeddings')
+    time_range = models.CharField(max_length=16)
+    vector = models.BinaryField()  # little-endian float32
+    built_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'time_range')
+
+    def __str__(self):
+        return f"TasteEmbedding({self.user_id} {self.time_range} built={self.built_at})"
+
+
+class ScoreCalibration(models.Model):
+    """Empirical distribution of raw compatibility scores.
+
+    `raw_quantiles` are evenly spaced quantiles (0th to 100th percentile) of
+    a sample of stored ``MusicCompatibility.raw_score`` values, built by the
+    `calibrate_scores` command. The newest row is what ``score_calibration``
+    maps raw scores to shown scores with.
+    """
+    raw_quantiles = models.JSONField()
+    sample_size = models.PositiveIntegerField()
+    built_at = models.DateTimeField()
+
+    class Meta:
+        get_latest_by = 'built_at'
+
+    def __str__(self):
+        return f"ScoreCalibration({len(self.raw_quantiles)} quantiles of {self.sample_size} scores, built={self.built_at})"
+
+
+class MusicCompatibility(models.Model):
+    """Precomputed music compatibility of `user_a` towards `user_b`.
+
+    Scores are directional (artist and track components are weighted by
+    user_a's own ranking), so both directions of a pair are stored. Rows are
+    written by the `rebuild_compatibility` management command and by
+    `compatibility_store.get_compatibility` on a cache miss.
+    """
+    user_a = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='compatibility_scores')
+    user_b = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    time_range = models.CharField(max_length=16)
+    total_score = models.FloatField()  # calibrated 0-100 score shown to users
+    raw_score = models.FloatField()  # weighted score before calibration
+    breakdown = models.JSONField(default=dict)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user_a', 'user_b', 'time_range')
+        indexes = [
+            models.Index(fields=['user_a', 'time_range', '-total_score'], name='compat_user_range_score_idx'),
+        ]
+
+    def as_result(self):
+        """Return the dict shape produced by MusicMatchingAlgorithm.calculate_music_compatibility."""
+        return {
+            'total_score': self.total_score,
+            'breakdown': self.breakdown,
+            'common_artists': [],
+            'common_genres': [],
+            'common_tracks': []
+        }
+
+    def __str__(self):
+        return f"MusicCompatibility({self.user_a_id}->{self.user_b_id} {self.time_range}: {self.total_score})"
+
+
+class SwipeQueueEntry(models.Model):
+    """A candidate waiting in `owner`'s swipe queue, ranked by compatibility.
+
+    Filled from ``MusicCompatibility`` by ``swipe_queue.refill_queue`` and
+    consumed by the swipe endpoints, which pop the best queued candidate and
+    mark it served. Serving is a lease: an entry served longer than
+    ``swipe_queue.SERVED_LEASE`` ago without a swipe is offered again. A
+    swipe deletes the entry, and users with a ``SwipeDecision`` from the
+    owner are never queued or served.
+    """
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='swipe_queue')
+    candidate = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField(default=0)  # compatibility total_score; 0 when not yet scored
+    queued_at = models.DateTimeField(auto_now_add=True)
+    served_at = models.DateTimeField(blank=True, null=True)
+    # Swipe card JSON built ahead of time by swipe_queue.warm_payloads
+    payload = models.JSONField(blank=True, null=True)
+    prepared_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('owner', 'candidate')
+        indexes = [
+            models.Index(fields=['owner', 'served_at', '-score'], name='swipequeue_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"SwipeQueueEntry({self.owner_id} -> {self.candidate_id}: {self.score})"
+
+
+class SwipeDecision(models.Model):
+    """A like or dislike `swiper` gave `target` on the swipe screen.
+
+    One row per pair (a repeat swipe updates it). Candidate selection
+    anti-joins against this table so decided users aren't offered again.
+    """
+    LIKE = 'like'
+    DISLIKE = 'dislike'
+    ACTION_CHOICES = [(LIKE, 'Like'), (DISLIKE, 'Dislike')]
+
+    swiper = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='swipe_decisions')
+    target = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    action = models.CharField(max_length=8, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('swiper', 'target')
+
+    def __str__(self):
+        return f"SwipeDecision({self.swiper_id} {self.action} {self.target_id})"
+
+
 class Message(models.Model):
     """Direct one-to-one message between two users."""
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_messages')
@@ -0,0 +1,215 @@
+"""
+Per-user cache of what each user is currently playing on Spotify.
+
+The home page polls ``/get-current-track``. Each user's answer is kept in
+this process for TTL seconds, or IDLE_TTL when nothing is playing, so
+repeated and concurrent polls share one upstream call. Fetches are
+single-flight: callers for the same user wait for the request already in
+flight instead of sending their own. When the cached answer is stale it is
+revalidated with Spotify's ETag (``If-None-Match``), and an unchanged
+answer comes back as a cheap 304.
+
+How long an answer is kept depends on what is playing. A playing track is
+rechecked just after it should end (but at least every TTL seconds), and a
+paused player, or one playing nothing, only every IDLE_TTL seconds.
+
+Every answer carries an ETag of its own, derived from the track. The
+endpoint uses it to reply ``304 Not Modified`` to clients that already have it.
+The `stream_events` Server-Sent Events stream uses it to push only changes.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection
+
+from .spotify_client import API_BASE, get_client
+from .spotify_tokens import get_access_token
+
+logger = logging.getLogger(__name__)
+
+CURRENTLY_PLAYING_URL = API_BASE + 'me/player/currently-playing'
+# Most seconds a playing track's answer is reused
+TTL = getattr(settings, 'NOW_PLAYING_TTL_SECONDS', 10)
+# ... and when nothing is playing, which changes less often
+IDLE_TTL = getattr(settings, 'NOW_PLAYING_IDLE_TTL_SECONDS', 30)
+# Near the end of a track it is rechecked sooner, but never more often than this
+MIN_TTL = 2
+# An event stream ends after this long (the browser's EventSource reconnects by itself)
+STREAM_MAX_SECONDS = getattr(settings, 'NOW_PLAYING_STREAM_MAX_SECONDS', 10 * 60)
+# Reconnect delay suggested to EventSource
+STREAM_RETRY_MS = 5000
+LOCK_STRIPES = 64
+
+_entries = {}  # user_id -> NowPlaying
+_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+class NowPlaying:
+    """One user's current track (or None) with its ETag and when it was fetched."""
+
+    __slots__ = ('track', 'etag', 'upstream_etag', 'remaining_ms', 'fetched_at', 'fetched_monotonic')
+
+    def __init__(self, track, upstream_etag=None, remaining_ms=None):
+        self.track = track
+        self.etag = track_etag(track)
+        self.upstream_etag = upstream_etag
+        self.remaining_ms = remaining_ms  # of the playing track when fetched, if known
+        self.fetched_at = time.time()
+        self.fetched_monotonic = time.monotonic()
+
+    def ttl(self):
+        """Seconds this answer is reused.
+
+        IDLE_TTL when nothing is playing, else TTL or until just after the
+        track should end, whichever comes first.
+        """
+        if not self.track:
+            return IDLE_TTL
+        if self.remaining_ms is None:
+            return TTL
+        return max(MIN_TTL, min(TTL, self.remaining_ms / 1000 + 1))
+
+    def expires_in(self):
+        return self.ttl() - (time.monotonic() - self.fetched_monotonic)
+
+    def is_fresh(self):
+        return self.expires_in() > 0
+
+    def as_json(self):
+        return {
+            'track': self.track,
+            'success': True,
+            'timestamp': datetime.fromtimestamp(self.fetched_at, tz=timezone.utc).isoformat()
+        }
+
+
+def track_etag(track):
+    """Short stable ETag (unquoted) for a track dict or None."""
+    payload = json.dumps(track, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+def _parse_track(data):
+    """(track info dict, ms left in it) from a currently-playing response; (None, None) if nothing is playing."""
+    item = data.get('item')
+    if not data.get('is_playing', False) or not item:
+        return None, None
+    images = item.get('album', {}).get('images') or []
+    track = {
+        'name': item['name'],
+        'artist': item['artists'][0]['name'],
+        'album': item['album']['name'],
+        'album_art': images[0]['url'] if images else None
+    }
+    remaining_ms = None
+    if item.get('duration_ms') and data.get('progress_ms') is not None:
+        remaining_ms = max(0, item['duration_ms'] - data['progress_ms'])
+    return track, remaining_ms
+
+
+def _fetch(user_id, previous):
+    """Ask Spotify what `user_id` is playing. Returns a NowPlaying; `previous` is revalidated if given."""
+    token = get_access_token(user_id)
+    if not token:
+        return NowPlaying(None)
+    headers = {'Authorization': f'Bearer {token}'}
+    if previous is not None and previous.upstream_etag:
+        headers['If-None-Match'] = previous.upstream_etag
+    try:
+        response = get_client().get(CURRENTLY_PLAYING_URL, headers=headers)
+        if response.status_code == 304 and previous is not None:
+            # Unchanged, but the track has moved on since
+            remaining_ms = previous.remaining_ms
+            if remaining_ms is not None:
+                remaining_ms = max(0, remaining_ms - int((time.monotonic() - previous.fetched_monotonic) * 1000))
+            return NowPlaying(previous.track, previous.upstream_etag, remaining_ms)
+        # No content means no track is playing
+        if response.status_code == 204:
+            return NowPlaying(None)
+        if response.status_code != 200:
+            logger.warning(f"Currently-playing request for user {user_id} returned {response.status_code}")
+            return NowPlaying(previous.track if previous else None)
+        track, remaining_ms = _parse_track(response.json())
+        return NowPlaying(track, response.headers.get('ETag'), remaining_ms)
+    except Exception as e:
+        logger.error(f"Error fetching currently playing track for user {user_id}: {e}")
+        return NowPlaying(previous.track if previous else None)
+
+
+def get_now_playing(user):
+    """Return `user`'s NowPlaying, fetching it from Spotify at most once per TTL across threads."""
+    user_id = getattr(user, 'pk', user)
+    entry = _entries.get(user_id)
+    if entry is not None and entry.is_fresh():
+        return entry
+    with _locks[user_id % LOCK_STRIPES]:
+        # Another thread may have fetched it while we waited
+        entry = _entries.get(user_id)
+        if entry is not None and entry.is_fresh():
+            return entry
+        entry = _entries[user_id] = _fetch(user_id, entry)
+        return entry
+
+
+def forget_now_playing(user):
+    _entries.pop(getattr(user, 'pk', user), None)
+
+
+def clear_now_playing():
+    _entries.clear()
+
+
+def streaming_supported(request):
+    """Whether `request` came through the ASGI handler, where `stream_events` doesn't hold a thread.
+
+    Under WSGI Django drains an async streaming body completely before
+    sending any of it, so pages poll ``/get-current-track`` there instead.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def _get_now_playing_in_worker(user):
+    # Runs in sync_to_async's executor threads; don't leave their DB connections open
+    try:
+        return get_now_playing(user)
+    finally:
+        connection.close()
+
+
+def _event(event, data, event_id):
+    return f"event: {event}\nid: {event_id}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_events(user, last_etag=None, max_seconds=STREAM_MAX_SECONDS):
+    """Async iterator of Server-Sent Events pushing `user`'s current track whenever it changes.
+
+    Only for ASGI requests (see `streaming_supported`). Each check goes
+    through `get_now_playing` (in a worker thread), so streams
+    and polls share the cache and Spotify is asked only when the cached answer
+    has expired. A 'track' event is sent when the ETag differs from the
+    client's `last_etag` (EventSource's Last-Event-ID), otherwise a comment
+    line as a keep-alive. The stream ends after `max_seconds`.
+    """
+    fetch = sync_to_async(_get_now_playing_in_worker, thread_sensitive=False)
+    deadline = time.monotonic() + max_seconds
+    yield f"retry: {STREAM_RETRY_MS}\n\n"
+    while True:
+        entry = await fetch(user)
+        if entry.etag != last_etag:
+            last_etag = entry.etag
+            yield _event('track', entry.as_json(), entry.etag)
+        else:
+            yield ": keep-alive\n\n"
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return
+        await asyncio.sleep(min(left, max(entry.expires_in(), 0.5)))
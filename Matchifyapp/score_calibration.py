@@ -0,0 +1,191 @@
+"""
+Calibration of raw compatibility scores to the distribution shown to users.
+
+Shown scores follow a fixed target distribution (TARGET_BUCKETS: 10% of
+pairs in 90-100, 20% in 80-90 and so on). To place a raw score in it we need
+its percentile among real raw scores. The `calibrate_scores` command samples
+stored ``MusicCompatibility.raw_score`` values, keeps their quantiles in a
+``ScoreCalibration`` row, and rewrites stored scores with the new mapping.
+
+Each process loads the newest table once (reloading after CALIBRATION_TTL)
+and composes it with the target distribution into one raw -> shown lookup,
+so `calibrate` is a single ``numpy.interp``, and `calibrate_many` one per
+array of scores. Until a calibration has been built the raw score itself is
+taken as the percentile.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+import numpy as np
+
+from .models import MusicCompatibility, ScoreCalibration
+
+logger = logging.getLogger(__name__)
+
+# (low, high, share of pairs) of shown scores, best first
+TARGET_BUCKETS = [
+    (90, 100, 0.10),
+    (80, 90, 0.20),
+    (70, 80, 0.35),
+    (60, 70, 0.15),
+    (50, 60, 0.10),
+    (40, 50, 0.06),
+    (0, 40, 0.04),
+]
+# Raw scores sampled per calibration
+SAMPLE_SIZE = getattr(settings, 'SCORE_CALIBRATION_SAMPLE_SIZE', 50000)
+# Quantiles stored per calibration (101 = every percentile)
+QUANTILES = getattr(settings, 'SCORE_CALIBRATION_QUANTILES', 101)
+# Fewer stored scores than this leave the previous calibration in place
+MIN_SAMPLES = getattr(settings, 'SCORE_CALIBRATION_MIN_SAMPLES', 200)
+# Reload the newest calibration from the database after this long
+CALIBRATION_TTL = getattr(settings, 'SCORE_CALIBRATION_TTL_SECONDS', 10 * 60)
+
+
+def _target_curve():
+    """(percentile edges, shown score at each edge) of TARGET_BUCKETS, both increasing."""
+    percentiles, scores = [0.0], [0.0]
+    for low, high, share in reversed(TARGET_BUCKETS):
+        percentiles.append(percentiles[-1] + share * 100.0)
+        scores.append(float(high))
+    percentiles[-1] = 100.0
+    return np.array(percentiles), np.array(scores)
+
+
+TARGET_PERCENTILES, TARGET_SCORES = _target_curve()
+
+
+class Calibration:
+    """Piecewise-linear raw score -> shown score lookup."""
+
+    def __init__(self, raw_quantiles=None):
+        if raw_quantiles is None or len(raw_quantiles) < 2:
+            # No empirical table: the raw score is its own percentile
+            self.raw_points, self.scores = TARGET_PERCENTILES, TARGET_SCORES
+            return
+        raw = np.asarray(raw_quantiles, dtype=np.float64)
+        percentiles = np.linspace(0.0, 100.0, len(raw))
+        # Tied quantiles (many equal raw scores) map to their mean percentile
+        self.raw_points, inverse = np.unique(raw, return_inverse=True)
+        percentiles = np.bincount(inverse, percentiles) / np.bincount(inverse)
+        self.scores = np.interp(percentiles, TARGET_PERCENTILES, TARGET_SCORES)
+
+    def __call__(self, raw_score):
+        return float(np.interp(min(100.0, max(0.0, float(raw_score))), self.raw_points, self.scores))
+
+    def many(self, raw_scores):
+        """Shown scores for an array of raw scores; elementwise equal to calling the lookup on each."""
+        return np.interp(np.clip(np.asarray(raw_scores, dtype=np.float64), 0.0, 100.0), self.raw_points, self.scores)
+
+
+def sample_raw_scores(sample_size=SAMPLE_SIZE):
+    """Return up to `sample_size` stored raw scores picked uniformly at random.
+
+    Random ids between the smallest and largest are looked up by primary key
+    (oversampling for gaps left by deleted rows), so the table is never scanned.
+    """
+    rows = MusicCompatibility.objects
+    bounds = rows.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return np.zeros(0)
+    span = bounds['high'] - bounds['low'] + 1
+    count = rows.count()
+    if count <= sample_size:
+        return np.fromiter(rows.values_list('raw_score', flat=True).iterator(), dtype=np.float64)
+
+    rng = np.random.default_rng()
+    wanted = min(span, int(sample_size * span / count * 1.2) + 1)
+    ids = bounds['low'] + rng.choice(span, size=wanted, replace=False)
+    scores = []
+    for start in range(0, len(ids), 5000):
+        scores.extend(rows.filter(id__in=ids[start:start + 5000].tolist()).values_list('raw_score', flat=True))
+    return np.asarray(scores[:sample_size], dtype=np.float64)
+
+
+def build_calibration(sample_size=SAMPLE_SIZE, quantiles=QUANTILES):
+    """Store a new calibration from a sample of stored raw scores.
+
+    Returns the ScoreCalibration, or None when fewer than MIN_SAMPLES scores
+    are stored (the current calibration stays in use).
+    """
+    sample = sample_raw_scores(sample_size)
+    if len(sample) < MIN_SAMPLES:
+        return None
+    raw_quantiles = np.quantile(sample, np.linspace(0.0, 1.0, quantiles))
+    with transaction.atomic():
+        ScoreCalibration.objects.all().delete()
+        calibration = ScoreCalibration.objects.create(
+            raw_quantiles=[round(float(q), 4) for q in raw_quantiles],
+            sample_size=len(sample),
+            built_at=timezone.now(),
+        )
+    reset_calibration()
+    return calibration
+
+
+def recalibrate_stored(batch_size=1000):
+    """Rewrite the shown score and breakdown of every stored row from its raw score. Returns rows updated."""
+    from .compatibility import MusicMatchingAlgorithm
+
+    algorithm = MusicMatchingAlgorithm()
+    batch = []
+    updated = 0
+    rows = MusicCompatibility.objects.only('id', 'raw_score', 'total_score', 'breakdown')
+    for row in rows.iterator(chunk_size=batch_size):
+        # Stored components were scaled to sum to the old shown score; only their proportions matter
+        result = algorithm._finalize_result(row.raw_score, row.breakdown or {}, [], [], [])
+        if result['total_score'] == row.total_score:
+            continue
+        row.total_score, row.breakdown = result['total_score'], result['breakdown']
+        batch.append(row)
+        if len(batch) >= batch_size:
+            MusicCompatibility.objects.bulk_update(batch, ['total_score', 'breakdown'])
+            updated += len(batch)
+            batch = []
+    if batch:
+        MusicCompatibility.objects.bulk_update(batch, ['total_score', 'breakdown'])
+    return updated + len(batch)
+
+
+_current = None  # (loaded_monotonic, Calibration)
+_current_lock = threading.Lock()
+
+
+def get_calibration():
+    """Return this process's Calibration, reloading it when older than CALIBRATION_TTL."""
+    global _current
+    entry = _current
+    if entry is None or time.monotonic() - entry[0] > CALIBRATION_TTL:
+        with _current_lock:
+            entry = _current
+            if entry is None or time.monotonic() - entry[0] > CALIBRATION_TTL:
+                try:
+                    stored = ScoreCalibration.objects.order_by('-built_at').first()
+                    calibration = Calibration(stored.raw_quantiles if stored else None)
+                except Exception as e:
+                    logger.error(f"Error loading score calibration: {e}")
+                    calibration = entry[1] if entry else Calibration()
+                entry = _current = (time.monotonic(), calibration)
+    return entry[1]
+
+
+def reset_calibration():
+    """Drop this process's loaded calibration; the next score reloads it."""
+    global _current
+    _current = None
+
+
+def calibrate(raw_score):
+    """Shown 0-100 score for a raw 0-100 compatibility score."""
+    return get_calibration()(raw_score)
+
+
+def calibrate_many(raw_scores):
+    """Shown 0-100 scores for an array of raw 0-100 compatibility scores."""
+    return get_calibration().many(raw_scores)
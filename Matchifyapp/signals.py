@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Profile, TasteSnapshot, school_domain_for_email, spotifyToken
+from .genre_index import store_user_genres
+from .item_index import store_top_items
+from .spotify_tokens import forget_token
+from .taste_snapshots import forget_music_data, profile_for
+
+
+@receiver(post_save, sender=get_user_model())
+def sync_school_domain(sender, instance, update_fields=None, **kwargs):
+    """Keep Profile.school_domain in step with the user's email address."""
+    # Saves that can't have changed the email (e.g. last_login on sign-in) are skipped
+    if update_fields is not None and 'email' not in update_fields:
+        return
+    domain = school_domain_for_email(instance.email)
+    if not Profile.objects.filter(user=instance).update(school_domain=domain):
+        Profile.objects.create(user=instance, school_domain=domain)
+
+
+@receiver(post_save, sender=TasteSnapshot)
+@receiver(post_delete, sender=TasteSnapshot)
+def forget_memoized_taste(sender, instance, **kwargs):
+    """Drop the memoized compact copy of a snapshot that was rewritten or deleted."""
+    forget_music_data(instance.user_id, instance.time_range)
+
+
+@receiver(post_save, sender=TasteSnapshot)
+def index_taste_snapshot(sender, instance, **kwargs):
+    """Keep the genre and top item indexes in step with the user's latest snapshot."""
+    store_user_genres(instance.user_id, instance.time_range, instance.genres or [])
+    store_top_items(instance.user_id, instance.time_range, profile_for(instance))
+
+
+@receiver(post_save, sender=spotifyToken)
+@receiver(post_delete, sender=spotifyToken)
+def forget_cached_token(sender, instance, **kwargs):
+    """Drop this process's cached access token of a user whose tokens were rewritten or removed."""
+    forget_token(instance.user_id)
@@ -0,0 +1,234 @@
+"""
+Shared HTTP client for the Spotify Web API and accounts service.
+
+Every Spotify call in the app goes through `get_client()` so that requests
+reuse pooled keep-alive connections and all get the same behaviour:
+
+- default connect/read timeouts,
+- a process-wide token bucket so background jobs and page views together stay
+  under Spotify's rate limit,
+- retries with exponential backoff and jitter for 429 (honouring
+  ``Retry-After``) on every request, and for 5xx responses and connection
+  errors only on GETs; other methods (the token exchange and refresh POSTs)
+  are retried on errors only when the request cannot have been sent,
+- per-endpoint latency/status metrics (``get_client().metrics()``).
+
+Settings (all optional) live in ``settings.SPOTIFY_HTTP``.
+"""
+
+from collections import Counter
+from urllib.parse import urlparse
+import logging
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+API_BASE = 'https://api.spotify.com/v1/'
+ACCOUNTS_TOKEN_URL = 'https://accounts.spotify.com/api/token'
+
+DEFAULTS = {
+    'POOL_SIZE': 20,  # keep-alive connections per host
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 10,
+    'MAX_RETRIES': 3,
+    'BACKOFF_SECONDS': 0.5,  # base delay; doubles on each retry
+    'MAX_RETRY_AFTER': 30,  # don't sleep longer than this for a 429; return it instead
+    'ACQUIRE_TIMEOUT': 2,  # longest wait for the rate limiter before giving up (page views)
+    'BACKGROUND_ACQUIRE_TIMEOUT': 30,  # the same for management commands, which can afford to queue
+    'RATE_PER_SECOND': 20,  # sustained request rate for this process
+    'BURST': 40,
+}
+
+
+# Methods safe to resend after an error that may have reached Spotify
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+
+class RateLimitTimeout(requests.RequestException):
+    """The rate limiter didn't allow a request within the acquire timeout."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket. `acquire()` blocks until a request may be sent."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting at most `timeout` seconds (forever if None). Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def configure(self, rate, capacity):
+        """Change the sustained rate and burst size (tokens already saved are capped to the new burst)."""
+        with self._lock:
+            self.rate = float(rate)
+            self.capacity = float(capacity)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (used when Spotify answers 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class EndpointMetrics:
+    """Request counts, latency and status codes per endpoint path."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, endpoint, elapsed_ms, status):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                'count': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'status': Counter()
+            })
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['status'][status] += 1
+
+    def record_retry(self, endpoint):
+        with self._lock:
+            if endpoint in self._stats:
+                self._stats[endpoint]['retries'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    'count': s['count'],
+                    'retries': s['retries'],
+                    'avg_ms': round(s['total_ms'] / s['count'], 1) if s['count'] else 0.0,
+                    'max_ms': round(s['max_ms'], 1),
+                    'status': dict(s['status']),
+                }
+                for endpoint, s in self._stats.items()
+            }
+
+
+class SpotifyClient:
+    """Pooled, retrying, rate-limited wrapper around a `requests.Session`."""
+
+    def __init__(self, **options):
+        config = dict(DEFAULTS, **options)
+        self.timeout = (config['CONNECT_TIMEOUT'], config['READ_TIMEOUT'])
+        self.max_retries = int(config['MAX_RETRIES'])
+        self.backoff = float(config['BACKOFF_SECONDS'])
+        self.max_retry_after = float(config['MAX_RETRY_AFTER'])
+        self.acquire_timeout = config['ACQUIRE_TIMEOUT']
+        self.background_acquire_timeout = config['BACKGROUND_ACQUIRE_TIMEOUT']
+        self.limiter = TokenBucket(config['RATE_PER_SECOND'], config['BURST'])
+        self._metrics = EndpointMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=int(config['POOL_SIZE']))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _sleep_before_retry(self, attempt):
+        # Exponential backoff with full jitter
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def request(self, method, url, acquire_timeout=None, **kwargs):
+        """Send a request and return the final `requests.Response`.
+
+        Connection errors are re-raised once retries are exhausted, like a bare
+        `requests` call would. Only idempotent methods are retried after a 5xx
+        or an error that may have reached Spotify; other methods are retried
+        only when the connection couldn't be made. Raises RateLimitTimeout if
+        the rate limiter holds the request back longer than `acquire_timeout`
+        (ACQUIRE_TIMEOUT by default, which is short so a busy limiter fails a
+        page view fast; background jobs pass `background_acquire_timeout`).
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if acquire_timeout is None:
+            acquire_timeout = self.acquire_timeout
+        endpoint = f"{method.upper()} {urlparse(url).path}"
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        response = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._metrics.record_retry(endpoint)
+            if not self.limiter.acquire(timeout=acquire_timeout):
+                raise RateLimitTimeout(f"Spotify {endpoint} held back by the rate limiter for too long")
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._metrics.record(endpoint, (time.monotonic() - started) * 1000, type(e).__name__)
+                # A connect timeout never sent anything; other errors may have been handled upstream
+                if attempt >= self.max_retries or not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                    raise
+                logger.info(f"Spotify {endpoint} failed ({e}); retrying")
+                self._sleep_before_retry(attempt)
+                continue
+            self._metrics.record(endpoint, (time.monotonic() - started) * 1000, response.status_code)
+
+            if response.status_code == 429:
+                try:
+                    retry_after = float(response.headers.get('Retry-After', 1))
+                except ValueError:
+                    retry_after = 1.0
+                # Hold back every caller in this process, not just this one, but never
+                # for longer than we would wait ourselves
+                self.limiter.pause(min(retry_after, self.max_retry_after))
+                if attempt >= self.max_retries or retry_after > self.max_retry_after:
+                    return response
+                logger.info(f"Spotify {endpoint} rate limited; retrying in {retry_after}s")
+                # acquire() waits out the pause; jitter spreads the callers that were held back
+                time.sleep(random.uniform(0, self.backoff))
+                continue
+
+            if response.status_code >= 500 and idempotent and attempt < self.max_retries:
+                self._sleep_before_retry(attempt)
+                continue
+
+            return response
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def metrics(self):
+        return self._metrics.snapshot()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide SpotifyClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SpotifyClient(**getattr(settings, 'SPOTIFY_HTTP', {}))
+    return _client
@@ -0,0 +1,298 @@
+"""
+The one place Spotify tokens are read, refreshed and stored, with a
+process-wide cache of users' access tokens.
+
+`get_access_token` serves a user's token from memory until REFRESH_MARGIN
+before it expires, so rendering a page for several users doesn't read the
+``spotifyToken`` table again and again. Past that point the token is
+refreshed proactively, while it is still usable.
+
+Only one refresh per user runs at a time. Within a process it holds a
+per-user lock (striped over LOCK_STRIPES locks), and whoever waits for the
+lock finds the token already refreshed. Across workers it claims a short
+lease on the user's row (``refreshing_until``, set with a conditional
+UPDATE) rather than holding a row lock while Spotify is called; workers that
+don't get the lease wait up to REFRESH_LEASE for the holder to store its token
+and then re-read the row. The new token is stored with a conditional UPDATE
+that only applies if the row still holds the token that was refreshed.
+
+`is_connected` and `connected_user_ids` answer whether users have linked
+Spotify from the same cache (or a short-lived cached flag), so templates and
+list views don't query the token table per user; `connected_user_ids` checks
+any number of uncached users with one query.
+
+`refresh_expiring` (run by the `refresh_spotify_tokens` command) refreshes
+every token about to expire ahead of time, so page loads rarely wait on
+accounts.spotify.com.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .credentials import CLIENT_ID, CLIENT_SECRET
+from .models import spotifyToken
+from .spotify_client import ACCOUNTS_TOKEN_URL, get_client
+
+logger = logging.getLogger(__name__)
+
+# Refresh tokens this long before they expire
+REFRESH_MARGIN = timedelta(seconds=getattr(settings, 'SPOTIFY_TOKEN_REFRESH_MARGIN_SECONDS', 5 * 60))
+# How long this process trusts a cached "has / hasn't linked Spotify" answer
+CONNECTED_TTL = getattr(settings, 'SPOTIFY_CONNECTED_TTL_SECONDS', 5 * 60)
+# How long a worker may hold the refresh lease (longer than a token request can take)
+REFRESH_LEASE = timedelta(seconds=getattr(settings, 'SPOTIFY_TOKEN_REFRESH_LEASE_SECONDS', 15))
+# How often a worker waiting on another's refresh re-reads the row
+LEASE_POLL_SECONDS = 0.2
+LOCK_STRIPES = 64
+
+_tokens = {}  # user_id -> (access_token, expires_at)
+_connected = {}  # user_id -> (has a token row, checked_monotonic)
+_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def _user_id(user):
+    return getattr(user, 'pk', user)
+
+
+def _usable(expires_at, margin=REFRESH_MARGIN):
+    return expires_at is not None and expires_at - margin > timezone.now()
+
+
+def _remember(row):
+    _tokens[row.user_id] = (row.access_token, row.expires_in)
+    return row.access_token
+
+
+def forget_token(user):
+    """Drop a user's cached access token and connected flag (e.g. after they were replaced or deleted)."""
+    user_id = _user_id(user)
+    _tokens.pop(user_id, None)
+    _connected.pop(user_id, None)
+
+
+def clear_tokens():
+    _tokens.clear()
+    _connected.clear()
+
+
+def save_tokens(user, access_token, refresh_token, expires_at, token_type):
+    """Store tokens from Spotify's authorization callback, replacing any the user had."""
+    row, created = spotifyToken.objects.get_or_create(
+        user=user,
+        defaults={
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'expires_in': expires_at,
+            'token_type': token_type
+        }
+    )
+    if not created:
+        row.access_token = access_token
+        row.refresh_token = refresh_token
+        row.expires_in = expires_at
+        row.token_type = token_type
+        row.save(update_fields=['access_token', 'refresh_token', 'expires_in', 'token_type'])
+    return _remember(row)
+
+
+def connected_user_ids(users):
+    """Return the set of ids among `users` (Users or ids) who have linked Spotify.
+
+    Users with a cached token or a flag younger than CONNECTED_TTL cost
+    nothing; the rest are checked with a single query.
+    """
+    user_ids = {_user_id(user) for user in users}
+    now = time.monotonic()
+    unknown = [user_id for user_id in user_ids
+               if user_id not in _tokens and now - _connected.get(user_id, (None, -CONNECTED_TTL))[1] >= CONNECTED_TTL]
+    if unknown:
+        linked = set(spotifyToken.objects.filter(user_id__in=unknown).values_list('user_id', flat=True))
+        for user_id in unknown:
+            _connected[user_id] = (user_id in linked, now)
+    return {user_id for user_id in user_ids if user_id in _tokens or _connected.get(user_id, (False,))[0]}
+
+
+def is_connected(user):
+    """Whether `user` has linked Spotify; usually answered from memory (see `connected_user_ids`)."""
+    return bool(connected_user_ids([user]))
+
+
+def get_access_token(user):
+    """Return a valid access token for `user` (a User or user id), refreshing it if due; None if unavailable."""
+    user_id = _user_id(user)
+    cached = _tokens.get(user_id)
+    if cached and _usable(cached[1]):
+        return cached[0]
+
+    with _locks[user_id % LOCK_STRIPES]:
+        # Another thread may have refreshed it while we waited
+        cached = _tokens.get(user_id)
+        if cached and _usable(cached[1]):
+            return cached[0]
+        row = spotifyToken.objects.filter(user_id=user_id).order_by('-id').first()
+        if row is None:
+            _tokens.pop(user_id, None)
+            return None
+        if _usable(row.expires_in):
+            return _remember(row)
+        return _refresh(user_id, row=row)
+
+
+def refresh_access_token(user, force=False, within=REFRESH_MARGIN):
+    """Refresh `user`'s access token now if it expires within `within` (always with `force`).
+
+    Returns the current token, or None if the user has none that works.
+    """
+    user_id = _user_id(user)
+    with _locks[user_id % LOCK_STRIPES]:
+        return _refresh(user_id, force, within)
+
+
+def _latest_row(user_id):
+    return spotifyToken.objects.filter(user_id=user_id).order_by('-id').first()
+
+
+def _reread(user_id):
+    """Re-read the user's row after another worker may have changed it; returns its token if still usable."""
+    current = _latest_row(user_id)
+    if current is None:
+        _tokens.pop(user_id, None)
+        return None
+    return _remember(current) if _usable(current.expires_in, timedelta(0)) else None
+
+
+def _claim_refresh(row):
+    """Take the cross-worker refresh lease on `row`; False if another worker holds it."""
+    now = timezone.now()
+    return bool(spotifyToken.objects
+                .filter(Q(refreshing_until__isnull=True) | Q(refreshing_until__lte=now), pk=row.pk)
+                .update(refreshing_until=now + REFRESH_LEASE))
+
+
+def _await_refresh(user_id, row):
+    """Wait for the worker holding the lease to store a new token, then return whatever the row holds."""
+    deadline = time.monotonic() + REFRESH_LEASE.total_seconds()
+    while True:
+        time.sleep(LEASE_POLL_SECONDS)
+        current = _latest_row(user_id)
+        if current is None:
+            _tokens.pop(user_id, None)
+            return None
+        released = current.refreshing_until is None or current.refreshing_until <= timezone.now()
+        if current.access_token != row.access_token or released or time.monotonic() >= deadline:
+            return _remember(current) if _usable(current.expires_in, timedelta(0)) else None
+
+
+def _refresh(user_id, force=False, within=REFRESH_MARGIN, row=None):
+    """Refresh the user's token; call with the user's process lock held.
+
+    `row` is the user's token row if the caller has just read it; otherwise it is read here.
+    """
+    try:
+        if row is None:
+            row = _latest_row(user_id)
+            if row is None:
+                _tokens.pop(user_id, None)
+                return None
+            # Another worker may have refreshed it already
+            if not force and _usable(row.expires_in, within):
+                return _remember(row)
+        if not _claim_refresh(row):
+            return _await_refresh(user_id, row)
+    except Exception as e:
+        logger.error(f"Error refreshing Spotify token for user {user_id}: {e}")
+        return None
+
+    stored = False
+    try:
+        response = get_client().post(ACCOUNTS_TOKEN_URL, data={
+            "grant_type": "refresh_token",
+            "refresh_token": row.refresh_token,
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET
+        }).json()
+        access_token = response.get('access_token')
+        if not access_token:
+            logger.warning(f"Spotify token refresh failed for user {user_id}: {response.get('error')}")
+            # Another worker may have rotated the refresh token (invalid_grant); otherwise
+            # the current token still works until it expires
+            return _reread(user_id)
+
+        fields = {
+            'access_token': access_token,
+            # Spotify may rotate the refresh token
+            'refresh_token': response.get('refresh_token') or row.refresh_token,
+            'token_type': response.get('token_type') or row.token_type,
+            'expires_in': timezone.now() + timedelta(seconds=response.get('expires_in', 3600)),
+            'refreshing_until': None,
+        }
+        # Only replace the token we refreshed; a concurrent refresh elsewhere wins
+        stored = (spotifyToken.objects
+                  .filter(pk=row.pk, access_token=row.access_token, refresh_token=row.refresh_token)
+                  .update(**fields))
+        if not stored:
+            return _reread(user_id)
+        for name, value in fields.items():
+            setattr(row, name, value)
+        return _remember(row)
+    except Exception as e:
+        logger.error(f"Error refreshing Spotify token for user {user_id}: {e}")
+        return None
+    finally:
+        if not stored:
+            # Let the next caller try rather than wait out the lease
+            spotifyToken.objects.filter(pk=row.pk).update(refreshing_until=None)
+
+
+def expiring_user_ids(within, max_expired=timedelta(days=1)):
+    """Ids of active users whose token expires within `within`, soonest first.
+
+    Tokens that expired more than `max_expired` ago are left to be refreshed
+    on the user's next visit, so dead refresh tokens aren't retried every run.
+    """
+    now = timezone.now()
+    return list(
+        spotifyToken.objects
+        .filter(expires_in__lt=now + within, expires_in__gte=now - max_expired, user__is_active=True)
+        .order_by('expires_in')
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+
+
+def refresh_expiring(within, workers=8, max_expired=timedelta(days=1)):
+    """Refresh, `workers` at a time, every token expiring within `within`. Returns (refreshed, failed)."""
+    user_ids = expiring_user_ids(within, max_expired)
+    if not user_ids:
+        return 0, 0
+    counts = {'refreshed': 0, 'failed': 0}
+    counts_lock = threading.Lock()
+
+    def refresh(user_id):
+        refresh_access_token(user_id, within=within)
+        cached = _tokens.get(user_id)
+        ok = cached is not None and _usable(cached[1], within)
+        with counts_lock:
+            counts['refreshed' if ok else 'failed'] += 1
+
+    def refresh_in_worker(user_id):
+        try:
+            refresh(user_id)
+        finally:
+            connection.close()
+
+    if workers <= 1:
+        for user_id in user_ids:
+            refresh(user_id)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(refresh_in_worker, user_ids))
+    return counts['refreshed'], counts['failed']
@@ -0,0 +1,274 @@
+"""
+Per-user swipe candidate queues.
+
+Each user's next swipe candidates live in ``SwipeQueueEntry`` ordered by
+their precomputed compatibility, so the swipe endpoints pop one indexed row
+instead of loading every user and picking at random. When fewer than
+``LOW_WATERMARK`` candidates remain the queue is topped up in a background
+thread (synchronously when it is empty), and the same thread pre-builds the
+card JSON of the next few candidates so serving a card is one cached read.
+
+Serving a candidate only leases it for SERVED_LEASE: a card that was fetched
+but never swiped on (prefetched and dropped, page reloaded) is offered again
+once the lease runs out. Swiping removes the candidate from the queue.
+"""
+
+from datetime import timedelta
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .genre_index import genre_neighbours
+from .models import FriendRequest, Friendship, MusicCompatibility, SwipeDecision, SwipeQueueEntry
+
+logger = logging.getLogger(__name__)
+
+LOW_WATERMARK = getattr(settings, 'SWIPE_QUEUE_LOW_WATERMARK', 10)
+REFILL_SIZE = getattr(settings, 'SWIPE_QUEUE_REFILL_SIZE', 50)
+# Cards kept pre-built ahead of the one being shown
+PREFETCH_COUNT = getattr(settings, 'SWIPE_PREFETCH_COUNT', 3)
+PAYLOAD_TTL = timedelta(seconds=getattr(settings, 'SWIPE_PAYLOAD_TTL_SECONDS', 30 * 60))
+# A served but undecided candidate is offered again after this long
+SERVED_LEASE = timedelta(seconds=getattr(settings, 'SWIPE_SERVED_LEASE_SECONDS', 10 * 60))
+TIME_RANGE = 'long_term'
+
+_refilling = set()
+_refilling_lock = threading.Lock()
+
+
+def _friendship_q(user, other):
+    # Friendships are stored in either order
+    return Q(user1=user, user2=other) | Q(user1=other, user2=user)
+
+
+def _available_q(now=None):
+    """Queue entries that may be served: never served, or served longer than SERVED_LEASE ago."""
+    return Q(served_at__isnull=True) | Q(served_at__lt=(now or timezone.now()) - SERVED_LEASE)
+
+
+def refill_queue(owner, size=REFILL_SIZE):
+    """Queue up to `size` new candidates for `owner`, best compatibility first.
+
+    Candidates with a stored MusicCompatibility score come first; if there
+    aren't enough, unscored users who share the owner's rarest genres follow,
+    then the most recently active unscored users fill the rest with score 0.
+    Users already swiped on or already friends are never added. Entries are
+    deleted once decided, so anyone still in the queue (waiting or leased)
+    is undecided and is skipped only to avoid queueing them twice; a leased
+    entry is offered again by `_pop_entries` when its lease runs out.
+    Returns the number of entries added.
+    """
+    User = get_user_model()
+    queued = SwipeQueueEntry.objects.filter(owner=owner)
+    decided = SwipeDecision.objects.filter(swiper=owner)
+    friendships = Friendship.objects.all()
+    # Drop entries decided outside `record_decision` (or before it removed them), and new friends
+    queued.filter(
+        Q(Exists(decided.filter(target=OuterRef('candidate'))))
+        | Q(Exists(friendships.filter(_friendship_q(owner, OuterRef('candidate')))))
+    ).delete()
+
+    scored = list(
+        MusicCompatibility.objects
+        .filter(user_a=owner, time_range=TIME_RANGE, user_b__is_active=True, user_b__is_superuser=False)
+        .exclude(user_b=owner)
+        .exclude(Exists(queued.filter(candidate=OuterRef('user_b'))))
+        .exclude(Exists(decided.filter(target=OuterRef('user_b'))))
+        .exclude(Exists(friendships.filter(_friendship_q(owner, OuterRef('user_b')))))
+        .order_by('-total_score')
+        .values_list('user_b_id', 'total_score')[:size]
+    )
+    if len(scored) < size:
+        candidates = (
+            User.objects.filter(is_active=True, is_superuser=False)
+            .exclude(id=owner.id)
+            .exclude(id__in=[user_id for user_id, _ in scored])
+            .exclude(Exists(queued.filter(candidate=OuterRef('pk'))))
+            .exclude(Exists(decided.filter(target=OuterRef('pk'))))
+            .exclude(Exists(friendships.filter(_friendship_q(owner, OuterRef('pk')))))
+        )
+        # Unscored users sharing the owner's rarest genres come first, ranked by how many
+        # they share (score in (0, 1], below any real compatibility score)
+        neighbours = genre_neighbours(owner, TIME_RANGE, limit=size)
+        if neighbours:
+            allowed = set(candidates.filter(id__in=[user_id for user_id, _ in neighbours]).values_list('id', flat=True))
+            scored.extend([(user_id, share) for user_id, share in neighbours if user_id in allowed][:size - len(scored)])
+        if len(scored) < size:
+            # Then the most recently active
+            unscored = (
+                candidates.exclude(id__in=[user_id for user_id, _ in scored])
+                .order_by('-last_login', '-id')
+                .values_list('id', flat=True)[:size - len(scored)]
+            )
+            scored.extend((user_id, 0.0) for user_id in unscored)
+
+    SwipeQueueEntry.objects.bulk_create(
+        [SwipeQueueEntry(owner=owner, candidate_id=user_id, score=score) for user_id, score in scored],
+        ignore_conflicts=True,
+    )
+    return len(scored)
+
+
+def _build_payload(owner, candidate):
+    from .views import _build_swipe_payload
+
+    return _build_swipe_payload(owner, candidate)
+
+
+def warm_payloads(owner, count=PREFETCH_COUNT):
+    """Build and store the swipe card JSON for the next `count` queued candidates that lack a fresh one."""
+    cutoff = timezone.now() - PAYLOAD_TTL
+    entries = (
+        SwipeQueueEntry.objects
+        .filter(_available_q(), owner=owner)
+        .exclude(Exists(SwipeDecision.objects.filter(swiper=owner, target=OuterRef('candidate'))))
+        .select_related('candidate')
+        .order_by('-score', 'id')[:count]
+    )
+    built = 0
+    for entry in entries:
+        if entry.payload is not None and entry.prepared_at and entry.prepared_at > cutoff:
+            continue
+        payload = _build_payload(owner, entry.candidate)
+        SwipeQueueEntry.objects.filter(id=entry.id).update(payload=payload, prepared_at=timezone.now())
+        built += 1
+    return built
+
+
+def maintain_queue(owner, warm=PREFETCH_COUNT):
+    """Refill the queue when it is below LOW_WATERMARK, then pre-build the next `warm` cards."""
+    pending = SwipeQueueEntry.objects.filter(_available_q(), owner=owner)
+    if not pending[LOW_WATERMARK - 1:LOW_WATERMARK].exists():
+        refill_queue(owner)
+    if warm:
+        warm_payloads(owner, warm)
+
+
+def _maintain_in_background(owner, warm):
+    if not getattr(settings, 'SWIPE_QUEUE_REFILL_ASYNC', True):
+        maintain_queue(owner, warm)
+        return
+    with _refilling_lock:
+        if owner.id in _refilling:
+            return
+        _refilling.add(owner.id)
+
+    def run():
+        try:
+            maintain_queue(owner, warm)
+        except Exception as e:
+            logger.error(f"Swipe queue maintenance failed for {owner.username}: {e}")
+        finally:
+            with _refilling_lock:
+                _refilling.discard(owner.id)
+            connection.close()
+
+    threading.Thread(target=run, name=f'swipe-queue-{owner.id}', daemon=True).start()
+
+
+def _pop_entries(owner, count):
+    """Lease up to `count` of `owner`'s best undecided available entries (marking them served) and return them."""
+    for attempt in range(2):
+        with transaction.atomic():
+            entries = list(
+                SwipeQueueEntry.objects
+                .select_for_update(skip_locked=True, of=('self',))
+                .filter(_available_q(), owner=owner)
+                .exclude(Exists(SwipeDecision.objects.filter(swiper=owner, target=OuterRef('candidate'))))
+                .exclude(Exists(Friendship.objects.filter(_friendship_q(owner, OuterRef('candidate')))))
+                .select_related('candidate')
+                .order_by('-score', 'id')[:count]
+            )
+            if entries:
+                SwipeQueueEntry.objects.filter(id__in=[e.id for e in entries]).update(served_at=timezone.now())
+                return entries
+        # Empty queue (first visit or drained): fill it now rather than in the background
+        if attempt == 0 and not refill_queue(owner):
+            break
+    return []
+
+
+def pop_cards(owner, count=1):
+    """Pop up to `count` of `owner`'s best queued candidates and return their swipe card payloads.
+
+    Cards prepared by `warm_payloads` are returned as stored; any that
+    weren't are built now. Afterwards the queue is refilled and the next
+    PREFETCH_COUNT cards are warmed in the background, so the following call
+    is a single cached read.
+    """
+    entries = _pop_entries(owner, count)
+    if not entries:
+        return []
+    cutoff = timezone.now() - PAYLOAD_TTL
+    cards = []
+    for entry in entries:
+        if entry.payload is not None and entry.prepared_at and entry.prepared_at > cutoff:
+            cards.append(entry.payload)
+        else:
+            cards.append(_build_payload(owner, entry.candidate))
+    _maintain_in_background(owner, PREFETCH_COUNT)
+    return cards
+
+
+def with_swipe_state(users, swiper):
+    """Annotate a User queryset with `liked_swiper` and `is_friend` relative to `swiper`.
+
+    Both are index lookups (the unique (swiper, target) and (user1, user2)
+    keys), so looking up a swipe target also answers whether liking them is
+    a match, with no further reads.
+    """
+    return users.annotate(
+        liked_swiper=Exists(SwipeDecision.objects.filter(swiper=OuterRef('pk'), target=swiper,
+                                                         action=SwipeDecision.LIKE)),
+        is_friend=Exists(Friendship.objects.filter(_friendship_q(swiper, OuterRef('pk')))),
+    )
+
+
+def record_decision(swiper, target, action):
+    """Store (or overwrite) `swiper`'s like/dislike of `target`; returns True if it made a match.
+
+    A like of someone who already liked `swiper` back creates their
+    Friendship (clearing any pending requests between them); any other like
+    leaves a FriendRequest. Both are single INSERT ... ON CONFLICT DO NOTHING
+    statements in the same transaction as the decision. `target` should come
+    from `with_swipe_state`; otherwise it is looked up again.
+
+    Its annotations only short-circuit dislikes and likes of friends. A like
+    locks both users' rows (in id order) and checks for the reverse like
+    after storing its own, so when two users like each other at the same
+    time the second transaction waits for the first and sees its like.
+    """
+    if not hasattr(target, 'liked_swiper'):
+        target = with_swipe_state(get_user_model().objects.filter(pk=target.pk), swiper).get()
+
+    with transaction.atomic():
+        if action == SwipeDecision.LIKE and not target.is_friend:
+            list(get_user_model().objects.select_for_update().filter(pk__in=[swiper.pk, target.pk])
+                 .order_by('pk').values_list('pk', flat=True))
+        SwipeDecision.objects.bulk_create(
+            [SwipeDecision(swiper=swiper, target=target, action=action, created_at=timezone.now())],
+            update_conflicts=True,
+            unique_fields=['swiper', 'target'],
+            update_fields=['action', 'created_at'],
+        )
+        # Decided: no longer a queued candidate
+        SwipeQueueEntry.objects.filter(owner=swiper, candidate=target).delete()
+        if action != SwipeDecision.LIKE or target.is_friend:
+            return False
+        # Re-read under the lock: the annotation may predate a concurrent like
+        liked_swiper = SwipeDecision.objects.filter(swiper=target, target=swiper, action=SwipeDecision.LIKE).exists()
+        if not liked_swiper:
+            FriendRequest.objects.bulk_create([FriendRequest(from_user=swiper, to_user=target)], ignore_conflicts=True)
+            return False
+
+        user1, user2 = sorted((swiper, target), key=lambda u: u.pk)
+        Friendship.objects.bulk_create([Friendship(user1=user1, user2=user2)], ignore_conflicts=True)
+        FriendRequest.objects.filter(
+            Q(from_user=swiper, to_user=target) | Q(from_user=target, to_user=swiper)
+        ).delete()
+    return True
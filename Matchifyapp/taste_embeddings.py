@@ -0,0 +1,189 @@
+"""
+Low-dimensional taste embeddings and an approximate nearest-neighbour index.
+
+For very large schools even the item index (``item_index``) returns huge
+candidate sets for popular artists. In embedding mode (``TASTE_EMBEDDING_MATCHING``)
+match candidates come from here instead: every user's rank-weighted artist
+and genre vector is projected to ``DIMENSIONS`` dense dimensions by a truncated
+SVD of the user x (artist + genre) matrix, and the nearest users by cosine
+similarity are looked up in an in-process index. Those few hundred users are
+then scored exactly by ``BatchScorer``.
+
+The index uses hnswlib (HNSW graph) when it is installed, and a NumPy
+brute-force dot product otherwise, which is already only a few milliseconds
+for tens of thousands of users.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import svds
+
+from .models import TasteEmbedding
+from .taste_profile import current_interners
+from .taste_snapshots import load_profiles
+
+try:
+    import hnswlib
+except ImportError:  # optional: brute force is used instead
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = getattr(settings, 'TASTE_EMBEDDING_DIMENSIONS', 64)
+# Weight of the genre block relative to the artist block
+GENRE_WEIGHT = 0.5
+# Neighbours fetched per user for exact reranking
+NEIGHBOURS = getattr(settings, 'TASTE_EMBEDDING_NEIGHBOURS', 200)
+# Reload the in-process index from the database after this long
+INDEX_TTL = getattr(settings, 'TASTE_EMBEDDING_INDEX_TTL_SECONDS', 10 * 60)
+# Below this many users an HNSW graph isn't worth building
+HNSW_MIN_USERS = 5000
+
+
+def embedding_matching_enabled():
+    return getattr(settings, 'TASTE_EMBEDDING_MATCHING', False)
+
+
+def taste_matrix(profiles):
+    """Sparse users x (artists + genres) matrix of L2-normalized taste weights.
+
+    An artist at rank i weighs 1/(i+1), like the exact scorer; a genre weighs
+    GENRE_WEIGHT times its share of the user's artists.
+    """
+    interners = current_interners()
+    profiles = [profile.recode(interners) for profile in profiles]
+    rows, cols, weights = [], [], []
+    for row, profile in enumerate(profiles):
+        artists = profile.artists[profile.artists >= 0]
+        rows.append(np.full(len(artists), row))
+        cols.append(artists.astype(np.int64))
+        weights.append(1.0 / (np.nonzero(profile.artists >= 0)[0] + 1))
+    n_artists = int(max((c.max() for c in cols if len(c)), default=-1)) + 1
+    for row, profile in enumerate(profiles):
+        if len(profile.genres):
+            rows.append(np.full(len(profile.genres), row))
+            cols.append(profile.genres.astype(np.int64) + n_artists)
+            weights.append(GENRE_WEIGHT * profile.genre_counts / max(len(profile.artists), 1))
+
+    rows, cols, weights = (np.concatenate(x) if x else np.zeros(0) for x in (rows, cols, weights))
+    # Interned codes are process-wide, so keep only the columns in use
+    used, cols = np.unique(cols.astype(np.int64), return_inverse=True)
+    matrix = sparse.csr_matrix((weights, (rows.astype(np.int64), cols)), shape=(len(profiles), max(len(used), 1)))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    return sparse.diags(np.where(norms > 0, 1.0 / np.maximum(norms, 1e-12), 0.0)) @ matrix
+
+
+def _unit_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.where(norms > 0, vectors / np.maximum(norms, 1e-12), 0.0).astype(np.float32)
+
+
+def compute_embeddings(profiles, dimensions=DIMENSIONS):
+    """Return a (len(profiles), <= dimensions) float32 array of unit-length taste embeddings."""
+    matrix = taste_matrix(profiles)
+    k = min(dimensions, min(matrix.shape) - 1)
+    if k < 1:
+        return _unit_rows(matrix.toarray()[:, :dimensions])
+    u, s, _ = svds(matrix, k=k, random_state=0)
+    return _unit_rows(u * s)
+
+
+def build_embeddings(time_range='long_term', dimensions=DIMENSIONS, batch_size=1000):
+    """Embed every active user with a taste snapshot and store the vectors. Returns the number stored."""
+    data = load_profiles(time_range)
+    if not data:
+        return 0
+    user_ids = list(data)
+    vectors = compute_embeddings([data[u] for u in user_ids], dimensions)
+
+    now = timezone.now()
+    rows = [TasteEmbedding(user_id=user_id, time_range=time_range, vector=vector.astype('<f4').tobytes(), built_at=now)
+            for user_id, vector in zip(user_ids, vectors)]
+    with transaction.atomic():
+        # Users who have since left (or lost their snapshot) drop out of the index
+        TasteEmbedding.objects.filter(time_range=time_range).exclude(user_id__in=user_ids).delete()
+        for start in range(0, len(rows), batch_size):
+            TasteEmbedding.objects.bulk_create(
+                rows[start:start + batch_size],
+                update_conflicts=True,
+                unique_fields=['user', 'time_range'],
+                update_fields=['vector', 'built_at'],
+            )
+    _indexes.pop(time_range, None)
+    return len(rows)
+
+
+class EmbeddingIndex:
+    """Nearest-neighbour search over unit-length user embeddings (cosine similarity)."""
+
+    def __init__(self, user_ids, vectors):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.row_of = {int(user_id): row for row, user_id in enumerate(self.user_ids)}
+        self._hnsw = None
+        if hnswlib is not None and len(self.user_ids) >= HNSW_MIN_USERS:
+            self._hnsw = hnswlib.Index(space='ip', dim=self.vectors.shape[1])
+            self._hnsw.init_index(max_elements=len(self.user_ids), ef_construction=200, M=16)
+            self._hnsw.add_items(self.vectors, np.arange(len(self.user_ids)))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @classmethod
+    def load(cls, time_range):
+        rows = list(TasteEmbedding.objects.filter(time_range=time_range).values_list('user_id', 'vector'))
+        if not rows:
+            return cls([], np.zeros((0, 1), dtype=np.float32))
+        return cls([user_id for user_id, _ in rows],
+                   np.stack([np.frombuffer(bytes(vector), dtype='<f4') for _, vector in rows]))
+
+    def search(self, user_id, k):
+        """Ids of the `k` users most similar to `user_id`, best first; None if it isn't indexed."""
+        row = self.row_of.get(user_id)
+        if row is None:
+            return None
+        k = min(k, len(self) - 1)
+        if k <= 0:
+            return []
+        query = self.vectors[row]
+        if self._hnsw is not None:
+            self._hnsw.set_ef(max(2 * k, 64))
+            labels, _ = self._hnsw.knn_query(query, k=k + 1)
+            rows = labels[0]
+        else:
+            similarity = self.vectors @ query
+            rows = np.argpartition(-similarity, k)[:k + 1]
+            rows = rows[np.argsort(-similarity[rows], kind='stable')]
+        return [int(self.user_ids[r]) for r in rows if r != row][:k]
+
+
+_indexes = {}  # time_range -> (loaded_monotonic, EmbeddingIndex)
+_indexes_lock = threading.Lock()
+
+
+def get_index(time_range='long_term'):
+    """Return the process-wide EmbeddingIndex for `time_range`, reloading it when older than INDEX_TTL."""
+    entry = _indexes.get(time_range)
+    if entry is None or time.monotonic() - entry[0] > INDEX_TTL:
+        with _indexes_lock:
+            entry = _indexes.get(time_range)
+            if entry is None or time.monotonic() - entry[0] > INDEX_TTL:
+                started = time.monotonic()
+                index = EmbeddingIndex.load(time_range)
+                entry = _indexes[time_range] = (time.monotonic(), index)
+                logger.info(f"Loaded {len(index)} taste embeddings ({time_range}) in "
+                            f"{(entry[0] - started) * 1000:.0f}ms"
+                            f"{' into HNSW' if index._hnsw is not None else ''}")
+    return entry[1]
+
+
+def similar_users(user_id, time_range='long_term', k=None):
+    """Ids of the `k` (default NEIGHBOURS) users closest to `user_id` in embedding space, or None if it has none."""
+    return get_index(time_range).search(user_id, NEIGHBOURS if k is None else k)
@@ -0,0 +1,332 @@
+"""
+Compact in-memory representation of a user's music taste.
+
+A ``TasteProfile`` keeps a user's top artists and tracks as NumPy arrays of
+interned integer codes in rank order, plus the codes and counts of their
+artists' genres. Display fields (names, popularity, an image URL, a track's
+artist names) are stored once per process per artist/track in the interners,
+not per user, so a profile is a few hundred bytes instead of the tens of KB
+of Spotify JSON it is built from. Shared items are found with sorted-array
+set operations instead of id -> item dicts.
+
+Once the interners hold MAX_INTERNED keys, new profiles are built with fresh
+ones; older profiles keep theirs and are recoded when compared with newer
+ones, so memory stays bounded without invalidating codes in use.
+
+``to_bytes``/``from_bytes`` give a self-contained binary form (string ids,
+not process-local codes) for caching, e.g. ``TasteSnapshot.profile``.
+"""
+
+from array import array
+import struct
+import sys
+import threading
+
+import numpy as np
+
+# Code of an item without an id; never counts as shared
+MISSING = -1
+# Keys one set of interners may hold before new profiles start on fresh ones
+MAX_INTERNED = 200_000
+
+
+def _merge(base, gaps):
+    """`base` with its missing fields taken from `gaps`."""
+    if base is None or gaps is None:
+        return gaps if base is None else base
+    return tuple(old if old is not None else new for old, new in zip(base, gaps))
+
+
+class Interner:
+    """String id <-> int code table with per-item display info."""
+
+    def __init__(self):
+        self._codes = {}
+        self._keys = []
+        self._info = []
+        self._as_of = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def code(self, key, info=None, as_of=None):
+        """Return the code for `key`, registering it (with its display `info`) on first sight.
+
+        Later `info` replaces the stored one if its `as_of` (when the data was
+        fetched from Spotify) is newer, and otherwise only fills gaps, so the
+        result doesn't depend on the order profiles are loaded in.
+        """
+        if key is None:
+            return MISSING
+        code = self._codes.get(key)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(key)
+                if code is None:
+                    code = len(self._keys)
+                    self._keys.append(key)
+                    self._info.append(info)
+                    self._as_of.append(as_of)
+                    self._codes[key] = code
+                    return code
+        if info is not None:
+            with self._lock:
+                current, seen = self._info[code], self._as_of[code]
+                if as_of is not None and (seen is None or as_of > seen):
+                    self._info[code], self._as_of[code] = _merge(info, current), as_of
+                elif current is None or None in current:
+                    self._info[code] = _merge(current, info)
+        return code
+
+    def key(self, code):
+        return None if code < 0 else self._keys[code]
+
+    def info(self, code):
+        return None if code < 0 else self._info[code]
+
+    def as_of(self, code):
+        return None if code < 0 else self._as_of[code]
+
+    def info_for(self, key):
+        """Display info of `key` if these tables have seen it, else None (never registers it)."""
+        code = self._codes.get(key)
+        return None if code is None else self._info[code]
+
+
+class Interners:
+    """One set of artist, track and genre tables; a profile's codes index the set it was built with."""
+
+    __slots__ = ('artists', 'tracks', 'genres')
+
+    def __init__(self):
+        self.artists = Interner()  # info: (name, genres tuple, popularity, image URL)
+        self.tracks = Interner()  # info: (name, artist names tuple, popularity)
+        self.genres = Interner()
+
+    def full(self):
+        return max(len(self.artists), len(self.tracks), len(self.genres)) >= MAX_INTERNED
+
+
+_interners = Interners()
+_interners_lock = threading.Lock()
+
+
+def current_interners():
+    """The interners new profiles are built with, replaced by fresh ones once full."""
+    global _interners
+    if _interners.full():
+        with _interners_lock:
+            if _interners.full():
+                _interners = Interners()
+    return _interners
+
+
+def artist_info(artist_id):
+    """(name, genres, popularity, image URL) of an artist this process has seen recently, else None."""
+    return _interners.artists.info_for(artist_id)
+
+
+def _image_url(item):
+    images = item.get('images') or (item.get('album') or {}).get('images') or []
+    return images[0].get('url') if images and isinstance(images[0], dict) else None
+
+
+def _codes(values):
+    return np.fromiter(values, dtype=np.int32)
+
+
+class TasteProfile:
+    """One user's ranked artist/track codes and genre counts for a time range."""
+
+    __slots__ = ('time_range', 'artists', 'tracks', 'genres', 'genre_counts', 'interners')
+
+    def __init__(self, time_range, artists, tracks, genres, genre_counts, interners):
+        self.time_range = time_range
+        self.artists = artists  # int32 artist codes, best first
+        self.tracks = tracks  # int32 track codes, best first
+        self.genres = genres  # int32 genre codes in first-seen order
+        self.genre_counts = genre_counts  # int32 number of the user's artists with each genre
+        self.interners = interners  # the Interners the codes index
+
+    @classmethod
+    def from_music_data(cls, data, as_of=None):
+        """Build a profile from {'artists', 'tracks', 'time_range'} of Spotify (or simplified) objects.
+
+        `as_of` is when the data was fetched; newer data updates the interned display info.
+        """
+        interners = current_interners()
+        artists = data.get('artists') or []
+        tracks = data.get('tracks') or []
+        genre_counts = {}
+        artist_codes = []
+        for a in artists:
+            genres = tuple(a.get('genres', []))
+            artist_codes.append(interners.artists.code(
+                a.get('id'), (a.get('name'), genres, a.get('popularity', 0), a.get('image') or _image_url(a)), as_of
+            ))
+            for genre in genres:
+                code = interners.genres.code(genre)
+                genre_counts[code] = genre_counts.get(code, 0) + 1
+        track_codes = [
+            interners.tracks.code(t.get('id'), (t.get('name'),
+                                                tuple(a['name'] if isinstance(a, dict) else a
+                                                      for a in t.get('artists', [])),
+                                                t.get('popularity', 0)), as_of)
+            for t in tracks
+        ]
+        return cls(
+            data.get('time_range'),
+            _codes(artist_codes),
+            _codes(track_codes),
+            _codes(genre_counts.keys()),
+            _codes(genre_counts.values()),
+            interners,
+        )
+
+    @classmethod
+    def coerce(cls, data):
+        """Return `data` if it is already a profile, else build one from a music data dict."""
+        return data if isinstance(data, cls) else cls.from_music_data(data)
+
+    def recode(self, interners):
+        """This profile with its codes in `interners` (itself if it already uses them)."""
+        if interners is self.interners:
+            return self
+
+        def move(codes, source, target):
+            return _codes(target.code(source.key(c), source.info(c), source.as_of(c)) for c in codes.tolist())
+
+        mine = self.interners
+        return TasteProfile(
+            self.time_range,
+            move(self.artists, mine.artists, interners.artists),
+            move(self.tracks, mine.tracks, interners.tracks),
+            move(self.genres, mine.genres, interners.genres),
+            self.genre_counts,
+            interners,
+        )
+
+    # --- Set operations ---
+    @staticmethod
+    def _shared(mine, theirs):
+        """(mask over `mine` of items also in `theirs`, index of each in `theirs` (first occurrence))."""
+        if not len(mine) or not len(theirs):
+            return np.zeros(len(mine), dtype=bool), np.zeros(len(mine), dtype=np.int64)
+        keys, first = np.unique(theirs, return_index=True)
+        pos = np.minimum(np.searchsorted(keys, mine), len(keys) - 1)
+        return (keys[pos] == mine) & (mine != MISSING), first[pos]
+
+    def shared_artists(self, other):
+        return self._shared(self.artists, other.recode(self.interners).artists)
+
+    def shared_tracks(self, other):
+        return self._shared(self.tracks, other.recode(self.interners).tracks)
+
+    def shared_genres(self, other):
+        """Codes of genres both users have, in this user's first-seen order."""
+        return self.genres[np.isin(self.genres, other.recode(self.interners).genres)]
+
+    # --- Display helpers ---
+    def artist_dicts(self, codes):
+        artists = self.interners.artists
+        out = []
+        for code in codes:
+            name, genres, popularity, image = artists.info(int(code)) or (None, (), 0, None)
+            out.append({'id': artists.key(int(code)), 'name': name, 'genres': list(genres),
+                        'popularity': popularity, 'image': image})
+        return out
+
+    def track_dicts(self, codes):
+        tracks = self.interners.tracks
+        out = []
+        for code in codes:
+            name, artists, popularity = tracks.info(int(code)) or (None, (), 0)
+            out.append({'id': tracks.key(int(code)), 'name': name, 'artists': list(artists),
+                        'popularity': popularity})
+        return out
+
+    def genre_names(self, codes):
+        return [self.interners.genres.key(int(c)) for c in codes]
+
+    def top_genres(self, limit=None):
+        """[{'genre': name, 'count': n}] most common first (ties in first-seen order)."""
+        order = np.argsort(-self.genre_counts, kind='stable')[:limit]
+        names = self.genre_names(self.genres[order])
+        return [{'genre': name, 'count': int(self.genre_counts[i])} for name, i in zip(names, order)]
+
+    def artist_ids(self):
+        return [self.interners.artists.key(int(c)) for c in self.artists]
+
+    def track_ids(self):
+        return [self.interners.tracks.key(int(c)) for c in self.tracks]
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ('artists', 'tracks', 'genres', 'genre_counts'))
+
+    # --- Binary form ---
+    # Header: magic, version, then the number of artists, tracks, genres,
+    # strings and body ints. Body: uint32 ints -- the time range; per artist
+    # id, name, popularity, image, n_genres, genre...; per track id, name,
+    # popularity, n_artists, artist name...; per genre name, count -- then the
+    # NUL-separated UTF-8 string table they index (0 = None).
+    _HEADER = struct.Struct('<2sBIIIII')
+    _MAGIC = b'TP'
+    _VERSION = 1
+
+    def to_bytes(self):
+        strings = {}
+
+        def ref(value):
+            if value is None:
+                return 0
+            return strings.setdefault(value, len(strings) + 1)
+
+        ints = array('I', [ref(self.time_range)])
+        for artist in self.artist_dicts(self.artists):
+            ints.extend((ref(artist['id']), ref(artist['name']), artist['popularity'] or 0,
+                         ref(artist['image']), len(artist['genres'])))
+            ints.extend(ref(g) for g in artist['genres'])
+        for track in self.track_dicts(self.tracks):
+            ints.extend((ref(track['id']), ref(track['name']), track['popularity'] or 0, len(track['artists'])))
+            ints.extend(ref(a) for a in track['artists'])
+        for name, count in zip(self.genre_names(self.genres), self.genre_counts.tolist()):
+            ints.extend((ref(name), count))
+        if sys.byteorder == 'big':
+            ints.byteswap()
+        header = self._HEADER.pack(self._MAGIC, self._VERSION, len(self.artists), len(self.tracks),
+                                   len(self.genres), len(strings), len(ints))
+        return header + ints.tobytes() + '\0'.join(strings).encode('utf-8')
+
+    @classmethod
+    def from_bytes(cls, blob, as_of=None):
+        magic, version, n_artists, n_tracks, n_genres, n_strings, n_ints = cls._HEADER.unpack_from(blob)
+        if magic != cls._MAGIC or version != cls._VERSION:
+            raise ValueError('Not a serialized TasteProfile')
+        offset = cls._HEADER.size
+        ints = array('I')
+        ints.frombytes(blob[offset:offset + 4 * n_ints])
+        if sys.byteorder == 'big':
+            ints.byteswap()
+        table = bytes(blob[offset + 4 * n_ints:]).decode('utf-8')
+        strings = [None] + (table.split('\0') if n_strings else [])
+
+        interners = current_interners()
+        it = iter(ints)
+        time_range = strings[next(it)]
+        artists = []
+        for _ in range(n_artists):
+            aid, name, popularity, image, n_names = (next(it) for _ in range(5))
+            genres = tuple(strings[next(it)] for _ in range(n_names))
+            artists.append(interners.artists.code(strings[aid], (strings[name], genres, popularity, strings[image]),
+                                                  as_of))
+        tracks = []
+        for _ in range(n_tracks):
+            tid, name, popularity, n_names = (next(it) for _ in range(4))
+            names = tuple(strings[next(it)] for _ in range(n_names))
+            tracks.append(interners.tracks.code(strings[tid], (strings[name], names, popularity), as_of))
+        genres, counts = [], []
+        for _ in range(n_genres):
+            genres.append(interners.genres.code(strings[next(it)]))
+            counts.append(next(it))
+        return cls(time_range, _codes(artists), _codes(tracks), _codes(genres), _codes(counts), interners)
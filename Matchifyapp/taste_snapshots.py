@@ -0,0 +1,228 @@
+"""
+Read-through cache of users' Spotify taste (top artists, tracks, genres).
+
+Compatibility scoring, profile pages and the swipe UI all need the same
+/me/top/artists and /me/top/tracks payloads. Instead of calling Spotify for
+every pair of users, the payloads are stored per (user, time_range) in
+``TasteSnapshot`` and only re-fetched once the snapshot's TTL has passed.
+
+Scoring, taste summaries and swipe cards read a snapshot as a compact
+``TasteProfile`` through ``get_user_music_data``, which memoizes it per
+request (see ``middleware.TasteMemoMiddleware``) and per process for
+``MEMO_TTL`` seconds, so a user's snapshot is loaded and parsed once however
+many consumers need it. The profile's binary form is stored alongside the raw
+JSON so it never has to be rebuilt from the JSON.
+"""
+
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from datetime import timedelta
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import TasteSnapshot
+from .taste_profile import TasteProfile
+from .spotify_client import API_BASE, get_client
+
+logger = logging.getLogger(__name__)
+
+# How long a snapshot is served without going back to Spotify.
+SNAPSHOT_TTL = timedelta(seconds=getattr(settings, 'TASTE_SNAPSHOT_TTL_SECONDS', 6 * 60 * 60))
+# After a failed refresh, the expired snapshot is served this long before Spotify is tried again.
+REFRESH_RETRY = timedelta(seconds=getattr(settings, 'TASTE_SNAPSHOT_RETRY_SECONDS', 10 * 60))
+# Spotify's maximum page size for the top items endpoints.
+SNAPSHOT_LIMIT = 50
+# How long compact music data is kept in process memory, and for how many (user, time_range) keys.
+MEMO_TTL = getattr(settings, 'TASTE_MEMO_TTL_SECONDS', 60)
+MEMO_MAX_ENTRIES = getattr(settings, 'TASTE_MEMO_MAX_ENTRIES', 2048)
+
+_memo = OrderedDict()  # (user_id, time_range) -> (expires_monotonic, TasteProfile)
+_memo_lock = threading.Lock()
+# Per-request memo, set up by middleware.TasteMemoMiddleware; None outside a request
+request_memo = ContextVar('taste_request_memo', default=None)
+
+
+def _fetch_top_items(user, kind, time_range, headers):
+    """Fetch one page of /me/top/<kind>. Returns a list of items or None on failure."""
+    url = f"{API_BASE}me/top/{kind}"
+    response = get_client().get(url, headers=headers, params={
+        'time_range': time_range,
+        'limit': SNAPSHOT_LIMIT
+    })
+    if response.status_code != 200:
+        logger.info(f"Spotify top {kind} for {user.username} returned {response.status_code}")
+        return None
+    return response.json().get('items', [])
+
+
+def count_genres(artists):
+    """Return [{'genre': name, 'count': n}] for the genres of `artists`, most common first."""
+    genres = []
+    for artist in artists:
+        genres.extend(artist.get('genres', []))
+    return [{'genre': genre, 'count': count} for genre, count in Counter(genres).most_common()]
+
+
+def refresh_snapshot(user, time_range):
+    """Fetch fresh top artists/tracks from Spotify and store them. Returns the snapshot or None."""
+    try:
+        from .views import get_auth_header
+
+        headers = get_auth_header(user)
+        if not headers:
+            return None
+
+        artists = _fetch_top_items(user, 'artists', time_range, headers)
+        if artists is None:
+            return None
+        tracks = _fetch_top_items(user, 'tracks', time_range, headers)
+        if tracks is None:
+            return None
+
+        now = timezone.now()
+        snapshot, _ = TasteSnapshot.objects.update_or_create(
+            user=user,
+            time_range=time_range,
+            defaults={
+                'artists': artists,
+                'tracks': tracks,
+                'genres': count_genres(artists),
+                'profile': TasteProfile.from_music_data(
+                    {'artists': artists, 'tracks': tracks, 'time_range': time_range}, as_of=now
+                ).to_bytes(),
+                'refreshed_at': now,
+                'expires_at': now + SNAPSHOT_TTL,
+            }
+        )
+        return snapshot
+    except Exception as e:
+        logger.error(f"Error refreshing taste snapshot for {getattr(user, 'username', user)}: {e}")
+        return None
+
+
+def get_snapshot(user, time_range, allow_stale=True):
+    """Return the user's TasteSnapshot for `time_range`, refreshing it when expired.
+
+    If the refresh fails (no token, Spotify error) an expired snapshot is still
+    returned when `allow_stale` is True, so a Spotify outage degrades to slightly
+    old data rather than no data. Its ``expires_at`` is then pushed
+    REFRESH_RETRY ahead (``refreshed_at`` keeps its age), so the refresh isn't
+    retried on every read and the stale data can be memoized meanwhile.
+    """
+    snapshot = TasteSnapshot.objects.filter(user=user, time_range=time_range).first()
+    if snapshot is not None and snapshot.is_fresh():
+        return snapshot
+
+    fresh = refresh_snapshot(user, time_range)
+    if fresh is not None:
+        return fresh
+    if snapshot is not None:
+        snapshot.expires_at = timezone.now() + REFRESH_RETRY
+        TasteSnapshot.objects.filter(pk=snapshot.pk).update(expires_at=snapshot.expires_at)
+    return snapshot if allow_stale else None
+
+
+def profile_for(snapshot):
+    """Return the TasteProfile of a snapshot, from its stored binary form when it has one."""
+    if snapshot.profile:
+        try:
+            return TasteProfile.from_bytes(snapshot.profile, as_of=snapshot.refreshed_at)
+        except ValueError:
+            logger.info(f"Rebuilding unreadable taste profile for user {snapshot.user_id}")
+    return TasteProfile.from_music_data(
+        {'artists': snapshot.artists, 'tracks': snapshot.tracks, 'time_range': snapshot.time_range},
+        as_of=snapshot.refreshed_at,
+    )
+
+
+def load_profiles(time_range, user_ids=None):
+    """{user_id: TasteProfile} for active, non-admin users with a snapshot (optionally only `user_ids`)."""
+    snapshots = TasteSnapshot.objects.filter(time_range=time_range, user__is_active=True, user__is_superuser=False)
+    if user_ids is not None:
+        snapshots = snapshots.filter(user_id__in=user_ids)
+    # Stored binary profiles are a fraction of the raw JSON; only rows written before they existed load the JSON
+    data = {
+        user_id: TasteProfile.from_bytes(blob, as_of=refreshed_at)
+        for user_id, blob, refreshed_at in
+        snapshots.exclude(profile=None).values_list('user_id', 'profile', 'refreshed_at').iterator()
+    }
+    fields = ('user_id', 'time_range', 'artists', 'tracks', 'profile', 'refreshed_at')
+    for snapshot in snapshots.filter(profile=None).only(*fields).iterator():
+        data[snapshot.user_id] = profile_for(snapshot)
+    return data
+
+
+def _memo_get(key):
+    memo = request_memo.get()
+    if memo is not None and key in memo:
+        return memo[key]
+    with _memo_lock:
+        entry = _memo.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _memo[key]
+            return None
+        _memo.move_to_end(key)
+    if memo is not None:
+        memo[key] = entry[1]
+    return entry[1]
+
+
+def _memo_set(key, data, ttl):
+    memo = request_memo.get()
+    if memo is not None:
+        memo[key] = data
+    if ttl <= 0:
+        return
+    with _memo_lock:
+        _memo[key] = (time.monotonic() + ttl, data)
+        _memo.move_to_end(key)
+        while len(_memo) > MEMO_MAX_ENTRIES:
+            _memo.popitem(last=False)
+
+
+def forget_music_data(user_id, time_range=None):
+    """Drop memoized music data for a user (one time range, or all of them)."""
+    memo = request_memo.get()
+    with _memo_lock:
+        for store in (_memo, memo or {}):
+            for key in [k for k in store if k[0] == user_id and (time_range is None or k[1] == time_range)]:
+                del store[key]
+
+
+def clear_memo():
+    """Empty the process-wide memo (e.g. between tests)."""
+    with _memo_lock:
+        _memo.clear()
+
+
+def get_user_music_data(user, time_range):
+    """Return the user's TasteProfile for `time_range`, or None if unavailable.
+
+    Served from the request memo, then the process memo, then the user's
+    snapshot (refreshing it from Spotify when expired). Missing data isn't
+    memoized, so a user who links Spotify shows up straight away; stale data
+    whose refresh failed is, until the refresh is due to be retried.
+    """
+    key = (user.pk, time_range)
+    data = _memo_get(key)
+    if data is not None:
+        return data
+
+    snapshot = get_snapshot(user, time_range)
+    if snapshot is None:
+        return None
+    data = profile_for(snapshot)
+    # Never keep data in memory past the point the snapshot itself is due a refresh
+    _memo_set(key, data, min(MEMO_TTL, (snapshot.expires_at - timezone.now()).total_seconds()))
+    return data
+
+
+def invalidate_snapshots(user):
+    """Drop all cached snapshots for a user (e.g. after they re-link Spotify)."""
+    TasteSnapshot.objects.filter(user=user).delete()
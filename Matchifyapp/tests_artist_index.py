@@ -0,0 +1,81 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import artist_index
+from .models import ArtistListen, TasteSnapshot, spotifyToken
+
+User = get_user_model()
+
+
+class ArtistIndexTests(TestCase):
+    def setUp(self):
+        artist_index._index = None
+        self.addCleanup(setattr, artist_index, '_index', None)
+        self.user = User.objects.create_user(username='me', email='me@uni.edu', password='pass')
+        spotifyToken.objects.create(user=self.user, access_token='tok', refresh_token='r', token_type='Bearer',
+                                    expires_in=timezone.now() + timedelta(hours=1))
+        other = User.objects.create_user(username='other', password='pass')
+        for u in (self.user, other):
+            ArtistListen.objects.create(user=u, artist_id='b1', artist_name='The Beatles', play_count=1)
+        ArtistListen.objects.create(user=other, artist_id='b2', artist_name='Beach House', play_count=1)
+        now = timezone.now()
+        TasteSnapshot.objects.create(
+            user=other, time_range='long_term', refreshed_at=now, expires_at=now,
+            artists=[{'id': 'b3', 'name': 'Beyoncé', 'genres': []}], tracks=[], genres=[]
+        )
+
+    def test_prefix_search_from_local_data(self):
+        self.client.force_login(self.user)
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.request') as request:
+            resp = self.client.get(reverse('leaderboard_autocomplete'), {'q': 'Be'})
+            # Word prefixes and accent-insensitive matches
+            self.assertEqual(artist_index.get_index().search('beat'), [{'id': 'b1', 'name': 'The Beatles'}])
+            self.assertEqual(artist_index.get_index().search('beyo')[0]['id'], 'b3')
+        request.assert_not_called()
+        # The Beatles have the most listeners
+        self.assertEqual([r['id'] for r in resp.json()['results']], ['b1', 'b2', 'b3'])
+
+    def test_miss_falls_back_to_spotify_and_is_indexed(self):
+        resp = mock.Mock(status_code=200)
+        resp.json.return_value = {'artists': {'items': [{'id': 'r1', 'name': 'Radiohead'}]}}
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', return_value=resp) as get:
+            self.assertEqual(artist_index.suggest_artists(self.user, 'radio'), [{'id': 'r1', 'name': 'Radiohead'}])
+            self.assertEqual(get.call_args.kwargs['params']['limit'], 5)
+            get.reset_mock()
+            self.assertEqual(artist_index.suggest_artists(self.user, 'radioh'), [{'id': 'r1', 'name': 'Radiohead'}])
+            get.assert_not_called()
+
+        # Still indexed after the next rebuild
+        artist_index._built_at -= artist_index.INDEX_TTL + 1
+        with self.settings(ARTIST_INDEX_REBUILD_ASYNC=False):
+            self.assertEqual(artist_index.get_index().search('radio'), [{'id': 'r1', 'name': 'Radiohead'}])
+
+    def test_most_listened_artists_rank_first_however_many_match(self):
+        listener = User.objects.create_user(username='fan', password='pass')
+        # Hundreds of alphabetically earlier matches with one listener each
+        ArtistListen.objects.bulk_create(
+            ArtistListen(user=listener, artist_id=f'x{i}', artist_name=f'Ba {i:04d}', play_count=1) for i in range(600)
+        )
+        index = artist_index.get_index()
+        for query in ('b', 'be', 'the b'):
+            self.assertEqual(index.search(query, limit=1), [{'id': 'b1', 'name': 'The Beatles'}])
+        self.assertEqual(index.search('ba 05', limit=3)[0]['name'], 'Ba 0500')
+
+    def test_stale_index_is_served_while_rebuilding(self):
+        index = artist_index.get_index()
+        artist_index._built_at -= artist_index.INDEX_TTL + 1
+        with artist_index._build_lock, mock.patch.object(artist_index.ArtistIndex, 'build') as build:
+            # Another thread holds the rebuild: the current index is returned without waiting
+            self.assertIs(artist_index.get_index(), index)
+        build.assert_not_called()
+
+        ArtistListen.objects.create(user=self.user, artist_id='r1', artist_name='Radiohead', play_count=1)
+        with self.settings(ARTIST_INDEX_REBUILD_ASYNC=False):
+            rebuilt = artist_index.get_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(rebuilt.search('radio'), [{'id': 'r1', 'name': 'Radiohead'}])
@@ -0,0 +1,360 @@
+from datetime import timedelta
+import json
+import random
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.test import TestCase
+from django.utils import timezone
+import numpy as np
+
+from .batch_scoring import BatchScorer, _finalize_block
+from .compatibility import MusicMatchingAlgorithm, find_top_music_matches, get_music_compatibility, get_music_taste_summary
+from .compatibility_store import get_compatibility, match_candidates, rebuild_compatibility
+from .genre_index import clear_user_counts
+from .item_index import candidate_ids
+from .models import MusicCompatibility, TasteSnapshot, TopItem, spotifyToken
+from .score_calibration import build_calibration, calibrate, recalibrate_stored, reset_calibration
+from .taste_embeddings import EmbeddingIndex, build_embeddings, similar_users
+from .taste_profile import TasteProfile
+from .taste_snapshots import clear_memo, get_user_music_data, request_memo
+
+User = get_user_model()
+
+
+def _artist(i, genres=()):
+    return {'id': f'a{i}', 'name': f'Artist {i}', 'genres': list(genres), 'popularity': 50}
+
+
+def _track(i):
+    return {'id': f't{i}', 'name': f'Track {i}', 'artists': [{'name': f'Artist {i}'}], 'popularity': 50}
+
+
+def _fake_spotify(url, headers=None, params=None, **kwargs):
+    """Stand-in for requests.get returning a fixed top-artists/top-tracks page."""
+    resp = mock.Mock(status_code=200)
+    if url.endswith('/artists'):
+        items = [_artist(i, genres=['indie', f'g{i % 3}']) for i in range(20)]
+    else:
+        items = [_track(i) for i in range(20)]
+    resp.json.return_value = {'items': items}
+    return resp
+
+
+class TasteSnapshotTests(TestCase):
+    def setUp(self):
+        clear_memo()
+        self.u1 = User.objects.create_user(username='alice', password='pass')
+        self.u2 = User.objects.create_user(username='bob', password='pass')
+        for u in (self.u1, self.u2):
+            spotifyToken.objects.create(
+                user=u, access_token='tok', refresh_token='ref', token_type='Bearer',
+                expires_in=timezone.now() + timedelta(hours=1),
+            )
+
+    def test_compatibility_reuses_snapshots(self):
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', side_effect=_fake_spotify) as get:
+            first = get_music_compatibility(self.u1, self.u2)
+            second = get_music_compatibility(self.u1, self.u2)
+            summary = get_music_taste_summary(self.u2)
+        # One artists + one tracks call per user; everything after is served from the snapshot
+        self.assertEqual(get.call_count, 4)
+        self.assertEqual(first, second)
+        self.assertEqual(TasteSnapshot.objects.count(), 2)
+        self.assertEqual(summary['top_genres'][0], {'genre': 'indie', 'count': 20})
+
+    def test_expired_snapshot_is_refreshed_and_kept_on_failure(self):
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', side_effect=_fake_spotify):
+            get_music_taste_summary(self.u1)
+        TasteSnapshot.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        clear_memo()
+
+        failing = mock.Mock(status_code=503)
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', return_value=failing) as get:
+            summary = get_music_taste_summary(self.u1)
+        self.assertEqual(get.call_count, 1)
+        # The stale snapshot is still served when Spotify is unavailable
+        self.assertEqual(summary['total_artists'], 20)
+
+        # ...and neither Spotify nor the database is asked again until the retry is due
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', return_value=failing) as get:
+            with self.assertNumQueries(0):
+                self.assertEqual(len(get_user_music_data(self.u1, 'long_term').artists), 20)
+            clear_memo()
+            get_user_music_data(self.u1, 'long_term')
+        get.assert_not_called()
+        self.assertTrue(TasteSnapshot.objects.get(user=self.u1).is_fresh())
+
+    def test_music_data_is_compact_and_memoized(self):
+        snapshot = _snapshot(self.u1, range(3), range(2))
+        data = get_user_music_data(self.u1, 'long_term')
+        self.assertEqual(data.artist_ids(), ['a0', 'a1', 'a2'])
+        self.assertEqual(data.artist_dicts(data.artists[1:2]), [{'id': 'a1', 'name': 'Artist 1', 'genres': ['g1'],
+                                                                 'popularity': 50, 'image': None}])
+        self.assertEqual(data.track_dicts(data.tracks[:1])[0]['artists'], ['Artist 0'])
+        with self.assertNumQueries(0):
+            self.assertIs(get_user_music_data(self.u1, 'long_term'), data)
+
+        # The request memo keeps serving within a request even once the process memo is gone
+        token = request_memo.set({})
+        try:
+            get_user_music_data(self.u1, 'long_term')
+            clear_memo()
+            with self.assertNumQueries(0):
+                self.assertIs(get_user_music_data(self.u1, 'long_term'), data)
+        finally:
+            request_memo.reset(token)
+
+        # Rewriting the snapshot drops the memoized copy
+        snapshot.artists = []
+        snapshot.save()
+        self.assertEqual(len(get_user_music_data(self.u1, 'long_term').artists), 0)
+
+
+def _snapshot(user, artist_ids, track_ids, time_range='long_term'):
+    artists = [_artist(i, genres=[f'g{i % 4}']) for i in artist_ids]
+    now = timezone.now()
+    return TasteSnapshot.objects.create(
+        user=user, time_range=time_range,
+        artists=artists, tracks=[_track(i) for i in track_ids],
+        genres=[{'genre': f'g{i % 4}', 'count': 1} for i in artist_ids],
+        refreshed_at=now, expires_at=now + timedelta(hours=6),
+    )
+
+
+class CompatibilityTableTests(TestCase):
+    def setUp(self):
+        clear_memo()
+        clear_user_counts()
+        self.addCleanup(clear_user_counts)
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(4)]
+        _snapshot(self.users[0], range(0, 20), range(0, 20))
+        _snapshot(self.users[1], range(0, 20), range(5, 25))
+        _snapshot(self.users[2], range(10, 30), range(40, 60))
+        _snapshot(self.users[3], range(100, 120), range(100, 120))
+
+    def test_full_rebuild_matches_live_scores(self):
+        stats = rebuild_compatibility(full=True)
+        self.assertEqual(stats['rows_written'], 4 * 3)
+        for a in self.users:
+            for b in self.users:
+                if a == b:
+                    continue
+                stored = MusicCompatibility.objects.get(user_a=a, user_b=b, time_range='long_term')
+                live = get_music_compatibility(a, b)
+                self.assertEqual(stored.total_score, live['total_score'])
+                self.assertEqual(stored.breakdown, live['breakdown'])
+
+    def test_incremental_rebuild_only_touches_changed_users(self):
+        rebuild_compatibility(full=True)
+        self.assertEqual(rebuild_compatibility()['rows_written'], 0)
+
+        TasteSnapshot.objects.filter(user=self.users[3]).update(refreshed_at=timezone.now() + timedelta(seconds=1))
+        stats = rebuild_compatibility()
+        self.assertEqual(stats['changed_users'], 1)
+        self.assertEqual(stats['rows_written'], 2 * 3)
+
+    def test_incremental_rebuild_writes_both_directions(self):
+        rebuild_compatibility(full=True)
+        MusicCompatibility.objects.all().delete()
+        u0, u1 = self.users[0].id, self.users[1].id
+        # Candidate lists aren't always symmetric (capped genre matches, embedding neighbours)
+        with mock.patch('Matchifyapp.compatibility_store.match_candidates',
+                        side_effect=lambda user_id, time_range: {u1} if user_id == u0 else set()):
+            stats = rebuild_compatibility()
+        self.assertEqual(stats['rows_written'], 2)
+        self.assertEqual(set(MusicCompatibility.objects.values_list('user_a_id', 'user_b_id')), {(u0, u1), (u1, u0)})
+
+    def test_full_rebuild_prunes_rows_it_did_not_write(self):
+        rebuild_compatibility(full=True)
+        TasteSnapshot.objects.filter(user=self.users[3]).delete()
+        stats = rebuild_compatibility(full=True)
+        self.assertEqual(stats['rows_written'], 3 * 2)
+        self.assertEqual(stats['rows_deleted'], 2 * 3)
+        self.assertFalse(MusicCompatibility.objects.filter(Q(user_a=self.users[3]) | Q(user_b=self.users[3])).exists())
+
+    def test_top_matches_and_lookup_read_from_table(self):
+        rebuild_compatibility(full=True)
+        with self.assertNumQueries(1):
+            matches = find_top_music_matches(self.users[0], min_score=0)
+        self.assertEqual(matches[0]['user'], self.users[1])
+        with self.assertNumQueries(1):
+            get_compatibility(self.users[0], self.users[2])
+
+
+    def test_candidates_come_from_the_item_and_genre_indexes(self):
+        loner = User.objects.create_user(username='loner', password='pass')
+        now = timezone.now()
+        TasteSnapshot.objects.create(user=loner, time_range='long_term', refreshed_at=now, expires_at=now,
+                                     artists=[_artist(i, genres=['polka']) for i in range(200, 210)],
+                                     tracks=[_track(200)], genres=[{'genre': 'polka', 'count': 10}])
+        self.assertEqual(TopItem.objects.filter(user=loner).count(), 11)
+        self.assertEqual(candidate_ids(loner.id, 'long_term'), set())
+        self.assertEqual(candidate_ids(self.users[0].id, 'long_term'), {u.id for u in self.users[1:]})
+
+        # Nothing stored yet: match search scores only the candidates
+        matches = find_top_music_matches(self.users[0], min_score=0)
+        self.assertEqual([m['user'] for m in matches][0], self.users[1])
+        self.assertEqual(MusicCompatibility.objects.count(), 3)
+
+        stats = rebuild_compatibility()
+        self.assertFalse(MusicCompatibility.objects.filter(Q(user_a=loner) | Q(user_b=loner)).exists())
+        self.assertEqual(stats['rows_written'], 4 * 3)
+
+
+class BatchScorerTests(TestCase):
+    def test_block_finalize_matches_pairwise_finalize(self):
+        rng = np.random.default_rng(3)
+        artist, genre, track = (np.round(rng.uniform(0, 100, 500), 2) for _ in range(3))
+        # Exact halves, empty breakdowns and non-positive totals
+        artist[:4], genre[:4], track[:4] = [0.05, 0.15, 0.0, 0.0], [2.25, 0.35, 0.0, 3.0], [0.45, 0.0, 0.0, 0.0]
+        raw_total = artist * 0.45 + genre * 0.30 + track * 0.25
+        raw_total[2:4] = [0.0, -1.0]
+        algorithm = MusicMatchingAlgorithm()
+        block = [values.tolist() for values in _finalize_block(artist, genre, track, raw_total)]
+        for i in range(len(raw_total)):
+            expected = algorithm._finalize_result(float(raw_total[i]), {
+                'artist_compatibility': round(float(artist[i]), 1),
+                'genre_compatibility': round(float(genre[i]), 1),
+                'track_compatibility': round(float(track[i]), 1),
+            }, [], [], [])
+            self.assertEqual([column[i] for column in block],
+                             [expected['total_score'], *expected['breakdown'].values()])
+
+    def test_matches_pairwise_algorithm(self):
+        rng = random.Random(7)
+        data = {}
+        for user_id in range(1, 31):
+            artist_ids = rng.sample(range(80), rng.randint(0, 50))
+            track_ids = rng.sample(range(150), rng.randint(0, 50))
+            data[user_id] = {
+                'artists': [_artist(i, genres=rng.sample([f'g{k}' for k in range(25)], rng.randint(0, 3))) for i in artist_ids],
+                'tracks': [_track(i) for i in track_ids],
+            }
+        algorithm = MusicMatchingAlgorithm()
+        scorer = BatchScorer(data)
+
+        pairs = 0
+        for a, b, raw_score, result in scorer.iter_pair_scores(block_size=7, include_common=True):
+            expected_raw, expected = algorithm.score_music_data(data[a], data[b])
+            self.assertAlmostEqual(raw_score, expected_raw, places=9)
+            self.assertEqual(result, expected)
+            pairs += 1
+        self.assertEqual(pairs, 30 * 29)
+
+        ranked = scorer.score_candidates(1)
+        self.assertEqual(len(ranked), 29)
+        self.assertEqual([r['total_score'] for _, r in ranked], sorted((r['total_score'] for _, r in ranked), reverse=True))
+
+
+class TasteProfileTests(TestCase):
+    def test_binary_round_trip_and_size(self):
+        # Ids of their own: display info is shared process-wide and the first-seen copy is kept
+        artists = [dict(_artist(i, genres=['indie', f'g{i % 3}']), id=f'p{i}', images=[{'url': f'https://i/{i}', 'height': 640}],
+                        followers={'total': 1000 + i}, external_urls={'spotify': f'https://open.spotify.com/artist/a{i}'})
+                   for i in range(50)]
+        data = {'artists': artists, 'tracks': [_track(i) for i in range(50)], 'time_range': 'long_term'}
+        profile = TasteProfile.from_music_data(data)
+        blob = profile.to_bytes()
+        copy = TasteProfile.from_bytes(blob)
+
+        self.assertEqual(copy.artist_ids(), profile.artist_ids())
+        self.assertEqual(copy.top_genres(), profile.top_genres())
+        self.assertEqual(copy.top_genres(1), [{'genre': 'indie', 'count': 50}])
+        self.assertEqual(copy.artist_dicts(copy.artists[:1])[0]['image'], 'https://i/0')
+        self.assertEqual(copy.time_range, 'long_term')
+        # Per-user arrays are a small fraction of the JSON they replace
+        self.assertLess(profile.nbytes() * 10, len(json.dumps(data)))
+        self.assertLess(len(blob), len(json.dumps(data)))
+
+        algorithm = MusicMatchingAlgorithm()
+        self.assertEqual(algorithm.score_music_data(copy, profile), algorithm.score_music_data(data, data))
+
+    def test_fresher_snapshot_updates_display_info(self):
+        now = timezone.now()
+        data = {'artists': [dict(_artist(1), id='r1', name='Old Name', popularity=10)], 'tracks': []}
+        profile = TasteProfile.from_music_data(data, as_of=now - timedelta(days=1))
+        TasteProfile.from_music_data({'artists': [dict(_artist(1), id='r1', name='New Name', popularity=None)]}, as_of=now)
+        TasteProfile.from_music_data({'artists': [dict(_artist(1), id='r1', name='Older Name')]},
+                                     as_of=now - timedelta(days=2))
+        artist = profile.artist_dicts(profile.artists)[0]
+        # Newest name wins; a field the newer data lacks keeps its old value
+        self.assertEqual((artist['name'], artist['popularity']), ('New Name', 10))
+
+    def test_full_interners_are_replaced_without_breaking_older_profiles(self):
+        mine = {'artists': [_artist(i, genres=['indie']) for i in range(6)], 'tracks': [_track(i) for i in range(6)]}
+        theirs = {'artists': [_artist(i, genres=['indie']) for i in range(3, 9)], 'tracks': []}
+        with mock.patch('Matchifyapp.taste_profile.MAX_INTERNED', 5):
+            old = TasteProfile.from_music_data(mine)
+            new = TasteProfile.from_music_data(theirs)
+        self.assertIsNot(old.interners, new.interners)
+        self.assertEqual(old.artist_dicts(old.artists[:1])[0]['name'], 'Artist 0')
+        self.assertEqual(old.artist_ids()[3:], new.artist_ids()[:3])
+        self.assertEqual(old.genre_names(old.shared_genres(new)), ['indie'])
+        shared, _ = new.shared_artists(old)
+        self.assertEqual(list(np.nonzero(shared)[0]), [0, 1, 2])
+        algorithm = MusicMatchingAlgorithm()
+        self.assertEqual(algorithm.score_music_data(old, new), algorithm.score_music_data(mine, theirs))
+        scorer = BatchScorer({1: old, 2: new})
+        self.assertIs(scorer.data[1].interners, scorer.data[2].interners)
+
+
+class TasteEmbeddingTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(5)]
+        _snapshot(self.users[0], range(0, 20), range(0, 20))
+        _snapshot(self.users[1], range(0, 18), range(5, 25))
+        _snapshot(self.users[2], range(10, 30), range(40, 60))
+        _snapshot(self.users[3], range(100, 120), range(100, 120))
+        _snapshot(self.users[4], range(300, 320), range(300, 320))
+
+    def test_neighbours_and_reranked_matches(self):
+        self.assertEqual(build_embeddings(dimensions=3), 5)
+        vectors = EmbeddingIndex.load('long_term').vectors
+        self.assertEqual(vectors.shape, (5, 3))
+        self.assertTrue(np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5))
+
+        neighbours = similar_users(self.users[0].id, k=2)
+        self.assertEqual(neighbours, [self.users[1].id, self.users[2].id])
+
+        with self.settings(TASTE_EMBEDDING_MATCHING=True), mock.patch('Matchifyapp.taste_embeddings.NEIGHBOURS', 2):
+            self.assertEqual(match_candidates(self.users[0].id, 'long_term'), {self.users[1].id, self.users[2].id})
+            matches = find_top_music_matches(self.users[0], min_score=0)
+        # Only the neighbours were scored (exactly) and stored
+        self.assertEqual([m['user'] for m in matches], [self.users[1], self.users[2]])
+        self.assertEqual(matches[0]['compatibility'], get_compatibility(self.users[0], self.users[1]))
+
+
+class ScoreCalibrationTests(TestCase):
+    def setUp(self):
+        reset_calibration()
+        self.addCleanup(reset_calibration)
+
+    def test_uncalibrated_mapping_treats_raw_score_as_percentile(self):
+        self.assertEqual(calibrate(0), 0.0)
+        self.assertEqual(calibrate(4), 40.0)
+        self.assertAlmostEqual(calibrate(50), 70 + 10 * 15 / 35)
+        self.assertEqual(calibrate(100), 100.0)
+
+    def test_calibration_follows_stored_raw_scores(self):
+        users = User.objects.bulk_create([User(username=f'cal{i}') for i in range(15)])
+        now = timezone.now()
+        pairs = [(a, b) for a in users for b in users if a != b]
+        MusicCompatibility.objects.bulk_create([
+            MusicCompatibility(user_a=a, user_b=b, time_range='long_term', raw_score=i / 10, total_score=0,
+                               breakdown={'artist_compatibility': 1, 'genre_compatibility': 1}, computed_at=now)
+            for i, (a, b) in enumerate(pairs)
+        ])
+        raw_scores = sorted(i / 10 for i in range(len(pairs)))
+
+        self.assertIsNotNone(build_calibration())
+        self.assertAlmostEqual(calibrate(np.median(raw_scores)), 70 + 10 * 15 / 35, places=3)
+        self.assertEqual(calibrate(raw_scores[-1]), 100.0)
+        self.assertEqual(calibrate(90), 100.0)
+        self.assertLess(calibrate(raw_scores[20]), calibrate(raw_scores[21]))
+
+        self.assertEqual(recalibrate_stored(), len(pairs))
+        best = MusicCompatibility.objects.get(raw_score=raw_scores[-1])
+        self.assertEqual(best.total_score, 100.0)
+        self.assertEqual(best.breakdown, {'artist_compatibility': 50.0, 'genre_compatibility': 50.0})
@@ -0,0 +1,81 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from . import artist_index
+from .leaderboards import get_leaderboard, refresh_leaderboards
+from .models import ArtistListen, LeaderboardEntry, Profile
+
+User = get_user_model()
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        artist_index._index = None
+        self.addCleanup(setattr, artist_index, '_index', None)
+        self.me = User.objects.create_user(username='me', email='me@uni.edu', password='pass')
+        plays = {'amy': 5, 'ben': 12, 'cat': 0, 'dan': 7}
+        for name, count in plays.items():
+            user = User.objects.create_user(username=name, email=f'{name}@UNI.edu', password='pass')
+            ArtistListen.objects.create(user=user, artist_id='art1', artist_name='Band',
+                                        play_count=count, total_ms=count * 180000)
+        other = User.objects.create_user(username='outsider', email='x@other.edu', password='pass')
+        ArtistListen.objects.create(user=other, artist_id='art1', artist_name='Band', play_count=99)
+        self.written = refresh_leaderboards()
+
+    def test_school_domain_kept_in_sync(self):
+        self.assertEqual(Profile.objects.get(user=self.me).school_domain, 'uni.edu')
+        self.me.email = 'me@college.edu'
+        self.me.save()
+        self.assertEqual(Profile.objects.get(user=self.me).school_domain, 'college.edu')
+
+    def test_single_query_ranked_by_plays(self):
+        with self.assertNumQueries(1):
+            results = get_leaderboard(self.me, artist_id='art1')
+        self.assertEqual([r['username'] for r in results], ['ben', 'dan', 'amy'])
+        self.assertEqual([r['rank'] for r in results], [1, 2, 3])
+        self.assertEqual(results[0]['minutes'], 36)
+
+        by_name = get_leaderboard(self.me, artist_name='band')
+        self.assertEqual([r['username'] for r in by_name], ['ben', 'dan', 'amy'])
+        self.assertEqual(get_leaderboard(self.me, artist_name='ban'), [])
+
+    def test_school_comes_from_the_profile(self):
+        # The stored school wins over the email domain
+        Profile.objects.filter(user=self.me).update(school_domain='other.edu')
+        results = get_leaderboard(self.me, artist_id='art1')
+        self.assertEqual([r['username'] for r in results], ['outsider'])
+        Profile.objects.filter(user=self.me).delete()
+        self.assertEqual(len(get_leaderboard(self.me, artist_id='art1')), 3)
+
+    def test_refresh_materializes_school_and_global_boards(self):
+        # uni.edu: ben, dan, amy; other.edu: outsider; all users: outsider, ben, dan, amy
+        self.assertEqual(self.written, 3 + 1 + 4)
+        ranks = list(LeaderboardEntry.objects.filter(school_domain='', artist_id='art1')
+                     .order_by('rank').values_list('user__username', flat=True))
+        self.assertEqual(ranks, ['outsider', 'ben', 'dan', 'amy'])
+
+    def test_pagination(self):
+        page2 = get_leaderboard(self.me, artist_id='art1', limit=2, offset=2)
+        self.assertEqual([(r['rank'], r['username']) for r in page2], [(3, 'amy')])
+
+        self.client.force_login(self.me)
+        data = self.client.get(reverse('leaderboard_results'), {'artist_id': 'art1', 'page_size': 2}).json()
+        self.assertEqual([r['username'] for r in data['results']], ['ben', 'dan'])
+        self.assertTrue(data['has_more'])
+        data = self.client.get(reverse('leaderboard_results'), {'artist_id': 'art1', 'page_size': 2, 'page': 2}).json()
+        self.assertEqual([r['username'] for r in data['results']], ['amy'])
+        self.assertFalse(data['has_more'])
+
+        resp = self.client.get(reverse('leaderboard_page'), {'artist_id': 'art1', 'page_size': 2})
+        self.assertContains(resp, '2. dan')
+        self.assertContains(resp, 'page=2')
+
+    def test_view_does_not_call_spotify(self):
+        self.client.force_login(self.me)
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.request') as request:
+            resp = self.client.get(reverse('leaderboard_results'), {'artist_id': 'art1'})
+        request.assert_not_called()
+        self.assertEqual(resp.json()['results'][0]['username'], 'ben')
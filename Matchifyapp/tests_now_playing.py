@@ -0,0 +1,143 @@
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .middleware import TasteMemoMiddleware
+from .models import spotifyToken
+from .now_playing import IDLE_TTL, MIN_TTL, TTL, NowPlaying, clear_now_playing, stream_events
+from .spotify_tokens import clear_tokens
+from .taste_snapshots import request_memo
+
+User = get_user_model()
+
+
+def _playing(name, etag='"v1"'):
+    resp = mock.Mock(status_code=200, headers={'ETag': etag})
+    resp.json.return_value = {'is_playing': True, 'item': {
+        'name': name, 'artists': [{'name': 'Band'}], 'album': {'name': 'Album', 'images': [{'url': 'img'}]},
+    }}
+    return resp
+
+
+class NowPlayingEndpointTests(TestCase):
+    def setUp(self):
+        clear_tokens()
+        clear_now_playing()
+        self.addCleanup(clear_tokens)
+        self.addCleanup(clear_now_playing)
+        self.user = User.objects.create_user(username='listener', password='pass')
+        spotifyToken.objects.create(user=self.user, access_token='tok', refresh_token='r', token_type='Bearer',
+                                    expires_in=timezone.now() + timedelta(hours=1))
+        self.client.force_login(self.user)
+        self.url = reverse('get_current_track')
+
+    def test_polls_within_ttl_share_one_upstream_call(self):
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', return_value=_playing('Song')) as get:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(first.json()['track']['name'], 'Song')
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertIn('no-cache', first['Cache-Control'])
+
+    def test_etag_and_body_come_from_one_lookup(self):
+        answers = iter([NowPlaying({'name': 'Song'}), NowPlaying({'name': 'Other'})])
+        with mock.patch('Matchifyapp.views.get_now_playing', side_effect=lambda user: next(answers)) as lookup:
+            response = self.client.get(self.url)
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(response.json()['track']['name'], 'Song')
+        self.assertEqual(response['ETag'], f'"{NowPlaying({"name": "Song"}).etag}"')
+
+    def test_unchanged_track_is_not_modified(self):
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', return_value=_playing('Song')):
+            etag = self.client.get(self.url)['ETag']
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_stale_entry_is_revalidated_with_spotify_etag(self):
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', return_value=_playing('Song')):
+            etag = self.client.get(self.url)['ETag']
+
+        with mock.patch('Matchifyapp.now_playing.TTL', 0), \
+                mock.patch('Matchifyapp.spotify_client.SpotifyClient.get',
+                           return_value=mock.Mock(status_code=304, headers={})) as get:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(get.call_args.kwargs['headers']['If-None-Match'], '"v1"')
+        self.assertEqual(response.status_code, 304)
+
+        with mock.patch('Matchifyapp.now_playing.TTL', 0), \
+                mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', return_value=_playing('Other', '"v2"')):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['track']['name'], 'Other')
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class NowPlayingStreamTests(TestCase):
+    def test_recheck_interval_follows_the_player(self):
+        track = {'name': 'Song'}
+        self.assertEqual(NowPlaying(None).ttl(), IDLE_TTL)
+        self.assertEqual(NowPlaying(track).ttl(), TTL)
+        self.assertEqual(NowPlaying(track, remaining_ms=5 * 60 * 1000).ttl(), TTL)
+        # Near the end of the track the next one is picked up quickly
+        self.assertEqual(NowPlaying(track, remaining_ms=3000).ttl(), 4)
+        self.assertEqual(NowPlaying(track, remaining_ms=0).ttl(), MIN_TTL)
+
+    async def test_stream_pushes_only_changes(self):
+        first, other = NowPlaying({'name': 'Song'}), NowPlaying({'name': 'Other'})
+        with mock.patch('Matchifyapp.now_playing.get_now_playing', side_effect=[first, first, other]), \
+                mock.patch('Matchifyapp.now_playing.asyncio.sleep', new=mock.AsyncMock()) as sleep:
+            stream = stream_events(1)
+            events = [await stream.__anext__() for _ in range(4)]
+            await stream.aclose()
+        self.assertEqual(events[0], 'retry: 5000\n\n')
+        self.assertTrue(events[1].startswith(f'event: track\nid: {first.etag}\n'))
+        self.assertIn('"name": "Song"', events[1])
+        self.assertEqual(events[2], ': keep-alive\n\n')
+        self.assertTrue(events[3].startswith(f'event: track\nid: {other.etag}\n'))
+        # Waits until the cached answer expires before checking again
+        self.assertAlmostEqual(sleep.call_args_list[0].args[0], TTL, delta=1)
+
+    async def test_stream_resumes_from_last_event_id(self):
+        first = NowPlaying({'name': 'Song'})
+        with mock.patch('Matchifyapp.now_playing.get_now_playing', return_value=first), \
+                mock.patch('Matchifyapp.now_playing.asyncio.sleep', new=mock.AsyncMock()):
+            stream = stream_events(1, last_etag=first.etag)
+            events = [await stream.__anext__() for _ in range(2)]
+            await stream.aclose()
+        self.assertEqual(events[1], ': keep-alive\n\n')
+
+    async def test_memo_middleware_runs_async_views_natively(self):
+        async def view(request):
+            return request_memo.get()
+
+        middleware = TasteMemoMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertEqual(await middleware(None), {})
+        self.assertIsNone(request_memo.get())
+
+    async def test_endpoint_requires_login(self):
+        url = reverse('now_playing_stream')
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 401)
+
+        user = await sync_to_async(User.objects.create_user)(username='streamer', password='pass')
+        await sync_to_async(self.async_client.force_login)(user)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.streaming)
+
+    def test_wsgi_requests_poll_instead_of_streaming(self):
+        user = User.objects.create_user(username='wsgi', password='pass')
+        self.client.force_login(user)
+        # 204 tells EventSource not to reconnect
+        self.assertEqual(self.client.get(reverse('now_playing_stream')).status_code, 204)
+        with mock.patch('Matchifyapp.views.get_current_track', return_value=None):
+            self.assertFalse(self.client.get(reverse('home')).context['now_playing_stream'])
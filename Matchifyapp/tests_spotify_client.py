@@ -0,0 +1,96 @@
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from .spotify_client import RateLimitTimeout, SpotifyClient, TokenBucket
+
+
+def _response(status, headers=None):
+    resp = mock.Mock(status_code=status)
+    resp.headers = headers or {}
+    return resp
+
+
+class SpotifyClientTests(SimpleTestCase):
+    def setUp(self):
+        self.client = SpotifyClient(BACKOFF_SECONDS=0, MAX_RETRIES=2, RATE_PER_SECOND=1000, BURST=1000)
+        sleep = mock.patch('Matchifyapp.spotify_client.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def test_retries_429_after_retry_after(self):
+        responses = [_response(429, {'Retry-After': '2'}), _response(200)]
+        with mock.patch.object(self.client, 'limiter') as limiter, \
+                mock.patch.object(self.client.session, 'request', side_effect=responses) as request:
+            resp = self.client.get('https://api.spotify.com/v1/me/top/artists', params={'limit': 50})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(request.call_count, 2)
+        # The whole process backs off for Retry-After seconds before the retry is sent
+        limiter.pause.assert_called_once_with(2.0)
+        self.assertEqual(limiter.acquire.call_count, 2)
+        # Default timeout applied to every call
+        self.assertEqual(request.call_args.kwargs['timeout'], self.client.timeout)
+
+        stats = self.client.metrics()['GET /v1/me/top/artists']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['status'], {429: 1, 200: 1})
+
+    def test_gives_up_after_max_retries(self):
+        with mock.patch.object(self.client.session, 'request', return_value=_response(503)) as request:
+            resp = self.client.get('https://api.spotify.com/v1/me/player/recently-played')
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(request.call_count, 3)
+
+        with mock.patch.object(self.client.session, 'request', side_effect=requests.ConnectionError('down')):
+            with self.assertRaises(requests.ConnectionError):
+                self.client.get('https://api.spotify.com/v1/search')
+
+    def test_long_retry_after_is_returned_and_pause_capped(self):
+        with mock.patch.object(self.client, 'limiter') as limiter, \
+                mock.patch.object(self.client.session, 'request',
+                                  return_value=_response(429, {'Retry-After': '3600'})) as request:
+            resp = self.client.get('https://api.spotify.com/v1/me')
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(request.call_count, 1)
+        limiter.pause.assert_called_once_with(self.client.max_retry_after)
+
+    def test_posts_are_not_resent_after_they_may_have_arrived(self):
+        url = 'https://accounts.spotify.com/api/token'
+        with mock.patch.object(self.client.session, 'request', return_value=_response(502)) as request:
+            self.assertEqual(self.client.post(url, data={}).status_code, 502)
+        self.assertEqual(request.call_count, 1)
+
+        with mock.patch.object(self.client.session, 'request', side_effect=requests.ReadTimeout('slow')) as request:
+            with self.assertRaises(requests.ReadTimeout):
+                self.client.post(url, data={})
+        self.assertEqual(request.call_count, 1)
+
+        # Nothing was sent if the connection couldn't be made
+        with mock.patch.object(self.client.session, 'request',
+                               side_effect=[requests.ConnectTimeout('no route'), _response(200)]) as request:
+            self.assertEqual(self.client.post(url, data={}).status_code, 200)
+        self.assertEqual(request.call_count, 2)
+
+    def test_acquire_timeout_can_be_set_per_call(self):
+        url = 'https://api.spotify.com/v1/me'
+        with mock.patch.object(self.client, 'limiter') as limiter, \
+                mock.patch.object(self.client.session, 'request', return_value=_response(200)):
+            limiter.acquire.return_value = True
+            self.client.get(url)
+            self.client.get(url, acquire_timeout=30)
+            self.assertEqual([c.kwargs['timeout'] for c in limiter.acquire.call_args_list],
+                             [self.client.acquire_timeout, 30])
+            limiter.acquire.return_value = False
+            with self.assertRaises(RateLimitTimeout):
+                self.client.get(url, acquire_timeout=0)
+
+class TokenBucketTests(SimpleTestCase):
+    def test_acquire_gives_up_after_timeout(self):
+        bucket = TokenBucket(rate=1, capacity=1)
+        self.assertTrue(bucket.acquire(timeout=0))
+        bucket.pause(60)
+        with mock.patch('Matchifyapp.spotify_client.time.sleep') as sleep:
+            self.assertFalse(bucket.acquire(timeout=5))
+        sleep.assert_not_called()
@@ -0,0 +1,192 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Friendship, spotifyToken
+from .spotify_tokens import (clear_tokens, connected_user_ids, get_access_token, is_connected, refresh_access_token,
+                             save_tokens)
+from .views import get_auth_header
+
+User = get_user_model()
+
+
+def _token_response(access_token, **extra):
+    resp = mock.Mock(status_code=200)
+    resp.json.return_value = dict(access_token=access_token, token_type='Bearer', expires_in=3600, **extra)
+    return resp
+
+
+class AccessTokenCacheTests(TestCase):
+    def setUp(self):
+        clear_tokens()
+        self.addCleanup(clear_tokens)
+        self.user = User.objects.create_user(username='listener', password='pass')
+        self.token = spotifyToken.objects.create(user=self.user, access_token='old', refresh_token='r',
+                                                 token_type='Bearer', expires_in=timezone.now() + timedelta(hours=1))
+
+    def test_valid_token_is_read_once_per_process(self):
+        self.assertEqual(get_access_token(self.user), 'old')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_access_token(self.user), 'old')
+            self.assertEqual(get_auth_header(self.user)['Authorization'], 'Bearer old')
+            self.assertEqual(get_access_token(self.user.id), 'old')
+
+    def test_token_is_refreshed_once_before_it_expires(self):
+        spotifyToken.objects.filter(id=self.token.id).update(expires_in=timezone.now() + timedelta(seconds=30))
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.post',
+                        return_value=_token_response('new', refresh_token='r2')) as post:
+            self.assertEqual(get_access_token(self.user), 'new')
+            self.assertEqual(get_access_token(self.user), 'new')
+            # Already fresh: nothing to do
+            self.assertEqual(refresh_access_token(self.user), 'new')
+        self.assertEqual(post.call_count, 1)
+        self.token.refresh_from_db()
+        self.assertEqual((self.token.access_token, self.token.refresh_token), ('new', 'r2'))
+        self.assertGreater(self.token.expires_in, timezone.now() + timedelta(minutes=59))
+
+    def test_token_refreshed_by_another_worker_is_not_refreshed_again(self):
+        spotifyToken.objects.filter(id=self.token.id).update(expires_in=timezone.now() + timedelta(seconds=30))
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.post') as post:
+            # Stale in this process's cache...
+            with mock.patch('Matchifyapp.spotify_tokens._refresh', return_value=None):
+                get_access_token(self.user)
+            # ...but another worker has since written a fresh one
+            spotifyToken.objects.filter(id=self.token.id).update(access_token='theirs',
+                                                                 expires_in=timezone.now() + timedelta(hours=1))
+            self.assertEqual(get_access_token(self.user), 'theirs')
+        post.assert_not_called()
+
+    def test_refresh_racing_another_worker_keeps_theirs(self):
+        spotifyToken.objects.filter(id=self.token.id).update(expires_in=timezone.now() + timedelta(seconds=30))
+
+        def refreshed_elsewhere_meanwhile(*args, **kwargs):
+            spotifyToken.objects.filter(id=self.token.id).update(access_token='theirs', refresh_token='r2',
+                                                                 expires_in=timezone.now() + timedelta(hours=1))
+            return _token_response('mine')
+
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.post', side_effect=refreshed_elsewhere_meanwhile):
+            self.assertEqual(get_access_token(self.user), 'theirs')
+        self.token.refresh_from_db()
+        self.assertEqual((self.token.access_token, self.token.refresh_token), ('theirs', 'r2'))
+
+    def test_failed_refresh_keeps_a_token_that_still_works(self):
+        spotifyToken.objects.filter(id=self.token.id).update(expires_in=timezone.now() + timedelta(seconds=30))
+        failed = mock.Mock(status_code=400)
+        failed.json.return_value = {'error': 'invalid_grant'}
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.post', return_value=failed):
+            self.assertEqual(get_access_token(self.user), 'old')
+            spotifyToken.objects.filter(id=self.token.id).update(expires_in=timezone.now() - timedelta(seconds=1))
+            self.assertIsNone(get_access_token(self.user))
+
+    def test_failed_refresh_uses_a_token_rotated_elsewhere(self):
+        spotifyToken.objects.filter(id=self.token.id).update(expires_in=timezone.now() - timedelta(seconds=1))
+
+        def rotated_elsewhere_meanwhile(*args, **kwargs):
+            spotifyToken.objects.filter(id=self.token.id).update(access_token='theirs', refresh_token='r2',
+                                                                 expires_in=timezone.now() + timedelta(hours=1))
+            failed = mock.Mock(status_code=400)
+            failed.json.return_value = {'error': 'invalid_grant'}
+            return failed
+
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.post', side_effect=rotated_elsewhere_meanwhile):
+            self.assertEqual(get_access_token(self.user), 'theirs')
+
+    def test_stale_token_is_read_once_before_refreshing(self):
+        spotifyToken.objects.filter(id=self.token.id).update(expires_in=timezone.now() + timedelta(seconds=30))
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.post', return_value=_token_response('new')), \
+                self.assertNumQueries(3):
+            # One SELECT of the row, an UPDATE claiming the refresh lease, one storing the new token
+            self.assertEqual(get_access_token(self.user), 'new')
+
+    def test_worker_without_the_lease_waits_instead_of_refreshing(self):
+        spotifyToken.objects.filter(id=self.token.id).update(expires_in=timezone.now() - timedelta(seconds=1),
+                                                             refreshing_until=timezone.now() + timedelta(seconds=10))
+
+        def other_worker_stores_its_token(seconds):
+            spotifyToken.objects.filter(id=self.token.id).update(access_token='theirs', refreshing_until=None,
+                                                                 expires_in=timezone.now() + timedelta(hours=1))
+
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.post') as post, \
+                mock.patch('Matchifyapp.spotify_tokens.time.sleep', side_effect=other_worker_stores_its_token):
+            self.assertEqual(get_access_token(self.user), 'theirs')
+        post.assert_not_called()
+
+        # A lease left by a worker that died has expired and is taken over
+        spotifyToken.objects.filter(id=self.token.id).update(expires_in=timezone.now() - timedelta(seconds=1),
+                                                             refreshing_until=timezone.now() - timedelta(seconds=1))
+        clear_tokens()
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.post', return_value=_token_response('new')):
+            self.assertEqual(get_access_token(self.user), 'new')
+        self.assertIsNone(spotifyToken.objects.get(id=self.token.id).refreshing_until)
+
+    def test_relinking_replaces_the_cached_token(self):
+        get_access_token(self.user)
+        self.token.access_token = 'relinked'
+        self.token.save()
+        self.assertEqual(get_access_token(self.user), 'relinked')
+        self.token.delete()
+        self.assertIsNone(get_access_token(self.user))
+
+
+class RefreshSpotifyTokensCommandTests(TestCase):
+    def setUp(self):
+        clear_tokens()
+        self.addCleanup(clear_tokens)
+        now = timezone.now()
+        self.expiring = {}
+        for name, expires_in in (('soon', timedelta(minutes=5)), ('later', timedelta(hours=1)),
+                                 ('expired', -timedelta(minutes=30)), ('long_gone', -timedelta(days=3))):
+            user = User.objects.create_user(username=name, password='pass')
+            spotifyToken.objects.create(user=user, access_token=name, refresh_token='r', token_type='Bearer',
+                                        expires_in=now + expires_in)
+            self.expiring[name] = user
+
+    def test_refreshes_only_tokens_about_to_expire(self):
+        out = StringIO()
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.post', return_value=_token_response('new')) as post:
+            call_command('refresh_spotify_tokens', within_minutes=15, workers=1, stdout=out)
+        self.assertIn('Refreshed 2 tokens expiring within 15 minutes (0 failed)', out.getvalue())
+        self.assertEqual(post.call_count, 2)
+        tokens = dict(spotifyToken.objects.values_list('user__username', 'access_token'))
+        self.assertEqual(tokens, {'soon': 'new', 'later': 'later', 'expired': 'new', 'long_gone': 'long_gone'})
+        # Page loads are then served from the cache
+        with self.assertNumQueries(0):
+            self.assertEqual(get_access_token(self.expiring['soon']), 'new')
+
+
+class ConnectedFlagTests(TestCase):
+    def setUp(self):
+        clear_tokens()
+        self.addCleanup(clear_tokens)
+        self.users = [User.objects.create_user(username=f'u{i}', password='pass') for i in range(3)]
+        spotifyToken.objects.create(user=self.users[0], access_token='a', refresh_token='r', token_type='Bearer',
+                                    expires_in=timezone.now() + timedelta(hours=1))
+
+    def test_batch_lookup_is_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(connected_user_ids(self.users), {self.users[0].id})
+        with self.assertNumQueries(0):
+            self.assertTrue(is_connected(self.users[0]))
+            self.assertFalse(is_connected(self.users[1].id))
+
+    def test_linking_spotify_updates_the_flag(self):
+        self.assertFalse(is_connected(self.users[1]))
+        save_tokens(self.users[1], 'b', 'r', timezone.now() + timedelta(hours=1), 'Bearer')
+        with self.assertNumQueries(0):
+            self.assertTrue(is_connected(self.users[1]))
+            self.assertEqual(get_access_token(self.users[1]), 'b')
+
+    def test_friends_page_marks_connected_friends(self):
+        for friend in self.users[1:]:
+            Friendship.objects.create(user1=self.users[0], user2=friend)
+        save_tokens(self.users[1], 'b', 'r', timezone.now() + timedelta(hours=1), 'Bearer')
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse('friends'))
+        friends = {f['username']: f['spotify_connected'] for f in response.context['friends']}
+        self.assertEqual(friends, {'u1': True, 'u2': False})
@@ -0,0 +1,175 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import swipe_queue
+from .genre_index import clear_user_counts, genre_neighbours, index_snapshots
+from .models import (FriendRequest, Friendship, Genre, MusicCompatibility, SwipeDecision, SwipeQueueEntry,
+                     TasteSnapshot)
+
+User = get_user_model()
+
+
+def _pop(owner):
+    """Username on the next swipe card served to `owner`, or None when nobody is left."""
+    cards = swipe_queue.pop_cards(owner, 1)
+    return cards[0]['user']['username'] if cards else None
+
+
+@override_settings(SWIPE_QUEUE_REFILL_ASYNC=False)
+class SwipeQueueTests(TestCase):
+    def setUp(self):
+        clear_user_counts()
+        self.addCleanup(clear_user_counts)
+        self.me = User.objects.create_user(username='me', password='pass')
+        self.others = [User.objects.create_user(username=f'u{i}', password='pass') for i in range(5)]
+        User.objects.create_superuser(username='admin', password='pass')
+        now = timezone.now()
+        # u0..u2 are scored (u2 best); u3 and u4 have no stored score yet
+        for user, score in zip(self.others[:3], (40.0, 55.0, 90.0)):
+            MusicCompatibility.objects.create(user_a=self.me, user_b=user, time_range='long_term',
+                                              total_score=score, raw_score=score, breakdown={}, computed_at=now)
+        self.client.force_login(self.me)
+
+    def test_pops_best_scored_candidates_first(self):
+        popped = [_pop(self.me) for _ in range(6)]
+        self.assertEqual(popped[:3], ['u2', 'u1', 'u0'])
+        self.assertEqual(set(popped[3:5]), {'u3', 'u4'})
+        # Everyone has been served once; nobody is queued twice and the admin is never offered
+        self.assertIsNone(popped[5])
+        self.assertEqual(SwipeQueueEntry.objects.filter(owner=self.me).count(), 5)
+
+    def test_refills_below_watermark(self):
+        swipe_queue.refill_queue(self.me, size=2)
+        self.assertEqual(SwipeQueueEntry.objects.filter(owner=self.me).count(), 2)
+        _pop(self.me)
+        # Fewer than LOW_WATERMARK left, so the rest of the users were queued
+        self.assertEqual(SwipeQueueEntry.objects.filter(owner=self.me, served_at__isnull=True).count(), 4)
+
+    def test_endpoints_serve_queue(self):
+        data = self.client.get(reverse('api_swipe_next')).json()
+        self.assertEqual(data['user']['username'], 'u2')
+        self.assertEqual(data['compatibility']['total_score'], 90.0)
+
+        resp = self.client.post(reverse('api_swipe_action'), data=json.dumps({'action': 'dislike', 'username': 'u2'}),
+                                content_type='application/json')
+        self.assertEqual(resp.json()['next']['user']['username'], 'u1')
+
+    def test_decisions_are_stored_and_excluded(self):
+        swipe_queue.refill_queue(self.me)
+        for action in ('like', 'dislike'):
+            self.client.post(reverse('api_swipe_action'), data=json.dumps({'action': action, 'username': 'u1'}),
+                             content_type='application/json')
+        decision = SwipeDecision.objects.get(swiper=self.me)
+        self.assertEqual((decision.target.username, decision.action), ('u1', 'dislike'))
+        self.assertNotIn('seen_swipes', self.client.session)
+
+        # u1 is still queued but has been decided, so it is skipped
+        popped = set()
+        while (username := _pop(self.me)) is not None:
+            popped.add(username)
+        self.assertNotIn('u1', popped)
+        SwipeQueueEntry.objects.all().delete()
+        swipe_queue.refill_queue(self.me)
+        self.assertFalse(SwipeQueueEntry.objects.filter(candidate__username='u1').exists())
+
+    def test_popped_but_undecided_candidate_is_offered_again(self):
+        self.assertEqual(_pop(self.me), 'u2')
+        self.assertEqual(_pop(self.me), 'u1')
+        # The card for u2 was never swiped (prefetched and dropped, or the page reloaded)
+        swipe_queue.record_decision(self.me, self.others[1], SwipeDecision.DISLIKE)
+        while _pop(self.me) is not None:
+            pass
+        self.assertEqual(swipe_queue.refill_queue(self.me), 0)
+
+        # Once their leases run out, undecided candidates come back best first; decided ones don't
+        SwipeQueueEntry.objects.update(served_at=timezone.now() - swipe_queue.SERVED_LEASE - timedelta(seconds=1))
+        again = []
+        while (username := _pop(self.me)) is not None:
+            again.append(username)
+        self.assertEqual(again[:2], ['u2', 'u0'])
+        self.assertEqual(set(again), {'u0', 'u2', 'u3', 'u4'})
+        self.assertFalse(SwipeQueueEntry.objects.filter(candidate=self.others[1]).exists())
+
+        # Candidates that left the queue without a decision are queued again
+        SwipeQueueEntry.objects.filter(candidate=self.others[2]).delete()
+        swipe_queue.refill_queue(self.me)
+        self.assertTrue(SwipeQueueEntry.objects.filter(candidate=self.others[2], served_at__isnull=True).exists())
+
+    def test_prefetched_cards_are_prebuilt(self):
+        first = self.client.get(reverse('api_swipe_next'), {'prefetch': 1}).json()
+        self.assertEqual([first['user']['username'], first['prefetched'][0]['user']['username']], ['u2', 'u1'])
+        # The next PREFETCH_COUNT cards were built after the pop
+        warmed = SwipeQueueEntry.objects.filter(owner=self.me, served_at__isnull=True, payload__isnull=False)
+        self.assertEqual(warmed.count(), swipe_queue.PREFETCH_COUNT)
+
+        with mock.patch('Matchifyapp.swipe_queue._build_payload', wraps=swipe_queue._build_payload) as build:
+            data = self.client.get(reverse('api_swipe_next'), {'prefetch': 2}).json()
+            served = [data['user']['username']] + [c['user']['username'] for c in data['prefetched']]
+            self.assertEqual(served[0], 'u0')
+            self.assertEqual(len(served), 3)
+            # The popped cards were stored, so only the background warm-up built anything
+            built = [c.args[1].username for c in build.call_args_list]
+            self.assertFalse(set(served) & set(built))
+
+    def test_mutual_like_creates_friendship(self):
+        u1 = self.others[1]
+
+        def like(swiper, target_username):
+            self.client.force_login(swiper)
+            return self.client.post(reverse('api_swipe_action'), content_type='application/json',
+                                    data=json.dumps({'action': 'like', 'username': target_username})).json()
+
+        self.assertFalse(like(self.me, 'u1')['match'])
+        self.assertTrue(FriendRequest.objects.filter(from_user=self.me, to_user=u1).exists())
+
+        self.assertTrue(like(u1, 'me')['match'])
+        self.assertEqual(Friendship.objects.count(), 1)
+        self.assertFalse(FriendRequest.objects.exists())
+        # Liking again is a no-op, and friends are no longer queued for each other
+        self.assertFalse(like(u1, 'me')['match'])
+        self.assertEqual(Friendship.objects.count(), 1)
+        SwipeDecision.objects.all().delete()
+        swipe_queue.refill_queue(u1)
+        self.assertFalse(SwipeQueueEntry.objects.filter(owner=u1, candidate=self.me).exists())
+
+    def test_concurrent_mutual_likes_create_friendship(self):
+        u1 = self.others[1]
+        # Both swipe targets were looked up before either like was stored
+        me_for_u1 = swipe_queue.with_swipe_state(User.objects.filter(pk=self.me.pk), u1).get()
+        u1_for_me = swipe_queue.with_swipe_state(User.objects.filter(pk=u1.pk), self.me).get()
+        self.assertFalse(me_for_u1.liked_swiper or u1_for_me.liked_swiper)
+
+        self.assertFalse(swipe_queue.record_decision(self.me, u1_for_me, SwipeDecision.LIKE))
+        self.assertTrue(swipe_queue.record_decision(u1, me_for_u1, SwipeDecision.LIKE))
+        self.assertEqual(Friendship.objects.count(), 1)
+        self.assertFalse(FriendRequest.objects.exists())
+
+    def test_unscored_users_sharing_rare_genres_come_first(self):
+        genres = {self.me: ['math rock', 'pop'], self.others[4]: ['math rock', 'pop'],
+                  self.others[3]: ['pop'], self.others[0]: ['pop']}
+        now = timezone.now()
+        for user, names in genres.items():
+            TasteSnapshot.objects.create(user=user, time_range='long_term', refreshed_at=now, expires_at=now,
+                                         genres=[{'genre': name, 'count': 1} for name in names])
+        self.assertEqual(index_snapshots(), (4, 6))
+        self.assertEqual(Genre.objects.count(), 2)
+
+        neighbours = genre_neighbours(self.me, 'long_term')
+        self.assertEqual(neighbours[0], (self.others[4].id, 1.0))
+        # The user count behind the IDF weights is reused rather than recounted
+        with self.assertNumQueries(3):
+            self.assertEqual(genre_neighbours(self.me, 'long_term'), neighbours)
+        # A stale user count smaller than a genre's listeners still weighs every genre positively
+        with mock.patch('Matchifyapp.genre_index.user_count', return_value=1):
+            stale = genre_neighbours(self.me, 'long_term')
+        self.assertEqual(stale[0], (self.others[4].id, 1.0))
+        self.assertTrue(all(0 < score <= 1 for _, score in stale))
+        popped = [_pop(self.me) for _ in range(4)]
+        # Scored users first, then u4 (shares the rare genre) ahead of u3
+        self.assertEqual(popped, ['u2', 'u1', 'u0', 'u4'])
@@ -0,0 +1,111 @@
+from datetime import timedelta
+from io import StringIO
+import re
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from .models import ArtistListen, LeaderboardEntry, PlayEvent, PlayHistoryCursor, spotifyToken
+from .spotify_client import SpotifyClient
+
+User = get_user_model()
+
+
+def _recently_played(artist_ids, first_minute=0):
+    """A recently-played page with one play per minute, newest first like Spotify returns it."""
+    resp = mock.Mock(status_code=200)
+    resp.json.return_value = {'items': [
+        {
+            'played_at': f'2026-01-01T10:{first_minute + i:02d}:00.000Z',
+            'track': {'id': f't{first_minute + i}', 'duration_ms': 1000,
+                      'artists': [{'id': aid, 'name': (aid or 'local').upper()}]},
+        }
+        for i, aid in reversed(list(enumerate(artist_ids)))
+    ]}
+    return resp
+
+
+class SyncArtistPlaysTests(TransactionTestCase):
+    def setUp(self):
+        self.users = []
+        for i in range(6):
+            user = User.objects.create_user(username=f'user{i}', password='pass')
+            spotifyToken.objects.create(
+                user=user, access_token=f'token{i}', refresh_token='r', token_type='Bearer',
+                expires_in=timezone.now() + timedelta(hours=1)
+            )
+            self.users.append(user)
+        User.objects.create_user(username='notoken', password='pass')
+
+    def _fake_get(self, url, headers=None, params=None, **kwargs):
+        if headers['Authorization'] == 'Bearer token3':
+            raise ValueError('boom')
+        if headers['Authorization'] == 'Bearer token4':
+            return mock.Mock(status_code=503)
+        return _recently_played(['x', 'x', 'y'])
+
+    def test_concurrent_sync_isolates_failures(self):
+        # An existing row is overwritten with the latest window by the upsert
+        ArtistListen.objects.create(user=self.users[0], artist_id='x', artist_name='old', play_count=9, total_ms=1)
+        out = StringIO()
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get', side_effect=self._fake_get):
+            call_command('sync_artist_plays', workers=4, batch_size=2, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn('Synced 4, skipped 1, failed 2 of 7 users', output)
+        self.assertIn('user3: unexpected error: boom', output)
+        self.assertIn('user4: Spotify API returned 503', output)
+        for i in (0, 1, 2, 5):
+            listens = {l.artist_id: l for l in ArtistListen.objects.filter(user=self.users[i])}
+            self.assertEqual(listens['x'].play_count, 2)
+            self.assertEqual(listens['x'].total_ms, 2000)
+            self.assertEqual(listens['y'].artist_name, 'Y')
+        self.assertFalse(ArtistListen.objects.filter(user__in=self.users[3:5]).exists())
+
+    def test_batched_writes_use_few_queries(self):
+        out = StringIO()
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get',
+                        return_value=_recently_played(['a', 'b', 'c', 'a', None])):
+            call_command('sync_artist_plays', workers=1, batch_size=10, stdout=out)
+
+        self.assertEqual(ArtistListen.objects.count(), 6 * 3)
+        self.assertEqual(ArtistListen.objects.get(user=self.users[0], artist_id='a').play_count, 2)
+        # A cursor preload, one token lookup per user and a handful of bulk statements for the batch
+        queries = int(re.search(r'DB queries: (\d+)', out.getvalue()).group(1))
+        self.assertLessEqual(queries, 1 + 7 + 5)
+
+    def test_rate_option_scales_the_burst(self):
+        client = SpotifyClient()
+        with mock.patch('Matchifyapp.management.commands.sync_artist_plays.get_client', return_value=client), \
+                mock.patch.object(client, 'get', return_value=_recently_played([])):
+            call_command('sync_artist_plays', workers=1, rate=5, skip_leaderboards=True, stdout=StringIO())
+            self.assertEqual((client.limiter.rate, client.limiter.capacity), (5.0, 10.0))
+            call_command('sync_artist_plays', workers=1, rate=5, burst=1, skip_leaderboards=True, stdout=StringIO())
+            self.assertEqual(client.limiter.capacity, 1.0)
+
+    def test_incremental_sync_uses_cursor_and_accumulates(self):
+        user = self.users[0]
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get',
+                        return_value=_recently_played(['x', 'y', 'x'])):
+            call_command('sync_artist_plays', workers=1, stdout=StringIO())
+        cursor = PlayHistoryCursor.objects.get(user=user).after_ms
+        self.assertEqual(PlayEvent.objects.filter(user=user).count(), 3)
+
+        # The next page overlaps the old plays; only the two new ones are ingested
+        with mock.patch('Matchifyapp.spotify_client.SpotifyClient.get',
+                        return_value=_recently_played(['x', 'y', 'x', 'x', 'z'])) as get:
+            call_command('sync_artist_plays', workers=1, stdout=StringIO())
+        self.assertEqual(get.call_args_list[0].kwargs['params'], {'limit': 50, 'after': cursor})
+        self.assertEqual(PlayEvent.objects.filter(user=user).count(), 5)
+        self.assertGreater(PlayHistoryCursor.objects.get(user=user).after_ms, cursor)
+
+        listens = {l.artist_id: l for l in ArtistListen.objects.filter(user=user)}
+        self.assertEqual(listens['x'].play_count, 3)
+        self.assertEqual(listens['x'].total_ms, 3000)
+        self.assertEqual(listens['y'].play_count, 1)
+        self.assertEqual(listens['z'].artist_name, 'Z')
+        # Leaderboards are refreshed after every sync with new plays
+        self.assertEqual(LeaderboardEntry.objects.get(school_domain='', artist_id='x', user=user).score, 3)
@@ -26,6 +26,7 @@ urlpatterns = [
     path("remove-friend/<str:username>", views.remove_friend, name="remove_friend"),
     path("cancel-friend-request/<str:username>", views.cancel_friend_request, name="cancel_friend_request"),
     path("get-current-track", views.get_current_track_endpoint, name="get_current_track"),
+    path("now-playing/stream", views.now_playing_stream, name="now_playing_stream"),
     path("api/connections", views.get_connections, name="get_connections"),
     path("profile/<str:username>/", views.profile, name="profile"),
     path("api/all_users", views.get_all_users, name="all_users"),
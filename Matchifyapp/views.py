@@ -18,10 +18,18 @@ from .forms import LoginForm, RegisterForm
 from .forms import EditProfileForm
 from django.db import DatabaseError
 import base64
-from requests import post, get, Request
+from requests import Request
 import json
 from . import extras
 from .compatibility import get_music_taste_summary
+from .artist_index import suggest_artists
+from .compatibility_store import get_compatibility
+from .leaderboards import get_leaderboard
+from .swipe_queue import pop_cards, record_decision, with_swipe_state
+from .taste_snapshots import get_snapshot as get_taste_snapshot, invalidate_snapshots
+from .spotify_client import ACCOUNTS_TOKEN_URL, get_client as get_spotify_client
+from .now_playing import get_now_playing, stream_events, streaming_supported
+from .spotify_tokens import connected_user_ids, get_access_token, is_connected, save_tokens
 from .models import spotifyToken
 from spotipy import Spotify
 from .credentials import CLIENT_ID, CLIENT_SECRET, REDIRECT_URI
@@ -29,8 +37,8 @@ from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from rest_framework.response import Response
 from django.conf import settings
-import requests
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.db.models import Q
 from django.db.models import Count, Case, When, IntegerField
@@ -52,7 +60,8 @@ from .forms import LoginForm
 from .models import Comment, Post
 from .forms import CommentForm
 from .models import Reaction
-from django.views.decorators.http import require_POST
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag, require_POST
 
 # Early stubs: ensure these names exist even if later code raises during import.
 def send_message(request, username):
@@ -131,52 +140,11 @@ def logout(request):
     return redirect("/")
 
 def get_current_track(user):
-    token = get_token(user)
-    if not token:
-        print("Debug: No token found")
-        return None
+    """Return what `user` is playing on Spotify ({'name', 'artist', 'album', 'album_art'}) or None.
 
-    url = "https://api.spotify.com/v1/me/player/currently-playing"
-    headers = get_auth_header(user)
-    
-    try:
-        print("Debug: Making request to Spotify")
-        response = get(url, headers=headers)
-        print(f"Debug: Response status code: {response.status_code}")
-        print(f"Debug: Response content: {response.content[:200]}")  # Print first 200 chars
-        
-        # No content means no track is playing
-        if response.status_code == 204:
-            print("Debug: No content (204) - No track playing")
-            return None
-            
-        if response.status_code != 200:
-            print(f"Debug: Bad status code: {response.status_code}")
-            return None
-
-        data = response.json()
-        print(f"Debug: Parsed JSON data: {data.keys()}")
-        
-        # Check if something is currently playing
-        if not data.get('is_playing', False):
-            print("Debug: Track exists but not playing")
-            return None
-
-        if 'item' not in data:
-            print("Debug: No item in response")
-            return None
-
-        track_info = {
-            'name': data['item']['name'],
-            'artist': data['item']['artists'][0]['name'],
-            'album': data['item']['album']['name'],
-            'album_art': data['item']['album']['images'][0]['url'] if data['item']['album']['images'] else None
-        }
-        print(f"Debug: Returning track info: {track_info}")
-        return track_info
-    except Exception as e:
-        print(f"Debug: Exception occurred: {str(e)}")
-        return None
+    Served from the per-user now-playing cache (see now_playing).
+    """
+    return get_now_playing(user).track
 
 def home(request):
     # Require authentication to view home. Redirect unauthenticated users to login.
@@ -186,7 +154,11 @@ def home(request):
 
     current_track = get_current_track(request.user)
     # Render the new home UI template that matches the provided React layout
-    return render(request, "home_new.html", {'current_track': current_track})
+    return render(request, "home_new.html", {
+        'current_track': current_track,
+        'spotify_connected': is_connected(request.user),
+        'now_playing_stream': streaming_supported(request),
+    })
 
 def cleanup_expired_otps():
     OtpToken.objects.filter(otp_expires_at__lt=timezone.now()).delete()
@@ -359,7 +331,7 @@ def spotify_redirect(request, format=None):
         print(f"Spotify auth error: {error}")  # Debug print
         return error
 
-    response = post("https://accounts.spotify.com/api/token", data={
+    response = get_spotify_client().post(ACCOUNTS_TOKEN_URL, data={
         "grant_type": "authorization_code",
         "code": code,
         "redirect_uri": REDIRECT_URI,
@@ -384,13 +356,15 @@ def spotify_redirect(request, format=None):
     print(f"Saving token for user: {request.user.username}")
     print(f"Access token: {access_token[:10]}...")  # Only print first 10 chars
 
-    extras.create_or_update_spotifyTokens(
+    save_tokens(
         user=request.user,
         access_token=access_token,
         refresh_token=refresh_token,
-        expires_in=expires_at,
+        expires_at=expires_at,
         token_type=token_type
     )
+    # A (re-)linked account may belong to a different Spotify user; drop cached taste data
+    invalidate_snapshots(request.user)
 
     redirect_url = reverse('success')
     return redirect(redirect_url)
@@ -413,40 +387,9 @@ class CheckAuthentication(APIView):
 client_id = CLIENT_ID
 client_secret = CLIENT_SECRET
 
-def refresh_spotify_token(user):
-    try:
-        spotify_token = spotifyToken.objects.get(user=user)
-        
-        # Check if token needs refresh
-        if spotify_token.expires_in <= timezone.now():
-            # Make refresh request to Spotify
-            response = post("https://accounts.spotify.com/api/token", data={
-                "grant_type": "refresh_token",
-                "refresh_token": spotify_token.refresh_token,
-                "client_id": CLIENT_ID,
-                "client_secret": CLIENT_SECRET
-            }).json()
-
-            # Update token in database
-            spotify_token.access_token = response.get('access_token')
-            spotify_token.expires_in = timezone.now() + timedelta(seconds=response.get('expires_in', 3600))
-            spotify_token.save()
-            
-            return spotify_token.access_token
-            
-    except Exception as e:
-        print(f"Error refreshing token: {e}")
-        return None
-
 def get_token(user):
-    try:
-        token = spotifyToken.objects.get(user=user)
-        # Check if token needs refresh
-        if token.expires_in <= timezone.now():
-            return refresh_spotify_token(user)
-        return token.access_token
-    except spotifyToken.DoesNotExist:
-        return None
+    """Return a valid access token for `user` from the process-wide token cache, or None."""
+    return get_access_token(user)
     
 
 def get_auth_header(user):
@@ -463,9 +406,8 @@ def get_auth_header(user):
 def search_for_artist(token, artist_name):
     url = "https://api.spotify.com/v1/search"
     headers = get_auth_header(token)
-    query = f"?q={artist_name}&type=artist&limit=1"
-    query_url = url + query
-    result = get(query_url, headers=headers)
+    params = {'q': artist_name, 'type': 'artist', 'limit': 1}
+    result = get_spotify_client().get(url, headers=headers, params=params)
     json_result = json.loads(result.content)["artists"]["items"]
     if len(json_result) == 0:
         print("No artist found")
@@ -473,88 +415,23 @@ def search_for_artist(token, artist_name):
     return json_result[0]
 
 def get_top_artists(user, time_range='medium_term'):
-    token = get_token(user)
-    print("Checking token:", token is not None)  # Debug print
-    
-    if not token:
-        print("No token found for user:", user.username)  # Debug print
-        return {'Error': 'No valid token found.'}
-
-    # Spotify API endpoint for top artists
-    url = "https://api.spotify.com/v1/me/top/artists"
-
-    # Headers for the API request
-    headers = get_auth_header(user)
-    if not headers:
-        return {'Error': 'No valid token found.'}
-
-    # Query parameters
-    params = {
-        'time_range': time_range,
-        'limit': 10
-    }
-
-    # Make the API request
-    print("Making request to:", url)  # Debug print
-    print("With headers:", headers)  # Debug print
-    print("With params:", params)  # Debug print
-    
-    result = get(url, headers=headers, params=params)
-    
-    print("Response status code:", result.status_code)  # Debug print
-    print("Response content:", result.content)  # Debug print
-
-    # Parse the response
-    try:
-        json_result = result.json()
-        if 'items' in json_result:
-            return json_result['items']
-        else:
-            print("JSON response but no items:", json_result)  # Debug print
-            return {'Error': 'No top artists found.'}
-    except Exception as e:
-        print("Failed to parse JSON:", str(e))  # Debug print
-        print("Raw response:", result.content)  # Debug print
-        return {'Error': f'Issue with request: {str(e)}'}
+    """Return a user's top 10 artists from their cached taste snapshot. Returns list or {'Error': msg}."""
+    snapshot = get_taste_snapshot(user, time_range)
+    if snapshot is None:
+        if not get_token(user):
+            return {'Error': 'No valid token found.'}
+        return {'Error': 'No top artists found.'}
+    return snapshot.artists[:10]
 
 
 def get_top_tracks(user, time_range='medium_term'):
-    """Fetch a user's top tracks from Spotify. Returns list or {'Error': msg}."""
-    token = get_token(user)
-    print("Checking token for tracks:", token is not None)  # Debug print
-    if not token:
-        print("No token found for user (tracks):", user.username)  # Debug print
-        return {'Error': 'No valid token found.'}
-
-    url = "https://api.spotify.com/v1/me/top/tracks"
-    headers = get_auth_header(user)
-    if not headers:
-        return {'Error': 'No valid token found.'}
-
-    params = {
-        'time_range': time_range,
-        'limit': 10
-    }
-
-    print("Making request to (tracks):", url)  # Debug print
-    print("With headers (tracks):", headers)  # Debug print
-    print("With params (tracks):", params)  # Debug print
-
-    result = get(url, headers=headers, params=params)
-    print("Response status code (tracks):", result.status_code)  # Debug print
-    print("Response content (tracks):", result.content[:500])  # Debug print
-
-    try:
-        json_result = result.json()
-        if 'items' in json_result:
-            return json_result['items']
-        else:
-            print("JSON response for tracks but no items:", json_result)  # Debug print
-            return {'Error': 'No top tracks found.'}
-    except Exception as e:
-        print("Failed to parse JSON for tracks:", str(e))  # Debug print
-        print("Raw response (tracks):", result.content)  # Debug print
-        return {'Error': f'Issue with request: {str(e)}'}
+    """Return a user's top 10 tracks from their cached taste snapshot. Returns list or {'Error': msg}."""
+    snapshot = get_taste_snapshot(user, time_range)
+    if snapshot is None:
+        if not get_token(user):
+            return {'Error': 'No valid token found.'}
+        return {'Error': 'No top tracks found.'}
+    return snapshot.tracks[:10]
 
 
 @login_required
@@ -706,7 +583,9 @@ def remove_friend(request, username):
 @login_required
 def profile(request, username):
     user = get_object_or_404(get_user_model(), username=username)
-    user_spotify = extras.is_spotify_authenticated(user)
+    # Both users' connected flags in one (usually cached) lookup
+    connected = connected_user_ids([user, request.user])
+    user_spotify = user.pk in connected
     # Get friend status
     current_user = request.user
     is_friend = Friendship.objects.filter(
@@ -716,10 +595,12 @@ def profile(request, username):
     friend_request_sent = FriendRequest.objects.filter(from_user=current_user, to_user=user).exists()
     friend_request_received = FriendRequest.objects.filter(from_user=user, to_user=current_user).exists()
 
-    # Compatibility score calculation
+    # Compatibility score from the precomputed table (scored and stored on a miss)
     compatibility_score = None
-    if user_spotify and extras.is_spotify_authenticated(current_user):
-        compatibility_score = calculate_compatibility(current_user, user)
+    if user_spotify and current_user != user and current_user.pk in connected:
+        compat = get_compatibility(current_user, user)
+        if compat:
+            compatibility_score = int(round(compat['total_score']))
 
     # Fetch top artists if connected
     top_artists = None
@@ -834,11 +715,13 @@ def friends(request):
     friends.discard(current_user)
 
     # For each friend prepare display data
+    connected = connected_user_ids(friends)
     friends_list = []
     for u in friends:
         friends_list.append({
             'username': u.username,
             'id': u.id,
+            'spotify_connected': u.id in connected,
         })
 
     # Incoming friend requests (to current user)
@@ -884,7 +767,9 @@ def cancel_friend_request(request, username):
 
 @login_required
 def leaderboard_autocomplete(request):
-    """Return a small list of artist suggestions for autocomplete using Spotify search.
+    """Return artist suggestions for autocomplete from the local artist index.
+
+    Spotify search is only used when nothing we have seen matches.
 
     Query params:
     - q: partial artist name
@@ -892,129 +777,52 @@ def leaderboard_autocomplete(request):
     q = request.GET.get('q', '').strip()
     if not q:
         return JsonResponse({'results': []})
-
-    # Use the current user's Spotify token to perform the search when possible
     try:
-        token = get_token(request.user)
-        if not token:
-            return JsonResponse({'results': []})
-        # search_for_artist expects a token object in this codebase
-        artist = search_for_artist(request.user, q)
-        if not artist:
-            return JsonResponse({'results': []})
-        # Return a small list (Spotify search returned best match); format for frontend
-        return JsonResponse({'results': [{'id': artist.get('id'), 'name': artist.get('name')}]})
-    except Exception:
+        return JsonResponse({'results': suggest_artists(request.user, q)})
+    except Exception as e:
+        logger.error(f"Artist autocomplete failed for {q!r}: {e}")
         return JsonResponse({'results': []})
 
 
-@login_required
-def leaderboard_results(request):
-    """Compute a school-local leaderboard for a given artist.
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_MAX_PAGE_SIZE = 50
 
-    Accepts either `artist_id` or `artist_name` as GET params. Returns top 10 users
-    from the current user's 'school' (inferred from email domain) ranked by how highly
-    the artist appears in their top artists (long_term). This is an approximation when
-    play counts are not stored server-side.
-    """
+
+def _leaderboard_page(request):
+    """Read artist_id/artist_name/page/page_size GET params and return one page of the leaderboard."""
     artist_id = request.GET.get('artist_id')
     artist_name = request.GET.get('artist_name')
-    if not (artist_id or artist_name):
-        return JsonResponse({'results': []})
-
-    User = get_user_model()
-    current = request.user
-
-    # Infer school from email domain (everything after '@'), fallback to all users
-    school_domain = None
     try:
-        if current.email and '@' in current.email:
-            school_domain = current.email.split('@', 1)[1].lower()
-    except Exception:
-        school_domain = None
+        page = max(int(request.GET.get('page', 1)), 1)
+    except (TypeError, ValueError):
+        page = 1
+    try:
+        page_size = min(max(int(request.GET.get('page_size', LEADERBOARD_PAGE_SIZE)), 1), LEADERBOARD_MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        page_size = LEADERBOARD_PAGE_SIZE
+
+    # One extra row tells us whether there is a next page
+    results = get_leaderboard(request.user, artist_id=artist_id, artist_name=artist_name,
+                              limit=page_size + 1, offset=(page - 1) * page_size)
+    return {
+        'artist_id': artist_id,
+        'artist_name': artist_name,
+        'results': results[:page_size],
+        'page': page,
+        'has_more': len(results) > page_size,
+    }
 
-    if school_domain:
-        candidates = User.objects.filter(email__iendswith='@' + school_domain, is_active=True)
-    else:
-        candidates = User.objects.filter(is_active=True)
 
-    from .models import ArtistListen
+@login_required
+def leaderboard_results(request):
+    """Return one page of the school-local leaderboard for an artist as JSON.
 
-    results = []
-    # For scoring: we'll call get_top_artists(user, time_range='long_term') and
-    # if the artist is present at rank r (0-based), score = 100 - r (higher is better).
-    for u in candidates:
-        try:
-            # Prefer an aggregated listening time if we have it in ArtistListen.
-            listen_q = None
-            if artist_id:
-                listen_q = ArtistListen.objects.filter(user=u, artist_id=artist_id).first()
-            if not listen_q and artist_name:
-                listen_q = ArtistListen.objects.filter(user=u, artist_name__iexact=artist_name).first()
-            if listen_q:
-                # Prefer play_count if available (how many times recent-play included artist)
-                if getattr(listen_q, 'play_count', None) and listen_q.play_count > 0:
-                    results.append({'username': u.username, 'score': listen_q.play_count, 'play_count': listen_q.play_count, 'listens': listen_q.play_count})
-                    continue
-                if listen_q.total_ms and listen_q.total_ms > 0:
-                    # Score by minutes listened (round to integer minutes for display)
-                    minutes = int(listen_q.minutes())
-                    results.append({'username': u.username, 'score': minutes, 'minutes': minutes, 'listens': minutes})
-                    continue
-                continue
-            top = get_top_artists(u, time_range='long_term')
-            if isinstance(top, dict) and top.get('Error'):
-                continue
-            # top is list of artist dicts
-            found_rank = None
-            for i, a in enumerate(top or []):
-                if artist_id and a.get('id') == artist_id:
-                    found_rank = i
-                    break
-                if artist_name and a.get('name', '').lower() == artist_name.lower():
-                    found_rank = i
-                    break
-
-            # We no longer derive a score from Spotify top-artist rank.
-            # Only use database-backed listen counts (ArtistListen) as the authoritative score.
-            if found_rank is not None:
-                # Record the rank for informational purposes but do not create a synthetic 0-100 score.
-                results.append({'username': u.username, 'rank': found_rank + 1})
-        except Exception:
-            continue
-
-    # Prefer database-backed listen counts (play_count or total minutes) when
-    # available. We'll place users with a DB 'listens' metric at the top and
-    # compute ranks from that; fall back to the previously-computed 'rank'
-    # (derived from Spotify top-artist position) for the remaining users.
-    listened = [r for r in results if r.get('listens') is not None]
-    others = [r for r in results if r.get('listens') is None]
-
-    final = []
-    if listened:
-        # sort by listens desc and assign ranks starting at 1
-        listened.sort(key=lambda x: -x['listens'])
-        for i, r in enumerate(listened, start=1):
-            r['rank'] = i
-            # keep score for compatibility (higher is better)
-            r['score'] = r.get('score', r['listens'])
-            final.append(r)
-
-    if others:
-        # For users without DB-backed listens, treat score as 0 and keep their informational rank if available.
-        for r in others:
-            r['score'] = 0
-        # Sort remaining users by rank ascending (more relevant ranks first), and append after listened users
-        others.sort(key=lambda x: (x.get('rank') or 10**9))
-        offset = len(final)
-        for i, r in enumerate(others, start=1):
-            # assign ranks after listened users; if no informational rank, place at the end
-            orig_rank = r.get('rank') or (10**9)
-            r['rank'] = offset + i if orig_rank >= 10**9 else offset + orig_rank
-            final.append(r)
-
-    top10 = final[:10]
-    return JsonResponse({'results': top10})
+    Accepts either `artist_id` or `artist_name` as GET params, plus optional
+    `page` and `page_size`. Users from the current user's 'school' (inferred
+    from email domain) are ranked by their recorded plays of the artist.
+    """
+    data = _leaderboard_page(request)
+    return JsonResponse({'results': data['results'], 'page': data['page'], 'has_more': data['has_more']})
 
 # views.py
 from django.contrib.auth.decorators import login_required
@@ -1185,26 +993,8 @@ def get_messages(request, username):
 
 @login_required
 def leaderboard_page(request):
-    """Render a standalone leaderboard page for an artist. Accepts artist_id or artist_name as GET params.
-    Reuses leaderboard_results logic to compute results and passes them to a template.
-    """
-    artist_id = request.GET.get('artist_id')
-    artist_name = request.GET.get('artist_name')
-    # Reuse the results function to get JSON, but call logic inline to avoid extra HTTP
-    resp = leaderboard_results(request)
-    try:
-        data = resp.content
-        # resp is a JsonResponse; get the dict
-        import json as _json
-        parsed = _json.loads(data)
-    except Exception:
-        parsed = {'results': []}
-
-    return render(request, 'leaderboard.html', {
-        'artist_name': artist_name,
-        'artist_id': artist_id,
-        'results': parsed.get('results', [])
-    })
+    """Render a standalone leaderboard page for an artist. Accepts artist_id or artist_name and page as GET params."""
+    return render(request, 'leaderboard.html', _leaderboard_page(request))
 
 
 @login_required
@@ -1328,15 +1118,39 @@ def edit_bio(request):
     # Redirect back to profile with success flag
     return redirect(reverse('profile', args=[request.user.username]) + '?edit_success=1')
 
+def _current_track_etag(request):
+    # Kept on the request so the body is the same answer the ETag was computed from
+    request.now_playing = get_now_playing(request.user)
+    return request.now_playing.etag
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@etag(_current_track_etag)
 def get_current_track_endpoint(request):
-    track = get_current_track(request.user)
-    print(f"Debug: Endpoint returning: {track}")
-    return JsonResponse({
-        'track': track,
-        'success': True,
-        'timestamp': timezone.now().isoformat()
-    })
+    """Current track JSON; clients revalidating with an unchanged ETag get 304 Not Modified."""
+    return JsonResponse(request.now_playing.as_json())
+
+
+async def now_playing_stream(request):
+    """Server-Sent Events stream of the user's current track, pushed when it changes.
+
+    Only served through Matchify.asgi. Under WSGI it answers 204 No Content,
+    which tells EventSource not to reconnect, and the page polls instead.
+    """
+    user_id = await sync_to_async(lambda: request.user.pk if request.user.is_authenticated else None)()
+    if user_id is None:
+        return HttpResponse(status=401)
+    if not streaming_supported(request):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(
+        stream_events(user_id, request.headers.get('Last-Event-ID')),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
@@ -1623,37 +1437,6 @@ def react(request, post_id):
 
         return redirect('discussion')
 
-def calculate_compatibility(user1, user2):
-    try:
-        # Get top artists for both users
-        user1_artists = get_top_artists(user1, 'long_term')
-        user2_artists = get_top_artists(user2, 'long_term')
-
-        # If the helper returned an error dict, bail out
-        if isinstance(user1_artists, dict) or isinstance(user2_artists, dict):
-            return None
-
-        # Extract artist IDs
-        user1_artist_ids = set(artist.get('id') for artist in user1_artists if 'id' in artist)
-        user2_artist_ids = set(artist.get('id') for artist in user2_artists if 'id' in artist)
-
-        # Calculate common artists
-        common_artists = user1_artist_ids.intersection(user2_artist_ids)
-
-        # Calculate genre overlap
-        user1_genres = set(genre for artist in user1_artists for genre in artist.get('genres', []))
-        user2_genres = set(genre for artist in user2_artists for genre in artist.get('genres', []))
-        common_genres = user1_genres.intersection(user2_genres)
-
-        # Score components (each weighted to 50)
-        artist_score = (len(common_artists) / max(len(user1_artist_ids), 1)) * 50
-        genre_score = (len(common_genres) / max(len(user1_genres), 1)) * 50
-
-        total_score = round(artist_score + genre_score)
-        return min(total_score, 100)
-    except Exception:
-        # If anything goes wrong while calculating compatibility, return None
-        return None
 @login_required
 def get_connections(request):
     current_user = request.user
@@ -1758,7 +1541,7 @@ def search_track(request):
     try:
         url = 'https://api.spotify.com/v1/search'
         params = {'q': q, 'type': 'track', 'limit': 10}
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
+        resp = get_spotify_client().get(url, headers=headers, params=params)
         if resp.status_code != 200:
             return JsonResponse({'results': []})
         data = resp.json()
@@ -1784,61 +1567,44 @@ def swipe(request):
     return render(request, 'swipe.html')
 
 
-@login_required
-def api_swipe_next(request):
-    """Return a dummy candidate and compatibility for testing the frontend.
+def _deterministic_compat(a_username, b_username, low=15, high=92):
+    """Reproducible stand-in compatibility for pairs without usable Spotify data."""
+    import hashlib
+    key = f"{a_username}:{b_username}"
+    h = hashlib.md5(key.encode('utf-8')).hexdigest()
+    num = int(h[:8], 16)
+    total = low + (num % (high - low + 1))
+    # split into artist/genre/track weights 45/30/25
+    artist = round(total * 0.45, 1)
+    genre = round(total * 0.30, 1)
+    track = round(total * 0.25, 1)
+    # adjust rounding difference
+    diff = round(total - (artist + genre + track), 1)
+    if diff != 0:
+        # add the difference to artist
+        artist = round(artist + diff, 1)
+    return {
+        'total_score': float(total),
+        'breakdown': {
+            'artist_compatibility': float(artist),
+            'genre_compatibility': float(genre),
+            'track_compatibility': float(track)
+        },
+        'common_artists': [],
+        'common_genres': [],
+        'common_tracks': []
+    }
 
-    In the real app this would find the next unseen user and compute compatibility.
-    For now return a minimal JSON object including calibrated total_score.
-    """
-    from .compatibility import get_music_compatibility
-    User = get_user_model()
-    # choose a candidate (first non-self user not already seen by this session)
-    seen = request.session.get('seen_swipes', []) or []
-    candidates_qs = list(User.objects.exclude(id=request.user.id).exclude(is_superuser=True).exclude(username__in=seen))
-    candidate = None
+
+def _build_swipe_payload(viewer, candidate):
+    """Build the swipe card JSON for `candidate` as seen by `viewer`."""
     try:
-        if candidates_qs:
-            candidate = random.choice(candidates_qs)
+        compat = get_compatibility(viewer, candidate) or {}
     except Exception:
-        # Fallback to deterministic selection if random fails
-        candidate = User.objects.exclude(id=request.user.id).exclude(is_superuser=True).exclude(username__in=seen).first()
-    if not candidate:
-        return JsonResponse({'error': 'no_candidate'}, status=404)
-
-    # Attempt to compute compatibility; may return None or very low when no Spotify data.
-    compat = get_music_compatibility(request.user, candidate)
-    # If compatibility is missing or uninformative (<=10), create a deterministic fallback
-    if not compat or (isinstance(compat, dict) and compat.get('total_score', 0) <= 10.0):
-        # deterministic fallback based on the pair of usernames so it's reproducible
-        def _deterministic_compat(a_username, b_username, low=15, high=92):
-            import hashlib
-            key = f"{a_username}:{b_username}"
-            h = hashlib.md5(key.encode('utf-8')).hexdigest()
-            num = int(h[:8], 16)
-            total = low + (num % (high - low + 1))
-            # split into artist/genre/track weights 45/30/25
-            artist = round(total * 0.45, 1)
-            genre = round(total * 0.30, 1)
-            track = round(total * 0.25, 1)
-            # adjust rounding difference
-            diff = round(total - (artist + genre + track), 1)
-            if diff != 0:
-                # add the difference to artist
-                artist = round(artist + diff, 1)
-            return {
-                'total_score': float(total),
-                'breakdown': {
-                    'artist_compatibility': float(artist),
-                    'genre_compatibility': float(genre),
-                    'track_compatibility': float(track)
-                },
-                'common_artists': [],
-                'common_genres': [],
-                'common_tracks': []
-            }
-
-        compat = _deterministic_compat(request.user.username or '', candidate.username or '')
+        compat = {}
+    # If compatibility is missing or uninformative (<=10), use a deterministic fallback
+    if not compat or compat.get('total_score', 0) <= 10.0:
+        compat = _deterministic_compat(viewer.username or '', candidate.username or '')
 
     # Prepare richer music taste summary for the candidate
     try:
@@ -1888,12 +1654,12 @@ def api_swipe_next(request):
         for i, g in enumerate(compat.get('common_genres', [])[:10]):
             top_genres.append({'rank': i + 1, 'name': g})
 
-    payload = {
+    return {
         'user': {
             'username': candidate.username,
             'bio': getattr(getattr(candidate, 'profile', None), 'bio', '') or '',
             'avatar_initial': candidate.username[0].upper() if candidate.username else 'U',
-            'is_spotify_connected': extras.is_spotify_authenticated(candidate)
+            'is_spotify_connected': is_connected(candidate)
         },
         'top_artists': top_artists,
         'top_tracks': top_tracks,
@@ -1901,142 +1667,64 @@ def api_swipe_next(request):
         'compatibility': compat
     }
 
-    return JsonResponse(payload)
+
+SWIPE_MAX_PREFETCH = 10
+
+
+def _requested_prefetch(value):
+    """Number of extra cards a client asked for, clamped to 0..SWIPE_MAX_PREFETCH."""
+    try:
+        return min(max(int(value or 0), 0), SWIPE_MAX_PREFETCH)
+    except (TypeError, ValueError):
+        return 0
+
+
+@login_required
+def api_swipe_next(request):
+    """Return the next candidate from the user's swipe queue with their compatibility and top music.
+
+    With `?prefetch=K` the following K cards are returned too, as `prefetched`,
+    so the client can show them without waiting on the network.
+    """
+    cards = pop_cards(request.user, 1 + _requested_prefetch(request.GET.get('prefetch')))
+    if not cards:
+        return JsonResponse({'error': 'no_candidate'}, status=404)
+    return JsonResponse(dict(cards[0], prefetched=cards[1:]))
 
 
 @login_required
 def api_swipe_action(request):
-    """Accept swipe action (like/dislike) from frontend. Minimal implementation for testing."""
+    """Accept a swipe action (like/dislike) and return the next card in the same response."""
     try:
         data = json.loads(request.body.decode('utf-8'))
     except Exception:
         data = request.POST or {}
 
-    User = get_user_model()
     # Accept either frontend key `other_username` or `username` for compatibility
     action = data.get('action')
     username = data.get('other_username') or data.get('username')
     if not username or action not in ('like', 'dislike'):
         return JsonResponse({'success': False, 'error': 'invalid_payload'}, status=400)
 
-    # Persist the seen candidate in session so they won't be shown again
-    try:
-        seen = request.session.get('seen_swipes', []) or []
-        if username not in seen:
-            seen.append(username)
-            request.session['seen_swipes'] = seen
-            request.session.modified = True
-    except Exception:
-        # If session storage fails, proceed without blocking the user
-        pass
-
-    # TODO: persist likes to DB / create friendships if needed
-    # Attempt to provide the next candidate directly (avoid extra round-trip)
-    try:
-        seen = request.session.get('seen_swipes', []) or []
-        candidates_qs = list(User.objects.exclude(id=request.user.id).exclude(is_superuser=True).exclude(username__in=seen))
-        next_candidate = None
-        if candidates_qs:
-            next_candidate = random.choice(candidates_qs)
-    except Exception:
-        next_candidate = User.objects.exclude(id=request.user.id).exclude(is_superuser=True).exclude(username__in=seen).first()
-
-    if not next_candidate:
-        return JsonResponse({'success': True, 'action': action, 'username': username, 'next': None})
-
-    # If the user 'liked' this candidate, create a FriendRequest if one doesn't already exist
-    if action == 'like':
+    # One lookup also tells whether they liked us back or are already friends
+    to_user = with_swipe_state(get_user_model().objects.filter(username=username), request.user).first()
+    match = False
+    if to_user and to_user != request.user:
+        # Recorded so this user isn't offered again; a like sends a friend request,
+        # or makes them friends straight away if they already liked this user
         try:
-            to_user = get_user_model().objects.filter(username=username).first()
-            if to_user and to_user != request.user:
-                # Don't create if already friends
-                already_friends = Friendship.objects.filter(
-                    Q(user1=request.user, user2=to_user) | Q(user1=to_user, user2=request.user)
-                ).exists()
-                if not already_friends:
-                    # Don't create duplicate friend requests
-                    if not FriendRequest.objects.filter(from_user=request.user, to_user=to_user).exists():
-                        FriendRequest.objects.create(from_user=request.user, to_user=to_user)
-        except Exception:
-            # Ignore failures here; the swipe action should still succeed even if friend request creation fails
-            pass
-
-    from .compatibility import get_music_compatibility, get_music_taste_summary
-    try:
-        compat = get_music_compatibility(request.user, next_candidate) or {}
-    except Exception:
-        compat = {}
-
-    # If compat is missing or too low, produce deterministic fallback like api_swipe_next
-    try:
-        if not compat or (isinstance(compat, dict) and compat.get('total_score', 0) <= 10.0):
-            import hashlib
-            def _deterministic_compat_pair(a,b, low=15, high=92):
-                key = f"{a}:{b}"
-                h = hashlib.md5(key.encode('utf-8')).hexdigest()
-                num = int(h[:8], 16)
-                total = low + (num % (high - low + 1))
-                artist = round(total * 0.45, 1)
-                genre = round(total * 0.30, 1)
-                track = round(total * 0.25, 1)
-                diff = round(total - (artist + genre + track), 1)
-                if diff != 0:
-                    artist = round(artist + diff, 1)
-                return {
-                    'total_score': float(total),
-                    'breakdown': {
-                        'artist_compatibility': float(artist),
-                        'genre_compatibility': float(genre),
-                        'track_compatibility': float(track)
-                    },
-                    'common_artists': [],
-                    'common_genres': [],
-                    'common_tracks': []
-                }
-
-            compat = _deterministic_compat_pair(request.user.username or '', next_candidate.username or '')
-    except Exception:
-        pass
-
-    try:
-        taste = get_music_taste_summary(next_candidate) or {}
-    except Exception:
-        taste = {}
-
-    top_artists = []
-    top_tracks = []
-    top_genres = []
-
-    if taste:
-        for i, a in enumerate(taste.get('top_artists', [])[:10]):
-            top_artists.append({'rank': i + 1, 'name': a.get('name'), 'popularity': a.get('popularity') if isinstance(a.get('popularity'), (int, float)) else None, 'id': a.get('id') if isinstance(a, dict) and a.get('id') else None, 'image': a.get('image') if isinstance(a, dict) and a.get('image') else None})
-        for i, t in enumerate(taste.get('top_tracks', [])[:10]):
-            top_tracks.append({'rank': i + 1, 'name': t.get('name'), 'artists': t.get('artists', []), 'popularity': t.get('popularity') if isinstance(t.get('popularity'), (int, float)) else None, 'id': t.get('id') if isinstance(t, dict) and t.get('id') else None})
-        for i, g in enumerate(taste.get('top_genres', [])[:10]):
-            if isinstance(g, dict):
-                name = g.get('genre') or g.get('name')
-            else:
-                name = str(g)
-            top_genres.append({'rank': i + 1, 'name': name})
-    else:
-        for i, a in enumerate(compat.get('common_artists', [])[:10]):
-            top_artists.append({'rank': i + 1, 'name': a.get('name') if isinstance(a, dict) else str(a), 'id': a.get('id') if isinstance(a, dict) else None})
-        for i, t in enumerate(compat.get('common_tracks', [])[:10]):
-            top_tracks.append({'rank': i + 1, 'name': t.get('name') if isinstance(t, dict) else str(t), 'artists': t.get('artists', []) if isinstance(t, dict) else []})
-        for i, g in enumerate(compat.get('common_genres', [])[:10]):
-            top_genres.append({'rank': i + 1, 'name': g})
-
-    payload = {
-        'user': {
-            'username': next_candidate.username,
-            'bio': getattr(getattr(next_candidate, 'profile', None), 'bio', '') or '',
-            'avatar_initial': next_candidate.username[0].upper() if next_candidate.username else 'U',
-            'is_spotify_connected': extras.is_spotify_authenticated(next_candidate)
-        },
-        'top_artists': top_artists,
-        'top_tracks': top_tracks,
-        'genres': [g['name'] for g in top_genres],
-        'compatibility': compat
-    }
+            match = record_decision(request.user, to_user, action)
+        except Exception as e:
+            # The swipe itself should still succeed and move on to the next card
+            logger.error(f"Could not record swipe by {request.user.username} on {username}: {e}")
 
-    return JsonResponse({'success': True, 'action': action, 'username': username, 'next': payload})
\ No newline at end of file
+    # Provide the next candidate directly (avoid extra round-trip), plus `prefetch` more if asked
+    cards = pop_cards(request.user, 1 + _requested_prefetch(data.get('prefetch')))
+    return JsonResponse({
+        'success': True,
+        'action': action,
+        'username': username,
+        'match': match,
+        'next': cards[0] if cards else None,
+        'prefetched': cards[1:],
+    })
\ No newline at end of file
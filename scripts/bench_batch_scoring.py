@@ -0,0 +1,92 @@
+"""Compare pairwise vs batch compatibility scoring on synthetic users.
+
+Usage: python scripts/bench_batch_scoring.py [n_users]
+
+Scores one user against every other user (the find-matches case) with the
+pairwise MusicMatchingAlgorithm helpers and with BatchScorer, both for every
+candidate and for a top-10 match list, then checks the results agree. The
+stored score calibration is replaced by the built-in default mapping, so no
+database access is needed.
+"""
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Matchify.settings')
+import django
+django.setup()
+
+from Matchifyapp import score_calibration
+from Matchifyapp.batch_scoring import BatchScorer
+from Matchifyapp.compatibility import MusicMatchingAlgorithm
+
+# Default (uncalibrated) mapping instead of the newest ScoreCalibration row
+_default_calibration = score_calibration.Calibration()
+score_calibration.get_calibration = lambda: _default_calibration
+
+n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+rng = random.Random(42)
+genres = [f'genre-{i}' for i in range(400)]
+# Skewed popularity so some artists/tracks are shared by many users
+artist_pool = [f'artist-{int(rng.paretovariate(1.2) * 10) % 20000}' for _ in range(60000)]
+track_pool = [f'track-{int(rng.paretovariate(1.2) * 10) % 80000}' for _ in range(200000)]
+artist_genres = {}
+
+
+def ranked(pool, n):
+    out = []
+    seen = set()
+    while len(out) < n:
+        item = rng.choice(pool)
+        if item not in seen:
+            seen.add(item)
+            out.append(item)
+    return out
+
+
+data = {}
+for user_id in range(n_users):
+    artists = []
+    for aid in ranked(artist_pool, 50):
+        g = artist_genres.setdefault(aid, rng.sample(genres, rng.randint(0, 4)))
+        artists.append({'id': aid, 'name': aid, 'genres': g, 'popularity': 50})
+    tracks = [{'id': tid, 'name': tid, 'artists': [], 'popularity': 50} for tid in ranked(track_pool, 50)]
+    data[user_id] = {'artists': artists, 'tracks': tracks}
+
+algorithm = MusicMatchingAlgorithm()
+user_id = 0
+candidates = [u for u in data if u != user_id]
+
+started = time.perf_counter()
+pairwise = {b: algorithm.score_music_data(data[user_id], data[b])[1] for b in candidates}
+pairwise_s = time.perf_counter() - started
+
+started = time.perf_counter()
+scorer = BatchScorer(data)
+encode_s = time.perf_counter() - started
+
+started = time.perf_counter()
+batch = dict(scorer.score_candidates(user_id, candidates, include_common=False))
+batch_s = time.perf_counter() - started
+
+started = time.perf_counter()
+top = scorer.score_candidates(user_id, candidates, limit=10, include_common=True)
+top_s = time.perf_counter() - started
+expected_top = sorted(pairwise.items(), key=lambda x: x[1]['total_score'], reverse=True)[:10]
+
+mismatches = sum(
+    1 for b in candidates
+    if batch[b]['total_score'] != pairwise[b]['total_score'] or batch[b]['breakdown'] != pairwise[b]['breakdown']
+)
+print(f"users={n_users}")
+print(f"pairwise loop:  {pairwise_s:.3f}s")
+print(f"batch encode:   {encode_s:.3f}s (once per rebuild)")
+print(f"batch scoring:  {batch_s:.3f}s  ({pairwise_s / batch_s:.0f}x faster)")
+print(f"batch top-10:   {top_s:.3f}s  ({pairwise_s / top_s:.0f}x faster)")
+print(f"score mismatches: {mismatches}")
+print(f"top-10 scores agree: {[r['total_score'] for _, r in top] == [r['total_score'] for _, r in expected_top]}")